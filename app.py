@@ -1,48 +1,69 @@
 import sqlite3
+import calendar
 import markdown
 import bleach
 import os
 import requests
-import tempfile
 import secrets
+import gzip
+import hashlib
+import mimetypes
+import shutil
+import tempfile
+import threading
+import fcntl
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import date, datetime
 from functools import wraps
-from werkzeug.security import check_password_hash
+from werkzeug.security import check_password_hash, safe_join
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, url_for, flash, redirect, session, send_from_directory
+from flask import Flask, Request, render_template, request, url_for, flash, redirect, session, send_from_directory, g, has_app_context, stream_with_context
 from werkzeug.exceptions import abort
-from markupsafe import Markup
+from markupsafe import Markup, escape
 from dotenv import load_dotenv
-from PIL import Image, ImageOps
-from PIL.ExifTags import TAGS
 import math
 import json
-import yaml
 from datetime import datetime, timezone, timedelta
+from urllib.parse import quote
+from html import unescape
 import re
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_wtf.csrf import CSRFProtect
 from pillow_heif import register_heif_opener
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+from image_processing import create_content_addressed_versions, IMAGE_FORMATS
+from migrate import pending_migrations
+import queries
+from storage import (
+    config,
+    get_int_config,
+    open_db_connection,
+    image_versions_for,
+    record_image_versions,
+    regenerated_variant_paths,
+    variant_filename,
+    IMAGE_VARIANTS,
+    IMAGE_WORKERS,
+    UPLOAD_FOLDER,
+    DATABASE
+)
 from mastodon import Mastodon
 
+# brotli precompression of static files is optional
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 # load environment variables
 load_dotenv()
 
 
-# load configs
-def load_config():
-    try:
-        with open('config.yaml', 'r') as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
-        print("config.yaml not found, using defaults")
-        return {}
-
-
 app = Flask(__name__)
-config = load_config()
 
 
 # Session configuration - expires after 1 week
@@ -69,55 +90,177 @@ limiter = Limiter(
 )
 
 
-# application settings - ensure numeric values are integers
-def get_int_config(key, default):
-    """get config value as integer, handling string values from YAML"""
-    value = config.get(key, default)
-    if value is None:
-        return default
-    
-    # if it's already an integer, return it
-    if isinstance(value, int):
-        return value
-    
-    # if it's a string, try to convert it
-    if isinstance(value, str):
-        try:
-            # handle expressions like "16 * 1024 * 1024"
-            if '*' in value or '+' in value or '-' in value:
-                # only evaluate simple arithmetic expressions for safety
-                if all(c in '0123456789 +-*()' for c in value):
-                    return int(eval(value))
-            else:
-                return int(value)
-        except (ValueError, SyntaxError):
-            print(f"Warning: Could not parse config value '{key}': {value}, using default: {default}")
-            return default
-    
-    return default
-
 # more configs
-UPLOAD_FOLDER = config.get('upload_folder', 'uploads')
-OPTIMIZED_FOLDER = config.get('optimized_folder', 'uploads/optimized')
 ALLOWED_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'webp','heic', 'heif']
 MAX_CONTENT_LENGTH = get_int_config('max_content_length', 300 * 1024 * 1024)
 POSTS_PER_PAGE = get_int_config('posts_per_page', 15)
-OPTIMIZED_WIDTH = get_int_config('optimized_width', 1200)
-WEBRING_SMALL_FOLDER = config.get('webring_small_folder', 'uploads/webring_small')
-WEBRING_TINY_FOLDER = config.get('webring_tiny_folder', 'uploads/webring_tiny')
-WEBRING_SMALL_WIDTH = get_int_config('webring_small_width', 960)
-WEBRING_TINY_WIDTH = get_int_config('webring_tiny_width', 256)
+PENDING_FOLDER = config.get('pending_folder', 'uploads/pending')  # uploads waiting for the image worker
+IMAGE_WORKER_POLL_INTERVAL = get_int_config('image_worker_poll_interval', 30)  # seconds
+IMAGE_CLAIM_TIMEOUT = get_int_config('image_claim_timeout', 10 * 60)  # seconds before a claimed image is assumed abandoned
 IMAGES_PER_PAGE = get_int_config('images_per_page', 30)
+SEARCH_RESULTS_PER_PAGE = get_int_config('search_results_per_page', 20)
+SEARCH_MAX_TERMS = get_int_config('search_max_terms', 10)  # words of a query that are used
+MARKDOWN_CACHE_SIZE = get_int_config('markdown_cache_size', 1000)  # rendered posts kept in memory
+RESPONSE_CACHE = bool(config.get('response_cache', True))  # cache pages for logged out visitors
+RESPONSE_CACHE_FOLDER = config.get('response_cache_folder', 'cache/pages')
+RESPONSE_CACHE_MAX_ENTRIES = get_int_config('response_cache_max_entries', 5000)  # per page group
+RESPONSE_CACHE_PURGE_LOG = 1000  # purges remembered, older entries are rendered again
+STATIC_EXPORT_FOLDER = config.get('static_export_folder') or None  # re-exported on writes when set
+SITE_URL = config.get('site_url', 'http://localhost')  # for absolute links in exported feeds and cross-posts
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# start the image worker and mastodon dispatcher threads on the first request.
+# export_static.py turns this off, so a one-off export renders pages without them
+app.config['BACKGROUND_WORKERS'] = True
+
+
+# how uploads and image variants are sent: 'flask' streams them from python,
+# 'x-accel-redirect' (nginx) and 'x-sendfile' (apache, lighttpd) only resolve
+# the file and let the web server send it
+UPLOAD_SERVING = config.get('upload_serving', 'flask')
+UPLOAD_ACCEL_PREFIX = config.get('upload_accel_prefix', '/_protected')  # internal nginx location for the app folder
+UPLOAD_MAX_AGE = get_int_config('upload_max_age', 365 * 24 * 60 * 60)  # seconds, filenames are random so never change
+if UPLOAD_SERVING not in ('flask', 'x-accel-redirect', 'x-sendfile'):
+    print(f"Warning: unknown upload_serving '{UPLOAD_SERVING}', using flask")
+    UPLOAD_SERVING = 'flask'
+app.config['USE_X_SENDFILE'] = UPLOAD_SERVING == 'x-sendfile'
+STATIC_MAX_AGE = get_int_config('static_max_age', 365 * 24 * 60 * 60)  # seconds, for fingerprinted static urls
+PRECOMPRESS_STATIC = bool(config.get('precompress_static', True))  # write .gz/.br copies of css and js at startup
 
 
 # create upload directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OPTIMIZED_FOLDER, exist_ok=True)
-os.makedirs(WEBRING_SMALL_FOLDER, exist_ok=True)
-os.makedirs(WEBRING_TINY_FOLDER, exist_ok=True)
+for variant in IMAGE_VARIANTS.values():
+    os.makedirs(variant['folder'], exist_ok=True)
+os.makedirs(PENDING_FOLDER, exist_ok=True)
+
+
+# uploaded files are spooled straight into the pending folder, so they can be
+# moved into place with a rename instead of copied out of a temporary file
+UPLOAD_SPOOL_PREFIX = '.upload-'
+
+
+class UploadRequest(Request):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_spool_paths = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile(
+            dir=PENDING_FOLDER, prefix=UPLOAD_SPOOL_PREFIX, suffix='.part', delete=False
+        )
+        self.upload_spool_paths.append(stream.name)
+        return stream
+
+
+app.request_class = UploadRequest
+
+
+@app.teardown_request
+def remove_unused_uploads(exception):
+    """delete spooled uploads that weren't moved into place (rejected, or the request failed)"""
+    for path in getattr(request, 'upload_spool_paths', ()):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# static assets. urls from url_for('static', ...) get a ?v=<content hash>
+# so they can be cached for a year and still change on deploy, and text
+# assets are precompressed once instead of on every request.
+STATIC_COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.xml')
+STATIC_ENCODINGS = [('gzip', '.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+if brotli is not None:
+    STATIC_ENCODINGS.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+_static_hashes = {}
+
+
+def static_file_hash(filename):
+    """short content hash of a static file, recomputed when the file changes"""
+    path = safe_join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+    cached = _static_hashes.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()[:12]
+    _static_hashes[filename] = (mtime, file_hash)
+    return file_hash
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        file_hash = static_file_hash(values['filename'])
+        if file_hash:
+            values['v'] = file_hash
+
+
+def precompress_static_files():
+    """write .gz (and .br, with the optional brotli package) next to text assets that changed"""
+    for root, _, filenames in os.walk(app.static_folder):
+        for filename in filenames:
+            if not filename.endswith(STATIC_COMPRESSIBLE):
+                continue
+            path = os.path.join(root, filename)
+            data = None
+            for _, suffix, compress in STATIC_ENCODINGS:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                # several server processes may do this at once, so replace atomically
+                fd, temp_path = tempfile.mkstemp(dir=root, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(compress(data))
+                    os.replace(temp_path, target)
+                except OSError as e:
+                    print(f"error precompressing {path}: {e}")
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+
+if PRECOMPRESS_STATIC:
+    precompress_static_files()
+
+
+def static_file(filename):
+    """
+    serve a static file, precompressed when the browser accepts it. fingerprinted
+    urls never change content, so they're cached for STATIC_MAX_AGE.
+    """
+    response = None
+    if filename.endswith(STATIC_COMPRESSIBLE):
+        for encoding, suffix, _ in STATIC_ENCODINGS:
+            path = safe_join(app.static_folder, filename + suffix)
+            if request.accept_encodings[encoding] and path and os.path.isfile(path):
+                response = send_from_directory(
+                    app.static_folder, filename + suffix,
+                    mimetype=mimetypes.guess_type(filename)[0]
+                )
+                response.content_encoding = encoding
+                break
+        response = response or send_from_directory(app.static_folder, filename)
+        response.vary.add('Accept-Encoding')
+    else:
+        response = send_from_directory(app.static_folder, filename)
+    if request.args.get('v'):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+app.view_functions['static'] = static_file
 
 
 # journal info variables for templates
@@ -129,6 +272,130 @@ def inject_blog_config():
     }
 
 
+def served_variant(image, variant):
+    """
+    the version image_url(image, variant) points to: the variant, or the
+    original when the variant failed to encode (it's missing from the
+    recorded versions) until regenerate_variants.py makes it. images
+    processed before versions were recorded have none, and keep their variants.
+    """
+    if variant == 'original':
+        return variant
+    recorded = get_recorded_versions(image['filename'])
+    if recorded and variant not in recorded:
+        return 'original'
+    return variant
+
+
+@app.template_global()
+def image_url(image, variant='optimized', **kwargs):
+    """
+    url for a variant of a post image, or 'original' for the full-size upload.
+    None until the background worker has stored the image: the upload is
+    still in the pending folder under a name it won't be served as.
+    """
+    if image['status'] != 'ready':
+        return None
+    variant = served_variant(image, variant)
+    if variant == 'original':
+        return url_for('uploaded_file', filename=image['filename'], **kwargs)
+    return url_for('variant_file', variant=variant, filename=stored_variant_filename(image, variant), **kwargs)
+
+
+def stored_variant_filename(image, variant):
+    """the file of an image's variant: the one recorded if it was remade under a new name, or the default"""
+    info = get_recorded_versions(image['filename']).get(variant)
+    if info and info[3]:
+        return info[3]
+    return variant_filename(IMAGE_VARIANTS[variant], image['filename'])
+
+
+def image_srcset_for(image, image_format, largest):
+    """
+    srcset of an image's variants in one format, no wider than the largest
+    variant. only versions recorded in image_versions are listed (images
+    processed before a profile was added don't have its files), with their
+    actual width, which is smaller than the profile's for narrow originals.
+    """
+    max_width = IMAGE_VARIANTS[largest]['width']
+    recorded = get_recorded_versions(image['filename'])
+    entries = {}
+    for variant in IMAGE_VARIANTS.values():
+        info = recorded.get(variant['name'])
+        if info and variant['format'] == image_format and variant['width'] <= max_width:
+            # several profiles wider than the original give the same width, list it once
+            entries.setdefault(info[0], image_url(image, variant['name']))
+    return ', '.join(f"{url} {width}w" for width, url in entries.items())
+
+
+@app.template_global()
+def image_srcset(image, largest='optimized'):
+    """srcset of an image's jpeg variants, for the <img> fallback"""
+    if image['status'] != 'ready':
+        return ''
+    return image_srcset_for(image, 'jpeg', largest)
+
+
+@app.template_global()
+def image_sources(image, largest='optimized'):
+    """
+    <source> type/srcset pairs for an image's non-jpeg variants,
+    so browsers that support modern formats can pick them in a <picture>
+    """
+    if image['status'] != 'ready':
+        return []
+    formats = []
+    for variant in IMAGE_VARIANTS.values():
+        if variant['format'] != 'jpeg' and variant['format'] not in formats:
+            formats.append(variant['format'])
+    sources = []
+    for image_format in formats:
+        srcset = image_srcset_for(image, image_format, largest)
+        if srcset:
+            sources.append({'type': IMAGE_FORMATS[image_format]['mime_type'], 'srcset': srcset})
+    return sources
+
+
+@app.template_global()
+def image_dimensions(image, variant='optimized'):
+    """
+    (width, height) of the file image_url(image, variant) points to, worked
+    out from the original's recorded size, or None if it isn't known yet
+    """
+    if not image['width'] or not image['height']:
+        return None
+    width, height = image['width'], image['height']
+    if image['status'] != 'ready' or served_variant(image, variant) == 'original':
+        return width, height
+    max_width = IMAGE_VARIANTS[variant]['width']
+    if width <= max_width:
+        return width, height
+    return max_width, int(height * (max_width / width))
+
+
+@app.template_global()
+def lightbox_variants(image):
+    """
+    url, size and type of each of an image's variants, smallest first, so
+    the lightbox can pick one to fit the screen instead of the original
+    """
+    if image['status'] != 'ready':
+        return []
+    recorded = get_recorded_versions(image['filename'])
+    variants = []
+    for variant in IMAGE_VARIANTS.values():
+        info = recorded.get(variant['name'])
+        if not info:
+            continue
+        variants.append({
+            'url': image_url(image, variant['name']),
+            'width': info[0],
+            'height': info[1],
+            'type': IMAGE_FORMATS[variant['format']]['mime_type'],
+        })
+    return sorted(variants, key=lambda variant: variant['width'])
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -160,159 +427,69 @@ def generate_random_filename(original_filename, post_date):
     return f"{date_str}_{random_string}{ext.lower()}"
 
 
-def strip_image_metadata(image_path, output_path):
-    """
-    strip metadata from image and save to output path
-    converts HEIC/HEIF to JPEG for web compatibility
-    """
-    try:
-        with Image.open(image_path) as img:
-            img = ImageOps.exif_transpose(img)  # apply EXIF rotation before anything else
-            # convert to RGB for consistency and web compatibility
-            # this handles HEIC, PNG with transparency, etc.
-            if img.mode in ('RGBA', 'LA', 'P'):
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                # create white background for transparent images
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'RGBA':
-                    background.paste(img, mask=img.split()[-1])
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # save as JPEG without any EXIF data (works for all input formats)
-            img.save(output_path, 'JPEG', quality=95, optimize=True, exif=b"")
-            return True
-    except Exception as e:
-        print(f"error stripping metadata from image: {e}")
-        return False
+# processed images are stored content-addressed: the original and its
+# variants are named after the hash of the picture, so a photo that is
+# uploaded again shares the files already on disk (see image_blobs in
+# migrations/0009_image_blobs.sql)
+BLOB_FILENAME_TEMPLATE = '{hash}.jpg'
+
+
+def blob_filename(content_hash):
+    return BLOB_FILENAME_TEMPLATE.replace('{hash}', content_hash)
 
 
-def optimize_image(input_path, output_path, max_width=OPTIMIZED_WIDTH):
+def create_blob_versions(source_path):
     """
-    optimize image by resizing it to max_width while maintaining aspect ratio
-    and strip all metadata. handles all formats including HEIC/HEIF.
+    create the original and all variant profiles of an upload under its
+    content hash, skipping any that already exist. returns (content hash,
+    dict of name -> (width, height, bytes) or None, whether it was a
+    duplicate, placeholder data uri).
     """
-    try:
-        with Image.open(input_path) as img:
-            img = ImageOps.exif_transpose(img)  # apply EXIF rotation before anything else
-            # convert to RGB if necessary (for JPEGs)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                # convert palette or transparency to RGB
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                # create white background for transparent images
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'RGBA':
-                    background.paste(img, mask=img.split()[-1])
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # calculate new dimensions
-            width, height = img.size
-            if width > max_width:
-                ratio = max_width / width
-                new_height = int(height * ratio)
-                img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-            # save optimized image without any EXIF data
-            img.save(output_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            return True
-    except Exception as e:
-        print(f"error optimizing image: {e}")
-        return False
+    return create_content_addressed_versions(source_path, image_versions_for(BLOB_FILENAME_TEMPLATE))
 
 
-def create_all_image_versions(temp_path, base_filename):
+def get_db_connection():
     """
-    create all required image versions from temporary upload.
-    returns dict with success status for each version.
-    opens image once and reuses for better performance.
+    get the database connection for the current request, opening it on first use.
+    it is closed in teardown, so callers should not close it themselves.
+    outside of an app context (scripts, background work) a new connection
+    is returned and the caller is responsible for closing it.
     """
-    results = {
-        'original': False,
-        'opt_1200': False,
-        'webring_small': False,
-        'webring_tiny': False
-    }
-
+    if not has_app_context():
+        return open_db_connection()
+    if 'db' not in g:
+        g.db = open_db_connection()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db_connection(exception):
+    """close the request's database connection, discarding uncommitted work"""
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
+
+def warn_pending_migrations():
+    """remind whoever is deploying to run migrate.py if the schema is behind"""
+    if not os.path.exists(DATABASE):
+        return
+    conn = open_db_connection()
     try:
-        # open image once and apply rotation
-        with Image.open(temp_path) as img:
-            img = ImageOps.exif_transpose(img)
-
-            # convert to RGB for consistency
-            if img.mode in ('RGBA', 'LA', 'P'):
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'RGBA':
-                    background.paste(img, mask=img.split()[-1])
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # save original (metadata stripped)
-            original_path = os.path.join(UPLOAD_FOLDER, base_filename)
-            img.save(original_path, 'JPEG', quality=95, optimize=True, exif=b"")
-            results['original'] = True
-
-            # 1200px optimized
-            optimized_filename = f"opt_{base_filename}"
-            optimized_path = os.path.join(OPTIMIZED_FOLDER, optimized_filename)
-            width, height = img.size
-            if width > OPTIMIZED_WIDTH:
-                ratio = OPTIMIZED_WIDTH / width
-                new_height = int(height * ratio)
-                img_1200 = img.resize((OPTIMIZED_WIDTH, new_height), Image.Resampling.LANCZOS)
-                img_1200.save(optimized_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            else:
-                img.save(optimized_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            results['opt_1200'] = True
-
-            # webring small version
-            webring_small_path = os.path.join(WEBRING_SMALL_FOLDER, base_filename)
-            if width > WEBRING_SMALL_WIDTH:
-                ratio = WEBRING_SMALL_WIDTH / width
-                new_height = int(height * ratio)
-                img_small = img.resize((WEBRING_SMALL_WIDTH, new_height), Image.Resampling.LANCZOS)
-                img_small.save(webring_small_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            else:
-                img.save(webring_small_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            results['webring_small'] = True
-
-            # webring tiny thumbnail
-            webring_tiny_path = os.path.join(WEBRING_TINY_FOLDER, base_filename)
-            if width > WEBRING_TINY_WIDTH:
-                ratio = WEBRING_TINY_WIDTH / width
-                new_height = int(height * ratio)
-                img_tiny = img.resize((WEBRING_TINY_WIDTH, new_height), Image.Resampling.LANCZOS)
-                img_tiny.save(webring_tiny_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            else:
-                img.save(webring_tiny_path, 'JPEG', quality=85, optimize=True, exif=b"")
-            results['webring_tiny'] = True
+        pending = pending_migrations(conn)
+    finally:
+        conn.close()
+    if pending:
+        names = ', '.join(f"{version:04d}_{name}" for version, name, _ in pending)
+        print(f"warning: database has pending migrations ({names}), run `python migrate.py`")
 
-    except Exception as e:
-        print(f"error creating image versions: {e}")
-        import traceback
-        traceback.print_exc()
 
-    return results
-
-
-def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+warn_pending_migrations()
 
 
 def get_post_by_date(post_date):
     conn = get_db_connection()
-    post = conn.execute('SELECT * FROM posts WHERE post_date = ?',
-                        (post_date,)).fetchone()
-    conn.close()
+    post = conn.execute(queries.POST_BY_DATE, (post_date,)).fetchone()
     if post is None:
         abort(404)
     return post
@@ -322,7 +499,6 @@ def get_post_by_id(post_id):
     conn = get_db_connection()
     post = conn.execute('SELECT * FROM posts WHERE id = ?',
                         (post_id,)).fetchone()
-    conn.close()
     if post is None:
         abort(404)
     return post
@@ -331,17 +507,174 @@ def get_post_by_id(post_id):
 def get_post_images(post_id):
     """get all images for a post, ordered by sort_order"""
     conn = get_db_connection()
-    images = conn.execute(
-        'SELECT * FROM post_images WHERE post_id = ? ORDER BY sort_order, id',
-        (post_id,)
-    ).fetchall()
-    conn.close()
+    images = conn.execute(queries.POST_IMAGES, (post_id,)).fetchall()
+    load_recorded_versions([image['filename'] for image in images])
     return images
 
 
-def process_uploaded_images(request, post_date):
-    """process multiple uploaded images and return list of processed filenames and alt texts"""
-    processed_images = []
+def get_images_for_posts(post_ids):
+    """
+    get images for many posts in a single query.
+    returns dict of post_id -> list of images, ordered by sort_order, id
+    """
+    images_by_post = {post_id: [] for post_id in post_ids}
+    if not images_by_post:
+        return images_by_post
+
+    conn = get_db_connection()
+    images = conn.execute(queries.images_of_posts(len(images_by_post)), list(images_by_post)).fetchall()
+
+    for image in images:
+        images_by_post[image['post_id']].append(image)
+    load_recorded_versions([image['filename'] for image in images])
+    return images_by_post
+
+
+def get_version_sizes(filenames, version):
+    """bytes of one version of many stored images, as a dict of filename -> bytes"""
+    if not filenames:
+        return {}
+    rows = get_db_connection().execute(
+        queries.version_sizes(len(filenames)), [version, *filenames]
+    ).fetchall()
+    return {row['filename']: row['bytes'] for row in rows}
+
+
+def get_recorded_versions(filename):
+    """
+    {version: (width, height, bytes, file)} of the files recorded for a
+    stored image, where file is None for the default filename (see
+    stored_variant_filename). looked up once per request, pages load them for all their images
+    at once with load_recorded_versions.
+    """
+    recorded = g.setdefault('recorded_versions', {})
+    if filename not in recorded:
+        load_recorded_versions([filename])
+    return recorded[filename]
+
+
+def load_recorded_versions(filenames):
+    """fetch the recorded versions of many stored images in one query, for get_recorded_versions"""
+    recorded = g.setdefault('recorded_versions', {})
+    missing = list({filename for filename in filenames if filename not in recorded})
+    if not missing:
+        return
+    for filename in missing:
+        recorded[filename] = {}
+    rows = get_db_connection().execute(queries.recorded_versions(len(missing)), missing).fetchall()
+    for row in rows:
+        recorded[row['filename']][row['version']] = (row['width'], row['height'], row['bytes'], row['file'])
+
+
+def image_enclosure(image, sizes, variant='optimized'):
+    """
+    type and length of image_url(image, variant) of a ready image, for rss
+    enclosures. sizes holds the variant's recorded bytes per filename.
+    """
+    if served_variant(image, variant) == 'original':
+        original = get_recorded_versions(image['filename']).get('original')
+        return {'type': IMAGE_FORMATS['jpeg']['mime_type'], 'length': original[2] if original else 0}
+    return {
+        'type': IMAGE_FORMATS[IMAGE_VARIANTS[variant]['format']]['mime_type'],
+        'length': sizes.get(image['filename'], 0)
+    }
+
+
+def attach_post_images(posts):
+    """return posts as dicts with an 'images' list, loaded in one query"""
+    images_by_post = get_images_for_posts([post['id'] for post in posts])
+    posts_with_images = []
+    for post in posts:
+        post_dict = dict(post)
+        post_dict['images'] = images_by_post[post['id']]
+        posts_with_images.append(post_dict)
+    return posts_with_images
+
+
+def get_site_stat(key):
+    """a listing total from site_stats (kept up to date by triggers, see migrations/0003_site_stats.sql)"""
+    row = get_db_connection().execute(queries.SITE_STAT, (key,)).fetchone()
+    return row['value'] if row else 0
+
+
+def fetch_keyset_page(conn, select, conditions, params, order_columns, per_page,
+                      before=None, after=None, page=None):
+    """
+    fetch one page of rows from select (a query without WHERE or ORDER BY),
+    listed newest first by order_columns.
+    pages are addressed by cursor, a tuple of order column values, so deep
+    pages cost the same as the first one: before=cursor lists the rows older
+    than it, after=cursor the rows newer than it, and after=() the oldest page.
+    page=n (OFFSET paging) is still accepted for old links.
+    returns (rows, has_newer, has_older).
+    """
+    def query(compare, cursor, newest_first, limit, offset=0):
+        sql = queries.keyset_page(select, conditions, order_columns, compare, descending=newest_first)
+        return conn.execute(sql, [*params, *cursor, limit, offset]).fetchall()
+
+    if after is not None:
+        if after:
+            rows = query('>', after, False, per_page)[::-1]
+        else:
+            rows = query(None, (), False, per_page)[::-1]
+    elif before is not None:
+        rows = query('<', before, True, per_page)
+    else:
+        offset = (max(page or 1, 1) - 1) * per_page
+        rows = query(None, (), True, per_page, offset)
+
+    if not rows:
+        return rows, False, False
+
+    def cursor_of(row):
+        return tuple(row[column.split('.')[-1]] for column in order_columns)
+
+    has_newer = bool(query('>', cursor_of(rows[0]), False, 1))
+    has_older = bool(query('<', cursor_of(rows[-1]), True, 1))
+    return rows, has_newer, has_older
+
+
+def build_pagination(endpoint, rows, cursor, has_newer, has_older, total, total_pages, page, is_first):
+    """
+    pagination object for pagination.html. cursor turns a row into its
+    cursor string. the page number is only known for the first page and
+    for old ?page= links.
+    """
+    if is_first:
+        page = page or 1
+    return {
+        'endpoint': endpoint,
+        'page': page,
+        'total_pages': total_pages,
+        'has_prev': has_newer,
+        'has_next': has_older,
+        'prev_cursor': cursor(rows[0]) if rows else None,
+        'next_cursor': cursor(rows[-1]) if rows else None,
+        'total': total
+    }
+
+
+def move_upload(file, destination):
+    """
+    move an uploaded file to destination. files spooled into PENDING_FOLDER by
+    UploadRequest are renamed, anything else (e.g. small files kept in memory
+    by a different request class) is written out.
+    """
+    spool_path = getattr(file.stream, 'name', None)
+    if isinstance(spool_path, str) and spool_path in getattr(request, 'upload_spool_paths', ()):
+        file.stream.close()
+        os.replace(spool_path, destination)
+    else:
+        file.save(destination)
+
+
+def store_uploaded_images(request, post_date):
+    """
+    store uploaded images for background processing.
+    returns list of (filename, alt_text, sort_order) for new post_images rows,
+    which should be inserted with status 'pending'.
+    """
+    uploaded_images = []
     
     for i in range(1, 6):  # handle up to 5 images
         file_key = f'image_{i}'
@@ -355,27 +688,620 @@ def process_uploaded_images(request, post_date):
                 # generate random filename with date prefix
                 image_filename = generate_random_filename(file.filename, post_date)
                 
-                # save original image with metadata stripped
-                original_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-                
-                # save to temporary location first
-                temp_path = os.path.join(tempfile.gettempdir(), f"temp_{image_filename}")
-                file.save(temp_path)
-                
-                # create all image versions
-                results = create_all_image_versions(temp_path, image_filename)
-
-                if results['original']:
-                    print(f"created versions for {image_filename}: 1200={results['opt_1200']}, small={results['webring_small']}, tiny={results['webring_tiny']}")
-                    processed_images.append((image_filename, alt_text, i-1))  # sort_order = i-1
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                else:
-                    print(f"failed to create image versions for {image_filename}")
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
+                # keep the upload as-is until the image worker picks it up
+                move_upload(file, os.path.join(PENDING_FOLDER, image_filename))
+                uploaded_images.append((image_filename, alt_text, i-1))  # sort_order = i-1
     
-    return processed_images
+    return uploaded_images
+
+
+def image_file_paths(filename):
+    """all paths on disk that may belong to an image, including a pending upload and remade variants"""
+    return [path for _, path, *_ in image_versions_for(filename)] + [
+        os.path.join(PENDING_FOLDER, filename)
+    ] + regenerated_variant_paths(filename)
+
+
+def delete_image_files(filename):
+    """delete an image's original, generated versions and pending upload"""
+    for path in image_file_paths(filename):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# background image processing
+# uploads are saved to PENDING_FOLDER and their post_images rows start out as
+# 'pending'. a worker thread in each app process claims pending rows, generates
+# the image versions and flips the row to 'ready' (or 'failed').
+_image_worker_wakeup = threading.Event()
+_image_worker_lock = threading.Lock()
+_image_worker_thread = None
+
+
+_image_pool = None
+
+
+def get_image_pool():
+    """process pool for image encoding, created on first use"""
+    global _image_pool
+    if _image_pool is None:
+        # spawn rather than fork, since this is called from a thread
+        _image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _image_pool
+
+
+def claim_pending_images(conn, limit):
+    """
+    mark up to limit pending images as processing and return them (as dicts,
+    with the time they were claimed, which the result is recorded against)
+    """
+    claimed = []
+    claim_time = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    candidates = conn.execute(queries.PENDING_IMAGES, (limit,)).fetchall()
+    for image in candidates:
+        # another process may have claimed it between the select and update
+        cursor = conn.execute(
+            "UPDATE post_images SET status = 'processing', claimed = ? WHERE id = ? AND status = 'pending'",
+            (claim_time, image['id'])
+        )
+        if cursor.rowcount == 1:
+            claimed.append({**dict(image), 'status': 'processing', 'claimed': claim_time})
+    conn.commit()
+    return claimed
+
+
+def requeue_abandoned_images(conn):
+    """
+    queue images again whose claim expired, i.e. the process working on them
+    died. images other processes are still working on are left alone.
+    """
+    cursor = conn.execute(queries.REQUEUE_ABANDONED_IMAGES, (f'-{IMAGE_CLAIM_TIMEOUT} seconds',))
+    conn.commit()
+    if cursor.rowcount:
+        print(f"image worker: requeued {cursor.rowcount} abandoned images")
+
+
+def delete_unreferenced_blobs(conn):
+    """remove the files of blobs that no post image references any more"""
+    blobs = conn.execute(queries.UNREFERENCED_BLOBS).fetchall()
+    for blob in blobs:
+        cursor = conn.execute(
+            'DELETE FROM image_blobs WHERE hash = ? AND ref_count <= 0', (blob['hash'],)
+        )
+        # files are removed while this transaction holds the write lock, so a
+        # worker that reuses the blob commits afterwards and sees they're gone
+        if cursor.rowcount:
+            delete_image_files(blob['filename'])
+        conn.commit()
+
+
+def record_image_result(conn, image, content_hash, results, placeholder=None):
+    """
+    point a processed image at its blob, mark it ready or failed, record its
+    dimensions and tidy up. results maps version names to (width, height,
+    bytes), or None for versions that failed. an image whose original was
+    stored is ready even if some variants failed: only the variants that
+    were made are recorded, pages fall back to the original for the rest,
+    and regenerate_variants.py makes the missing ones.
+    """
+    pending_path = os.path.join(PENDING_FOLDER, image['filename'])
+
+    if content_hash and results.get('original'):
+        status = 'ready'
+        failed = [name for name, info in results.items() if not info]
+        if failed:
+            print(f"failed to create {', '.join(failed)} for {image['filename']}, run regenerate_variants.py")
+    else:
+        status = 'failed'
+        print(f"failed to create image versions for {image['filename']}: {results}")
+
+    if status == 'ready':
+        stored_filename = blob_filename(content_hash)
+        conn.execute(
+            'INSERT INTO image_blobs (hash, filename) VALUES (?, ?) ON CONFLICT (hash) DO NOTHING',
+            (content_hash, stored_filename)
+        )
+        width, height, _ = results['original']
+        cursor = conn.execute(
+            '''UPDATE post_images SET status = ?, filename = ?, blob_hash = ?,
+                   width = ?, height = ?, placeholder = ?, claimed = NULL
+               WHERE id = ? AND status = 'processing' AND claimed = ?''',
+            (status, stored_filename, content_hash, width, height, placeholder, image['id'], image['claimed'])
+        )
+        if cursor.rowcount:
+            # a blob uploaded again keeps the versions recorded for it, which
+            # may be remade ones
+            record_image_versions(conn, stored_filename, results, replace=False)
+    else:
+        stored_filename = None
+        cursor = conn.execute(
+            '''UPDATE post_images SET status = ?, claimed = NULL
+               WHERE id = ? AND status = 'processing' AND claimed = ?''',
+            (status, image['id'], image['claimed'])
+        )
+    conn.commit()
+
+    if cursor.rowcount == 0:
+        if conn.execute('SELECT 1 FROM post_images WHERE id = ?', (image['id'],)).fetchone():
+            # our claim expired and another worker took the image over, the
+            # pending upload is theirs now
+            delete_unreferenced_blobs(conn)
+            return
+        # the image or its post was deleted while we were working on it
+        delete_image_files(image['filename'])
+        delete_unreferenced_blobs(conn)
+        return
+
+    if status == 'ready' and not all(
+        os.path.exists(path) for name, path, *_ in image_versions_for(stored_filename) if results.get(name)
+    ):
+        # the blob's last other reference was deleted (and its files with it)
+        # while we were working, so go again
+        conn.execute("UPDATE post_images SET status = 'pending', claimed = NULL WHERE id = ?", (image['id'],))
+        conn.commit()
+        return
+
+    if stored_filename and os.path.exists(pending_path):
+        os.remove(pending_path)
+
+    # wait for the post's last image, so a post with several images rewrites
+    # its pages, feeds and static export once rather than once per image
+    if conn.execute(queries.UNFINISHED_POST_IMAGES, (image['post_id'],)).fetchone():
+        return
+
+    # pages showing the post link to the new versions now
+    post = conn.execute(
+        'SELECT post_date, is_private FROM posts WHERE id = ?', (image['post_id'],)
+    ).fetchone()
+    if post and not post['is_private']:
+        invalidate_cached_post([post['post_date']], images_changed=True)
+
+    # a cross-post waiting for this post's images can be sent now
+    # (entries that failed before keep their retry backoff)
+    cursor = conn.execute(
+        '''UPDATE mastodon_outbox SET next_attempt = CURRENT_TIMESTAMP
+           WHERE post_id = ? AND status = 'pending' AND attempts = 0''',
+        (image['post_id'],)
+    )
+    conn.commit()
+    if cursor.rowcount:
+        notify_mastodon_dispatcher()
+
+
+def process_image_jobs(conn, images):
+    """generate versions for claimed images, in parallel across the process pool"""
+    if IMAGE_WORKERS <= 0:
+        for image in images:
+            content_hash, results, _, placeholder = create_blob_versions(
+                os.path.join(PENDING_FOLDER, image['filename'])
+            )
+            record_image_result(conn, image, content_hash, results, placeholder)
+        return
+
+    pool = get_image_pool()
+    futures = {
+        pool.submit(
+            create_content_addressed_versions,
+            os.path.join(PENDING_FOLDER, image['filename']),
+            image_versions_for(BLOB_FILENAME_TEMPLATE)
+        ): image
+        for image in images
+    }
+    for future in as_completed(futures):
+        image = futures[future]
+        try:
+            content_hash, results, _, placeholder = future.result()
+        except Exception as e:
+            print(f"image worker process error for {image['filename']}: {e}")
+            content_hash, results, placeholder = None, {'original': None}, None
+        record_image_result(conn, image, content_hash, results, placeholder)
+
+
+def remove_stale_upload_spools(max_age=24 * 60 * 60):
+    """remove spooled uploads left behind by a crash mid-request"""
+    cutoff = datetime.now().timestamp() - max_age
+    for filename in os.listdir(PENDING_FOLDER):
+        path = os.path.join(PENDING_FOLDER, filename)
+        if filename.startswith(UPLOAD_SPOOL_PREFIX) and os.path.getmtime(path) < cutoff:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def run_image_worker():
+    """process pending images, then sleep until notified or the poll interval passes"""
+    remove_stale_upload_spools()
+
+    while True:
+        conn = open_db_connection()
+        try:
+            requeue_abandoned_images(conn)
+            while True:
+                images = claim_pending_images(conn, max(IMAGE_WORKERS, 1))
+                if not images:
+                    break
+                process_image_jobs(conn, images)
+        except Exception as e:
+            print(f"image worker error: {e}")
+        finally:
+            conn.close()
+
+        _image_worker_wakeup.wait(IMAGE_WORKER_POLL_INTERVAL)
+        _image_worker_wakeup.clear()
+
+
+def start_image_worker():
+    """start this process's image worker thread if it isn't running"""
+    global _image_worker_thread
+    if not app.config['BACKGROUND_WORKERS']:
+        return
+    with _image_worker_lock:
+        if _image_worker_thread is None or not _image_worker_thread.is_alive():
+            _image_worker_thread = threading.Thread(
+                target=run_image_worker, name='image-worker', daemon=True
+            )
+            _image_worker_thread.start()
+
+
+def notify_image_worker():
+    """wake the image worker after new pending images were committed"""
+    start_image_worker()
+    _image_worker_wakeup.set()
+
+
+@app.before_request
+def ensure_image_worker():
+    # started lazily so forked server workers each get their own thread
+    start_image_worker()
+
+
+# conditional GET. site_stats holds a content version and the time of the
+# last post or image write (see migrations/0006_content_version.sql), which
+# become the ETag and Last-Modified of every page and feed built from posts.
+# feed readers polling an unchanged journal get a 304 after one lookup.
+CONDITIONAL_ENDPOINTS = (
+    'index', 'post', 'images_gallery', 'rss_feed', 'images_rss', 'atom_feed', 'json_feed', 'search',
+    'sitemap_index', 'sitemap_pages', 'sitemap_year',
+    'archive', 'archive_year', 'archive_month'
+)
+
+
+def app_signature():
+    """changes when the code, templates, static files or config change, so deploys get new etags"""
+    paths = [__file__, 'config.yaml']
+    # pages link to fingerprinted static urls, so static files count too
+    for folder in (os.path.join(app.root_path, 'templates'), app.static_folder):
+        for root, _, filenames in os.walk(folder):
+            paths.extend(
+                os.path.join(root, filename) for filename in filenames
+                if not filename.endswith(('.gz', '.br', '.tmp'))  # written at startup
+            )
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        try:
+            digest.update(f'{path}:{os.stat(path).st_mtime_ns}'.encode('utf-8'))
+        except OSError:
+            continue
+    return digest.hexdigest()[:12]
+
+
+APP_SIGNATURE = app_signature()
+
+
+def content_validators():
+    """(etag, last modified) for the current content as seen by this visitor"""
+    stats = {
+        row['key']: row['value'] for row in get_db_connection().execute(
+            "SELECT key, value FROM site_stats WHERE key IN ('content_version', 'content_modified')"
+        )
+    }
+    # logged in visitors see private posts, so they get their own etags
+    audience = 'admin' if session.get('logged_in') else 'public'
+    etag = f"{stats.get('content_version', 0)}-{APP_SIGNATURE}-{audience}"
+    last_modified = datetime.fromtimestamp(stats.get('content_modified', 0), timezone.utc)
+    return etag, last_modified
+
+
+GZIP_ETAG_SUFFIX = '-gz'
+
+
+def set_content_validators(response, validators):
+    etag, last_modified = validators
+    if response.content_encoding == 'gzip':
+        # the compressed bytes are another representation, with their own etag
+        etag += GZIP_ETAG_SUFFIX
+    # nginx may send either encoding of an x-accel-redirect feed, so it's only a weak match
+    response.set_etag(etag, weak='X-Accel-Redirect' in response.headers)
+    response.last_modified = last_modified
+    # always revalidate, the version check is cheap
+    response.cache_control.no_cache = True
+    if session.get('logged_in'):
+        response.cache_control.private = True
+    response.vary.add('Cookie')
+
+
+@app.before_request
+def answer_conditional_request():
+    g.content_validators = None
+    # a page showing flash messages must not be reused for later requests
+    if request.method != 'GET' or request.endpoint not in CONDITIONAL_ENDPOINTS or session.get('_flashes'):
+        return None
+
+    g.content_validators = content_validators()
+    etag, last_modified = g.content_validators
+    if request.if_none_match:
+        # compared weakly, as If-None-Match is, and gzipped feeds have their own etag
+        matched = [tag for tag in (etag, etag + GZIP_ETAG_SUFFIX) if request.if_none_match.contains_weak(tag)]
+        not_modified = bool(matched)
+        etag = matched[0] if matched else etag
+    elif request.if_modified_since:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        response = app.response_class(status=304)
+        set_content_validators(response, (etag, last_modified))
+        return response
+
+
+@app.after_request
+def add_content_validators(response):
+    validators = g.get('content_validators')
+    if validators and response.status_code == 200:
+        set_content_validators(response, validators)
+    return response
+
+
+# response cache for anonymous visitors.
+# listings, post pages and feeds only change when a post is written or an
+# image finishes processing, so rendered responses are kept on disk (shared
+# by every server process) and purged when those writes happen. entries are
+# grouped in directories so a write only removes the pages it can affect.
+# a render that started before a write in another process may be stored
+# after that write's purge, so purges are also logged in the database
+# (response_cache_purges): an entry records the last purge before it was
+# rendered, and is only served while no later purge covers its group (and,
+# for index pages, its range of post dates). entries also record the app
+# signature, since those from before a deploy are outdated.
+CACHEABLE_ENDPOINTS = {
+    # endpoint: query arguments the page understands
+    'index': ('page', 'before', 'after'),
+    'post': (),
+    'images_gallery': ('page', 'before', 'after'),
+    'rss_feed': (),
+    'images_rss': (),
+    'atom_feed': (),
+    'json_feed': (),
+    'archive': (),
+    'archive_year': (),
+    'archive_month': (),
+}
+POST_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def response_cache_group(endpoint, view_args):
+    """cache directory for an endpoint, or None if it can't be cached"""
+    if endpoint == 'index':
+        return 'index'
+    if endpoint == 'post':
+        post_date = view_args.get('post_date', '')
+        return os.path.join('post', post_date) if POST_DATE_PATTERN.match(post_date) else None
+    if endpoint == 'images_gallery':
+        return 'images'
+    if endpoint.startswith('archive'):
+        return 'archive'
+    # feeds are already served from snapshot files when those are on
+    return None if FEED_SNAPSHOTS else 'feeds'
+
+
+def response_cache_path():
+    """(cache group, cache file) for the current request, or None if it shouldn't be cached"""
+    if not RESPONSE_CACHE or request.method != 'GET':
+        return None
+    allowed_args = CACHEABLE_ENDPOINTS.get(request.endpoint)
+    if allowed_args is None or any(arg not in allowed_args for arg in request.args):
+        return None
+    # logged in pages show private posts and edit links, flashes are one-off
+    if session.get('logged_in') or session.get('_flashes'):
+        return None
+    group = response_cache_group(request.endpoint, request.view_args or {})
+    if group is None:
+        return None
+    # the full url, since feeds contain absolute links
+    key = hashlib.sha256(request.url.encode('utf-8')).hexdigest()
+    return group, os.path.join(RESPONSE_CACHE_FOLDER, group, f'{key}.json')
+
+
+def cache_purge_bounds():
+    """(first, last) id in the purge log, 0 for an empty log"""
+    row = get_db_connection().execute(queries.CACHE_PURGE_BOUNDS).fetchone()
+    return row['first'] or 0, row['last'] or 0
+
+
+def cache_entry_current(group, entry, purge_bounds):
+    """whether no purge since an entry was rendered covers it"""
+    first, last = purge_bounds
+    rendered_after = entry.get('purge')
+    if entry.get('signature') != APP_SIGNATURE or not isinstance(rendered_after, int):
+        return False
+    if rendered_after == last:
+        return True
+    if rendered_after < first - 1:
+        # the purges since have been forgotten
+        return False
+    low, high = entry.get('range') or (None, None)
+    return not get_db_connection().execute(
+        queries.CACHE_PURGED_SINCE, (group, rendered_after, low, low, high, high)
+    ).fetchone()
+
+
+def read_cached_response(group, path, purge_bounds):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not cache_entry_current(group, entry, purge_bounds):
+        # rendered before a write that affects it, the fresh render replaces it
+        return None
+    # as the view would have, for the static export
+    g.response_cache_range = entry.get('range')
+    response = app.response_class(entry['body'], mimetype=entry['mimetype'])
+    response.headers['X-Cache'] = 'HIT'
+    response.vary.add('Cookie')
+    return response
+
+
+def write_cached_response(path, response, cache_range, purge):
+    """store a response, written to a temporary file first so readers never see half of it"""
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    if len(os.listdir(folder)) >= RESPONSE_CACHE_MAX_ENTRIES:
+        # full, most likely of entries outdated by a deploy, so start the group over
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder, exist_ok=True)
+    entry = {
+        'purge': purge,
+        'signature': APP_SIGNATURE,
+        'mimetype': response.mimetype,
+        'range': cache_range,
+        'body': response.get_data(as_text=True),
+    }
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"error writing response cache entry: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+@app.before_request
+def serve_cached_response():
+    g.response_cache_path = None
+    # pages answered by answer_conditional_request, without one-off flashes
+    cache = response_cache_path() if g.get('content_validators') else None
+    if cache:
+        group, g.response_cache_path = cache
+        # read before anything is rendered, a purge after this covers the render
+        g.response_cache_purges = cache_purge_bounds()
+        return read_cached_response(group, g.response_cache_path, g.response_cache_purges)
+
+
+@app.after_request
+def store_cached_response(response):
+    path = g.get('response_cache_path')
+    if (
+        path
+        and response.status_code == 200
+        and not response.direct_passthrough
+        and 'X-Cache' not in response.headers
+        and not session.modified
+    ):
+        write_cached_response(path, response, g.get('response_cache_range'), g.response_cache_purges[1])
+        response.headers['X-Cache'] = 'MISS'
+        response.vary.add('Cookie')
+    return response
+
+
+def skip_response_cache_while_processing(images):
+    """
+    pages showing an image the worker hasn't finished show a stand-in for it,
+    so they aren't cached (the pages are purged again once the image is ready)
+    """
+    if any(image['status'] in ('pending', 'processing') for image in images):
+        g.response_cache_path = None
+
+
+def remove_cache_folder(group):
+    shutil.rmtree(os.path.join(RESPONSE_CACHE_FOLDER, group), ignore_errors=True)
+
+
+def purge_index_pages(first_date, last_date):
+    """remove cached index pages whose range of post dates overlaps first_date..last_date"""
+    folder = os.path.join(RESPONSE_CACHE_FOLDER, 'index')
+    try:
+        filenames = os.listdir(folder)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        path = os.path.join(folder, filename)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                low, high = json.load(f).get('range') or (None, None)
+        except (OSError, ValueError):
+            low, high = None, None
+        if (low is None or low <= last_date) and (high is None or high >= first_date):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def log_cache_purges(purges):
+    """
+    record (cache group, first date, last date) purges, so entries rendered
+    before them aren't served even if they're stored afterwards
+    """
+    conn = open_db_connection()
+    try:
+        conn.executemany(
+            'INSERT INTO response_cache_purges (cache_group, first_date, last_date) VALUES (?, ?, ?)', purges
+        )
+        conn.execute(
+            'DELETE FROM response_cache_purges WHERE id <= (SELECT MAX(id) FROM response_cache_purges) - ?',
+            (RESPONSE_CACHE_PURGE_LOG,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def invalidate_cached_post(post_dates, totals_changed=False, images_changed=False):
+    """
+    purge the cached pages a write to a public post can affect: its post page
+    (at every date it has had), the feeds and archive, the index pages covering
+    its dates (every index page if the number of public posts changed, since
+    they all show it), and the image gallery if the post's images changed.
+    feed snapshots are rewritten, and the static export, if enabled, is
+    brought up to date in the background.
+    """
+    if RESPONSE_CACHE:
+        purges = [os.path.join('post', post_date) for post_date in post_dates if POST_DATE_PATTERN.match(post_date)]
+        purges += ['feeds', 'archive'] + (['images'] if images_changed else [])
+        index_range = (None, None) if totals_changed else (min(post_dates), max(post_dates))
+        log_cache_purges([(group, None, None) for group in purges] + [('index', *index_range)])
+        for group in purges:
+            remove_cache_folder(group)
+        if totals_changed:
+            remove_cache_folder('index')
+        else:
+            purge_index_pages(*index_range)
+    update_feed_snapshots()
+    if STATIC_EXPORT_FOLDER:
+        threading.Thread(
+            target=run_static_export, args=(post_dates, totals_changed, images_changed),
+            name='static-export', daemon=True
+        ).start()
+
+
+def run_static_export(post_dates, totals_changed, images_changed):
+    """re-export pages affected by a write (see export_static.py)"""
+    from export_static import export_changes
+    try:
+        exporter = export_changes(
+            app, STATIC_EXPORT_FOLDER, SITE_URL, post_dates, images_changed, totals_changed
+        )
+        print(f"static export: {exporter.written} written, {exporter.removed} removed")
+    except Exception as e:
+        print(f"static export error: {e}")
 
 
 def login_required(f):
@@ -389,44 +1315,291 @@ def login_required(f):
     return decorated_function
 
 
-def post_to_mastodon(post_date, title, post_url):
-    """post to mastodon if configured"""
-    try:
-        mastodon_config = config.get('mastodon', {})
-        instance_url = mastodon_config.get('instance_url')
-        access_token = mastodon_config.get('access_token')
-        privacy = mastodon_config.get('privacy', 'private')
-        
-        if not instance_url or not access_token:
-            flash('mastodon not configured - skipping cross-post')
-            return False
-            
-        # create mastodon client
-        mastodon = Mastodon(
-            access_token=access_token,
-            api_base_url=instance_url
+# mastodon cross-posting. create/edit only add the post to the
+# mastodon_outbox table; a dispatcher thread in each app process sends due
+# entries with exponential backoff. entries are claimed with a conditional
+# update and every send carries an idempotency key, so two processes racing
+# never toot a post twice. mastodon only remembers idempotency keys for an
+# hour though, so a retry first looks for a status an earlier attempt may
+# have created without us hearing back, and reuses the media it uploaded.
+MASTODON_CONFIG = config.get('mastodon') or {}
+MASTODON_POST_BASE_URL = SITE_URL.rstrip('/')
+MASTODON_REQUEST_TIMEOUT = get_int_config('mastodon_request_timeout', 30)  # seconds
+MASTODON_MAX_ATTEMPTS = get_int_config('mastodon_max_attempts', 8)
+MASTODON_RETRY_BASE = get_int_config('mastodon_retry_base', 30)  # seconds, doubled after each failure
+MASTODON_RETRY_MAX = get_int_config('mastodon_retry_max', 6 * 60 * 60)  # seconds
+MASTODON_MAX_MEDIA = 4  # attachments mastodon allows per status
+MASTODON_CLAIM_TIMEOUT = 10 * 60  # seconds before a claimed entry is assumed abandoned
+MASTODON_LOOKBACK = 20  # own recent statuses searched for an earlier attempt's status
+
+_mastodon_client = None
+_mastodon_wakeup = threading.Event()
+_mastodon_lock = threading.Lock()
+_mastodon_thread = None
+
+
+def mastodon_configured():
+    """cross-posts link back to the post, so they need site_url as well as an account"""
+    return bool(MASTODON_CONFIG.get('instance_url') and MASTODON_CONFIG.get('access_token') and config.get('site_url'))
+
+
+if MASTODON_CONFIG.get('access_token') and not config.get('site_url'):
+    print("Warning: site_url is not set, cross-posting to mastodon is off until it is")
+
+
+def get_mastodon_client():
+    """this process's mastodon client, created on first use and reused"""
+    global _mastodon_client
+    if _mastodon_client is None:
+        _mastodon_client = Mastodon(
+            access_token=MASTODON_CONFIG['access_token'],
+            api_base_url=MASTODON_CONFIG['instance_url'],
+            # don't ask the instance for its version before every first request
+            version_check_mode='none',
+            request_timeout=MASTODON_REQUEST_TIMEOUT
         )
-        
-        # format post content
-        iso_date = datetime.strptime(post_date, '%Y-%m-%d').strftime('%Y-%m-%d')
-        status_text = f"new journal entry...\n\n{iso_date} - {title}\n\nhttps://journal.palomakop.tv/post/{post_date}"
-        
-        # post to mastodon
-        mastodon.status_post(
-            status=status_text,
-            visibility=privacy
+    return _mastodon_client
+
+
+def queue_mastodon_post(conn, post_id):
+    """
+    add a post to the outbox, in the caller's transaction. a post that was
+    already sent stays sent; one that gave up is queued again, uploading its
+    media afresh as mastodon has likely removed the unattached uploads.
+    returns whether the post was queued (it wasn't if it's sent or already queued)
+    """
+    cursor = conn.execute(
+        '''INSERT INTO mastodon_outbox (post_id) VALUES (?)
+           ON CONFLICT (post_id) DO UPDATE SET
+               status = 'pending', attempts = 0, next_attempt = CURRENT_TIMESTAMP, last_error = NULL,
+               media_ids = NULL
+           WHERE status = 'failed' ''',
+        (post_id,)
+    )
+    return cursor.rowcount > 0
+
+
+def get_mastodon_outbox_entry(post_id):
+    return get_db_connection().execute(
+        'SELECT * FROM mastodon_outbox WHERE post_id = ?', (post_id,)
+    ).fetchone()
+
+
+def mastodon_retry_delay(attempts):
+    return min(MASTODON_RETRY_BASE * 2 ** (attempts - 1), MASTODON_RETRY_MAX)
+
+
+def claim_mastodon_entry(conn):
+    """claim the next due outbox entry, or return None"""
+    while True:
+        entry = conn.execute(queries.DUE_MASTODON_POST).fetchone()
+        if entry is None:
+            return None
+        cursor = conn.execute(
+            '''UPDATE mastodon_outbox SET status = 'sending', claimed = CURRENT_TIMESTAMP
+               WHERE id = ? AND status = 'pending' ''',
+            (entry['id'],)
         )
-        
-        flash('successfully cross-posted to mastodon!')
-        return True
-        
+        conn.commit()
+        if cursor.rowcount == 1:
+            return entry
+
+
+class MastodonImagesNotReady(Exception):
+    """the post's images are still being processed, try again shortly"""
+
+
+def mastodon_media_for(conn, post_id):
+    """
+    (path, alt text) of the webring_small version of a post's images, or None
+    if some are still being processed
+    """
+    images = conn.execute(queries.POST_IMAGES, (post_id,)).fetchall()
+    if any(image['status'] in ('pending', 'processing') for image in images):
+        return None
+    variant = IMAGE_VARIANTS['webring_small']
+    media = []
+    for image in images:
+        recorded = conn.execute(
+            'SELECT file FROM image_versions WHERE filename = ? AND version = ?',
+            (image['filename'], variant['name'])
+        ).fetchone()
+        filename = recorded['file'] if recorded and recorded['file'] else variant_filename(variant, image['filename'])
+        path = os.path.join(variant['folder'], filename)
+        if image['status'] == 'ready' and os.path.exists(path):
+            media.append((path, image['alt_text']))
+    return media[:MASTODON_MAX_MEDIA]
+
+
+def find_mastodon_status(client, post_url):
+    """one of our recent statuses that links to post_url, or None"""
+    for status in client.account_statuses(client.me(), limit=MASTODON_LOOKBACK):
+        if f'href="{post_url}"' in (status.get('content') or ''):
+            return status
+    return None
+
+
+def send_mastodon_entry(conn, entry):
+    """send one claimed outbox entry, returns the status url"""
+    post = conn.execute(
+        'SELECT * FROM posts WHERE id = ?', (entry['post_id'],)
+    ).fetchone()
+    media = mastodon_media_for(conn, post['id'])
+    if media is None:
+        raise MastodonImagesNotReady()
+
+    client = get_mastodon_client()
+    post_url = f"{MASTODON_POST_BASE_URL}/post/{post['post_date']}"
+    if entry['claimed'] is not None:
+        # an earlier attempt may have created the status and then timed out
+        status = find_mastodon_status(client, post_url)
+        if status is not None:
+            return status.get('url')
+
+    if entry['media_ids'] is not None:
+        media_ids = json.loads(entry['media_ids'])
+    else:
+        mime_type = IMAGE_FORMATS[IMAGE_VARIANTS['webring_small']['format']]['mime_type']
+        media_ids = []
+        for path, alt_text in media:
+            with open(path, 'rb') as f:
+                media_ids.append(str(client.media_post(f, mime_type=mime_type, description=alt_text)['id']))
+        conn.execute(
+            'UPDATE mastodon_outbox SET media_ids = ? WHERE id = ?', (json.dumps(media_ids), entry['id'])
+        )
+        conn.commit()
+    status_text = f"new journal entry...\n\n{post['post_date']} - {post['title']}\n\n{post_url}"
+    status = client.status_post(
+        status=status_text,
+        visibility=MASTODON_CONFIG.get('privacy', 'private'),
+        media_ids=media_ids or None,
+        idempotency_key=f"journal-post-{post['id']}"
+    )
+    return status.get('url')
+
+
+def dispatch_mastodon_entry(conn, entry):
+    """send an entry and record the outcome, scheduling a retry on failure"""
+    try:
+        remote_url = send_mastodon_entry(conn, entry)
+    except MastodonImagesNotReady:
+        # not a failed attempt, just wait for the image worker. nothing was
+        # sent, so put back the earlier claim (if any) that tells the next
+        # attempt whether to look for a status it may have created
+        conn.execute(
+            '''UPDATE mastodon_outbox SET status = 'pending', claimed = ?,
+                   next_attempt = datetime('now', ?) WHERE id = ?''',
+            (entry['claimed'], f'+{IMAGE_WORKER_POLL_INTERVAL} seconds', entry['id'])
+        )
+        conn.commit()
+        return
     except Exception as e:
-        flash(f'error posting to mastodon: {str(e)}')
-        return False
+        attempts = entry['attempts'] + 1
+        if attempts >= MASTODON_MAX_ATTEMPTS:
+            print(f"giving up cross-posting post {entry['post_id']} to mastodon: {e}")
+            status, delay = 'failed', 0
+        else:
+            print(f"error cross-posting post {entry['post_id']} to mastodon, will retry: {e}")
+            status, delay = 'pending', mastodon_retry_delay(attempts)
+        conn.execute(
+            '''UPDATE mastodon_outbox SET status = ?, attempts = ?, last_error = ?,
+                   next_attempt = datetime('now', ?) WHERE id = ?''',
+            (status, attempts, str(e), f'+{delay} seconds', entry['id'])
+        )
+        conn.commit()
+        return
+
+    conn.execute(
+        '''UPDATE mastodon_outbox SET status = 'sent', attempts = attempts + 1, last_error = NULL,
+               remote_url = ?, sent = CURRENT_TIMESTAMP WHERE id = ?''',
+        (remote_url, entry['id'])
+    )
+    conn.commit()
+
+
+def seconds_until_next_mastodon_entry(conn):
+    row = conn.execute(
+        '''SELECT (julianday(MIN(next_attempt)) - julianday('now')) * 86400 AS wait
+           FROM mastodon_outbox WHERE status = 'pending' '''
+    ).fetchone()
+    if row['wait'] is None:
+        return None
+    return max(row['wait'], 0)
+
+
+def run_mastodon_dispatcher():
+    """send due outbox entries, then sleep until the next one is due or we're notified"""
+    while True:
+        wait = None
+        conn = open_db_connection()
+        try:
+            # entries claimed by a process that died are sent again, after
+            # looking for a status the dead process may have created
+            conn.execute(
+                '''UPDATE mastodon_outbox SET status = 'pending'
+                   WHERE status = 'sending' AND claimed < datetime('now', ?)''',
+                (f'-{MASTODON_CLAIM_TIMEOUT} seconds',)
+            )
+            conn.commit()
+            while True:
+                entry = claim_mastodon_entry(conn)
+                if entry is None:
+                    break
+                dispatch_mastodon_entry(conn, entry)
+            wait = seconds_until_next_mastodon_entry(conn)
+        except Exception as e:
+            print(f"mastodon dispatcher error: {e}")
+        finally:
+            conn.close()
+
+        _mastodon_wakeup.wait(wait if wait is not None else MASTODON_CLAIM_TIMEOUT)
+        _mastodon_wakeup.clear()
+
+
+def start_mastodon_dispatcher():
+    """start this process's dispatcher thread if cross-posting is configured"""
+    global _mastodon_thread
+    if not mastodon_configured() or not app.config['BACKGROUND_WORKERS']:
+        return
+    with _mastodon_lock:
+        if _mastodon_thread is None or not _mastodon_thread.is_alive():
+            _mastodon_thread = threading.Thread(
+                target=run_mastodon_dispatcher, name='mastodon-dispatcher', daemon=True
+            )
+            _mastodon_thread.start()
+
+
+def flash_mastodon_queued(queued):
+    """after a save: tell the admin the post was queued, or why it wasn't"""
+    if queued:
+        notify_mastodon_dispatcher()
+        flash('queued for mastodon.')
+    elif 'cross_post_mastodon' not in request.form:
+        return
+    elif not mastodon_configured():
+        flash('mastodon is not configured (it needs instance_url, access_token and site_url), post was not cross-posted.')
+    else:
+        flash('already queued for or sent to mastodon.')
+
+
+def notify_mastodon_dispatcher():
+    """wake the dispatcher after an outbox entry was committed"""
+    start_mastodon_dispatcher()
+    _mastodon_wakeup.set()
+
+
+@app.before_request
+def ensure_mastodon_dispatcher():
+    # started lazily, like the image worker, so each server process has one
+    start_mastodon_dispatcher()
 
 
 # configure markdown
-md = markdown.Markdown(extensions=['fenced_code', 'tables', 'toc'])
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'toc']
+
+# markdown.Markdown instances keep state between conversions and are not
+# thread-safe, so each thread gets its own and resets it before every use
+_markdown_local = threading.local()
 
 # configure bleach settings for HTML sanitization
 ALLOWED_TAGS = [
@@ -454,13 +1627,35 @@ ALLOWED_ATTRIBUTES = {
 
 ALLOWED_PROTOCOLS = ['http', 'https', 'mailto']
 
-# add markdown filter to Jinja2
-@app.template_filter('markdown')
-def markdown_filter(text):
-    if not text:
-        return ''
+# rendered HTML cache, keyed by a hash of the markdown source
+_rendered_cache = OrderedDict()
+_rendered_cache_lock = threading.Lock()
+
+
+def get_markdown_renderer():
+    """get this thread's markdown instance, reset and ready to convert"""
+    renderer = getattr(_markdown_local, 'renderer', None)
+    if renderer is None:
+        renderer = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        _markdown_local.renderer = renderer
+    return renderer.reset()
+
+
+def render_markdown(text):
+    """
+    convert markdown to sanitized HTML.
+    results are kept in an LRU cache keyed by content hash, so unchanged
+    posts are only rendered once per process.
+    """
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _rendered_cache_lock:
+        clean_html = _rendered_cache.get(key)
+        if clean_html is not None:
+            _rendered_cache.move_to_end(key)
+            return clean_html
+
     # convert markdown to HTML
-    html = md.convert(text)
+    html = get_markdown_renderer().convert(text)
     # sanitize the HTML with bleach
     clean_html = bleach.clean(
         html,
@@ -469,7 +1664,20 @@ def markdown_filter(text):
         protocols=ALLOWED_PROTOCOLS,
         strip=True
     )
-    return Markup(clean_html)
+
+    with _rendered_cache_lock:
+        _rendered_cache[key] = clean_html
+        while len(_rendered_cache) > MARKDOWN_CACHE_SIZE:
+            _rendered_cache.popitem(last=False)
+    return clean_html
+
+
+# add markdown filter to Jinja2
+@app.template_filter('markdown')
+def markdown_filter(text):
+    if not text:
+        return ''
+    return Markup(render_markdown(text))
 
 
 # add filter to strip HTML tags for RSS descriptions
@@ -479,34 +1687,126 @@ def striptags_filter(text):
     return bleach.clean(text, tags=[], strip=True)
 
 
-@app.route('/uploads/<filename>')
-def uploaded_file(filename):
-    """serve uploaded files"""
-    return send_from_directory(os.path.join(os.path.dirname(__file__), UPLOAD_FOLDER), filename)
+# feeds and page descriptions. a post's html, plain text excerpt and og
+# description all come from one markdown render, and are kept per revision
+# of its content (keyed by content hash, like the markdown cache), so a feed
+# poll doesn't render or strip tags again for every post.
+FEED_EXCERPT_LENGTH = 300
+OG_DESCRIPTION_LENGTH = 160
 
+_post_text_cache = OrderedDict()
+_post_text_cache_lock = threading.Lock()
 
-@app.route('/uploads/optimized/<filename>')
-def optimized_file(filename):
-    """serve optimized files"""
-    return send_from_directory(os.path.join(os.path.dirname(__file__), UPLOAD_FOLDER, 'optimized'), filename)
 
+def truncate_text(text, length):
+    if len(text) <= length:
+        return text
+    return text[:length - 3].rstrip() + '...'
 
-@app.route('/uploads/webring_small/<filename>')
-def webring_small_file(filename):
-    """serve webring small versions"""
-    return send_from_directory(
-        os.path.join(os.path.dirname(__file__), WEBRING_SMALL_FOLDER),
-        filename
-    )
 
+@app.template_global()
+def render_post(content):
+    """
+    {'html', 'excerpt', 'description'} for a post's markdown: sanitized html,
+    a plain text excerpt for feeds and a shorter one for og:description
+    """
+    content = content or ''
+    key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    with _post_text_cache_lock:
+        rendered = _post_text_cache.get(key)
+        if rendered is not None:
+            _post_text_cache.move_to_end(key)
+            return rendered
+
+    html = render_markdown(content) if content else ''
+    # plain text, with entities decoded (templates escape it again) and whitespace collapsed
+    text = ' '.join(unescape(bleach.clean(html, tags=[], strip=True)).split())
+    rendered = {
+        'html': Markup(html),
+        'excerpt': text[:FEED_EXCERPT_LENGTH] + ('...' if len(text) > FEED_EXCERPT_LENGTH else ''),
+        'description': truncate_text(text, OG_DESCRIPTION_LENGTH),
+    }
+
+    with _post_text_cache_lock:
+        _post_text_cache[key] = rendered
+        while len(_post_text_cache) > MARKDOWN_CACHE_SIZE:
+            _post_text_cache.popitem(last=False)
+    return rendered
 
-@app.route('/uploads/webring_tiny/<filename>')
-def webring_tiny_file(filename):
-    """serve webring tiny thumbnail versions"""
-    return send_from_directory(
-        os.path.join(os.path.dirname(__file__), WEBRING_TINY_FOLDER),
-        filename
+
+def build_feed_posts(posts):
+    """
+    posts as dicts ready for the feeds: their images, the first image as an
+    enclosure, and their rendered content
+    """
+    feed_posts = attach_post_images(posts)
+    # feeds are fetched and cached elsewhere, so images still being processed
+    # are left out until they're ready (which rewrites the feeds)
+    for post in feed_posts:
+        post['images'] = [image for image in post['images'] if image['status'] == 'ready']
+    # the first image of each post is its enclosure
+    sizes = get_version_sizes(
+        [post['images'][0]['filename'] for post in feed_posts if post['images']], 'optimized'
     )
+    image_html = Markup('<p><img src="{}" alt="{}" style="max-width: 100%; height: auto;"></p>')
+    for post in feed_posts:
+        post['rendered'] = render_post(post['content'])
+        # the post followed by its images, for feeds without a separate image list
+        post['feed_html'] = post['rendered']['html'] + Markup('').join(
+            image_html.format(image_url(image, _external=True), image['alt_text'] or 'Post image')
+            for image in post['images']
+        )
+        if post['images']:
+            post['enclosure'] = image_enclosure(post['images'][0], sizes)
+    return feed_posts
+
+
+def accel_redirect_location(path):
+    """internal nginx location of a file inside the app folder, for X-Accel-Redirect"""
+    app_folder = os.path.dirname(os.path.abspath(__file__))
+    location = os.path.relpath(path, app_folder).replace(os.sep, '/')
+    return f"{UPLOAD_ACCEL_PREFIX.rstrip('/')}/{quote(location)}"
+
+
+def send_upload(folder, filename):
+    """
+    send a file from an upload folder with far-future caching, since upload
+    filenames are random and a file is never replaced under the same name.
+    in x-accel-redirect mode the response only names the file for nginx,
+    which needs an internal location for UPLOAD_ACCEL_PREFIX aliased to the
+    app folder (so upload folders have to be inside it), e.g.
+        location /_protected/ { internal; alias /home/pi/journal/; }
+    in x-sendfile mode flask sets the X-Sendfile header itself.
+    """
+    app_folder = os.path.dirname(os.path.abspath(__file__))
+    if UPLOAD_SERVING == 'x-accel-redirect':
+        path = safe_join(os.path.join(app_folder, folder), filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        response.headers['X-Accel-Redirect'] = accel_redirect_location(path)
+    else:
+        response = send_from_directory(os.path.join(app_folder, folder), filename)
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/uploads/<filename>')
+def uploaded_file(filename):
+    """serve uploaded files"""
+    return send_upload(UPLOAD_FOLDER, filename)
+
+
+@app.route('/uploads/<variant>/<filename>')
+def variant_file(variant, filename):
+    """serve generated image variants"""
+    if variant not in IMAGE_VARIANTS:
+        abort(404)
+    return send_upload(IMAGE_VARIANTS[variant]['folder'], filename)
 
 
 @app.route('/about')
@@ -524,162 +1824,414 @@ def favicon():
     )
 
 
-@app.route('/rss')
-def rss_feed():
-    """generate RSS feed with last 50 public posts"""
-    conn = get_db_connection()
-    posts = conn.execute(
+def render_rss_feed():
+    """RSS feed with the last 50 public posts"""
+    return render_template('rss.xml', posts=build_feed_posts(get_feed_posts()), datetime=datetime)
+
+
+def render_atom_feed():
+    """atom version of the RSS feed"""
+    return render_template('atom.xml', posts=build_feed_posts(get_feed_posts()), datetime=datetime)
+
+
+def render_json_feed():
+    """json feed (https://jsonfeed.org/version/1.1) version of the RSS feed"""
+    items = []
+    for post in build_feed_posts(get_feed_posts()):
+        post_url = url_for('post', post_date=post['post_date'], _external=True)
+        item = {
+            'id': post_url,
+            'url': post_url,
+            'title': post['title'],
+            'content_html': str(post['feed_html']),
+            'summary': post['rendered']['excerpt'],
+            'date_published': f"{post['post_date']}T00:00:00+00:00",
+        }
+        if post['images']:
+            image = post['images'][0]
+            item['image'] = image_url(image, _external=True)
+            item['attachments'] = [{
+                'url': image_url(image, _external=True),
+                'mime_type': post['enclosure']['type'],
+                'size_in_bytes': post['enclosure']['length'],
+            }]
+        items.append(item)
+    feed = {
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': config.get('journal_title', 'my journal'),
+        'description': config.get('journal_description', ''),
+        'home_page_url': url_for('index', _external=True),
+        'feed_url': request.url,
+        'items': items,
+    }
+    return json.dumps(feed, ensure_ascii=False)
+
+
+def get_feed_posts():
+    return get_db_connection().execute(
         'SELECT * FROM posts WHERE is_private = 0 ORDER BY post_date DESC LIMIT 50'
     ).fetchall()
-    
-    # add images to each post
-    posts_with_images = []
-    for post in posts:
-        post_dict = dict(post)
-        post_dict['images'] = get_post_images(post['id'])
-        posts_with_images.append(post_dict)
-    
-    conn.close()
-    
-    response = render_template('rss.xml', posts=posts_with_images, datetime=datetime)
-    return app.response_class(response, mimetype='application/rss+xml')
+
+
+@app.route('/rss')
+def rss_feed():
+    return feed_response('rss')
+
+
+@app.route('/atom.xml')
+def atom_feed():
+    return feed_response('atom')
+
+
+@app.route('/feed.json')
+def json_feed():
+    return feed_response('json')
+
+
+def parse_image_cursor(value):
+    """image cursors are '<created>_<id>'; returns (created, id) or None"""
+    if value is None:
+        return None
+    if value == '':
+        return ()
+    created, _, image_id = value.rpartition('_')
+    if not created or not image_id.isdigit():
+        return None
+    return (created, int(image_id))
 
 
 @app.route('/images')
 def images_gallery():
     """display all public images in grid with pagination"""
-    page = request.args.get('page', 1, type=int)
+    page = request.args.get('page', type=int)
+    before = parse_image_cursor(request.args.get('before'))
+    after = parse_image_cursor(request.args.get('after'))
 
     conn = get_db_connection()
 
-    # count total public images
-    total_query = '''
-        SELECT COUNT(*)
-        FROM post_images pi
-        INNER JOIN posts p ON pi.post_id = p.id
-        WHERE p.is_private = 0
-    '''
-    total = conn.execute(total_query).fetchone()[0]
-
-    # calculate pagination
+    # total public images is kept up to date by triggers
+    total = get_site_stat('public_images')
     total_pages = math.ceil(total / IMAGES_PER_PAGE)
-    offset = (page - 1) * IMAGES_PER_PAGE
 
     # get images with post data
-    images_query = '''
-        SELECT
-            pi.id,
-            pi.filename,
-            pi.alt_text,
-            pi.created,
-            p.post_date,
-            p.id as post_id
-        FROM post_images pi
-        INNER JOIN posts p ON pi.post_id = p.id
-        WHERE p.is_private = 0
-        ORDER BY pi.created DESC
-        LIMIT ? OFFSET ?
-    '''
-    images = conn.execute(images_query, (IMAGES_PER_PAGE, offset)).fetchall()
-    conn.close()
-
-    pagination = {
-        'page': page,
-        'total_pages': total_pages,
-        'has_prev': page > 1,
-        'has_next': page < total_pages,
-        'prev_num': page - 1 if page > 1 else None,
-        'next_num': page + 1 if page < total_pages else None,
-        'total': total
-    }
+    images, has_newer, has_older = fetch_keyset_page(
+        conn, queries.GALLERY_IMAGES, queries.GALLERY_CONDITIONS, [],
+        queries.GALLERY_ORDER, IMAGES_PER_PAGE,
+        before=before, after=after, page=page
+    )
+    load_recorded_versions([image['filename'] for image in images])
+
+    pagination = build_pagination(
+        'images_gallery', images, lambda image: f"{image['created']}_{image['id']}",
+        has_newer, has_older, total, total_pages, page,
+        is_first=before is None and after is None
+    )
 
     return render_template('images.html', images=images, pagination=pagination)
 
 
+def render_images_feed():
+    """webring-spec RSS feed with the last 50 images from public posts"""
+    images = get_db_connection().execute(queries.IMAGES_FEED).fetchall()
+    return render_template('images_rss.xml', images=images, datetime=datetime, request=request)
+
+
 @app.route('/images.xml')
 def images_rss():
-    """generate webring-spec RSS feed with last 50 images from public posts"""
+    return feed_response('images')
+
+
+# feed snapshots. when site_url is set, every feed is rendered to a file
+# (plus a .gz copy) after each write to a public post, so requests only
+# send bytes, or have nginx send them: feed latency doesn't grow with the
+# archive. without site_url feeds are rendered per request, since their
+# absolute links come from the request.
+FEED_FOLDER = config.get('feed_folder', 'feeds')
+FEED_SNAPSHOTS = bool(FEED_FOLDER and config.get('site_url'))
+FEEDS = {
+    # name: (path, file, mimetype, renderer)
+    'rss': ('/rss', 'rss.xml', 'application/rss+xml', render_rss_feed),
+    'images': ('/images.xml', 'images.xml', 'application/rss+xml', render_images_feed),
+    'atom': ('/atom.xml', 'atom.xml', 'application/atom+xml', render_atom_feed),
+    'json': ('/feed.json', 'feed.json', 'application/feed+json', render_json_feed),
+}
+FEED_SIGNATURE_FILE = '.signature'
+
+
+def feed_snapshot_signature(content_version):
+    """
+    snapshots are rewritten when the content, code, templates or the site url
+    change. the content version covers writes whose snapshot update failed,
+    or that only changed private posts
+    """
+    return f'{content_version} {APP_SIGNATURE} {SITE_URL}'
+
+
+def current_content_version(conn):
+    row = conn.execute(queries.SITE_STAT, ('content_version',)).fetchone()
+    return row['value'] if row else 0
+
+
+@contextmanager
+def feed_snapshot_lock():
+    """one writer at a time across server processes, so the last write wins with the latest data"""
+    os.makedirs(FEED_FOLDER, exist_ok=True)
+    with open(os.path.join(FEED_FOLDER, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_feed_file(filename, data):
+    fd, temp_path = tempfile.mkstemp(dir=FEED_FOLDER, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, os.path.join(FEED_FOLDER, filename))
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def write_feed_snapshots():
+    """render every feed as it would be served from site_url and write it out"""
+    with feed_snapshot_lock():
+        # read before rendering, so a write during it is picked up next time
+        conn = open_db_connection()
+        try:
+            content_version = current_content_version(conn)
+        finally:
+            conn.close()
+        for path, filename, _, render in FEEDS.values():
+            with app.test_request_context(path, base_url=SITE_URL):
+                data = render().encode('utf-8')
+            # the .gz first, so it's never older than the file it compresses
+            write_feed_file(f'{filename}.gz', gzip.compress(data, 9, mtime=0))
+            write_feed_file(filename, data)
+        write_feed_file(FEED_SIGNATURE_FILE, feed_snapshot_signature(content_version).encode('utf-8'))
+
+
+def ensure_feed_snapshots():
+    """write the snapshots if they're missing, behind the content or from an older version of the app"""
+    try:
+        with open(os.path.join(FEED_FOLDER, FEED_SIGNATURE_FILE), 'r') as f:
+            signature = f.read()
+    except OSError:
+        signature = None
+    if signature != feed_snapshot_signature(current_content_version(get_db_connection())):
+        write_feed_snapshots()
+
+
+def update_feed_snapshots():
+    """after a write to a public post"""
+    if not FEED_SNAPSHOTS:
+        return
+    try:
+        write_feed_snapshots()
+    except Exception as e:
+        # the signature still has the old content version, so the next feed request tries again
+        print(f"error writing feed snapshots: {e}")
+
+
+def feed_response(name):
+    """
+    a feed from its snapshot, precompressed when the browser accepts gzip,
+    or rendered for this request when snapshots are off. in x-accel-redirect
+    mode nginx sends the snapshot from an internal location aliased to the
+    app folder (see send_upload), where `gzip_static on;` picks up the .gz.
+    """
+    _, filename, mimetype, render = FEEDS[name]
+    if not FEED_SNAPSHOTS:
+        return app.response_class(render(), mimetype=mimetype)
+    try:
+        ensure_feed_snapshots()
+    except Exception as e:
+        print(f"error writing feed snapshots: {e}")
+        return app.response_class(render(), mimetype=mimetype)
+
+    snapshot_path = os.path.join(FEED_FOLDER, filename)
+    if UPLOAD_SERVING == 'x-accel-redirect':
+        response = app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = accel_redirect_location(os.path.abspath(snapshot_path))
+        return response
+
+    encoding = None
+    if request.accept_encodings['gzip'] and os.path.isfile(snapshot_path + '.gz'):
+        snapshot_path, encoding = snapshot_path + '.gz', 'gzip'
+    try:
+        with open(snapshot_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return app.response_class(render(), mimetype=mimetype)
+    response = app.response_class(data, mimetype=mimetype)
+    response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# sitemaps. /sitemap.xml lists a sitemap per year of public posts, and each
+# year's sitemap is streamed from a cursor rather than built in memory. the
+# lastmod dates come from posts.updated (kept up to date by triggers, see
+# migrations/0012_post_updated.sql), so crawlers can skip unchanged pages.
+SITEMAP_NAMESPACES = (
+    'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+    'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"'
+)
+
+
+def sitemap_date(timestamp):
+    """w3c datetime for a sqlite 'YYYY-MM-DD HH:MM:SS' utc timestamp"""
+    return timestamp.replace(' ', 'T') + '+00:00' if ' ' in timestamp else timestamp
+
+
+def sitemap_url(loc, lastmod=None, images=()):
+    entry = f'<url><loc>{escape(loc)}</loc>'
+    if lastmod:
+        entry += f'<lastmod>{sitemap_date(lastmod)}</lastmod>'
+    for image_loc in images:
+        entry += f'<image:image><image:loc>{escape(image_loc)}</image:loc></image:image>'
+    return entry + '</url>\n'
+
+
+def stream_sitemap(entries):
+    """a streamed sitemap response around an iterable of <url> or <sitemap> entries"""
+    def generate():
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+        yield from entries
+    return app.response_class(stream_with_context(generate()), mimetype='application/xml')
+
+
+@app.route('/sitemap.xml')
+def sitemap_index():
+    """sitemap index: the fixed pages, then a sitemap per year with public posts"""
+    years = get_db_connection().execute(queries.SITEMAP_YEARS).fetchall()
+
+    def entries():
+        yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+        sitemaps = [(url_for('sitemap_pages', _external=True), max((y['lastmod'] for y in years), default=None))]
+        sitemaps += [
+            (url_for('sitemap_year', year=int(y['year']), _external=True), y['lastmod']) for y in years
+        ]
+        for loc, lastmod in sitemaps:
+            entry = f'<sitemap><loc>{escape(loc)}</loc>'
+            if lastmod:
+                entry += f'<lastmod>{sitemap_date(lastmod)}</lastmod>'
+            yield entry + '</sitemap>\n'
+        yield '</sitemapindex>\n'
+    return stream_sitemap(entries())
+
+
+@app.route('/sitemap-pages.xml')
+def sitemap_pages():
+    """listing pages (their later pages are found through pagination)"""
+    lastmod = get_db_connection().execute(
+        'SELECT MAX(updated) AS lastmod FROM posts WHERE is_private = 0'
+    ).fetchone()['lastmod']
+
+    def entries():
+        yield f'<urlset {SITEMAP_NAMESPACES}>\n'
+        for endpoint in ('index', 'archive', 'images_gallery'):
+            yield sitemap_url(url_for(endpoint, _external=True), lastmod)
+        yield sitemap_url(url_for('about', _external=True))
+        yield '</urlset>\n'
+    return stream_sitemap(entries())
+
+
+@app.route('/sitemap-<int(fixed_digits=4):year>.xml')
+def sitemap_year(year):
+    """every public post of a year, with its images"""
     conn = get_db_connection()
+    if not conn.execute(
+        "SELECT 1 FROM month_counts WHERE month >= ? AND month < ? AND public_posts > 0 LIMIT 1",
+        (f'{year:04d}-01', f'{year + 1:04d}-01')
+    ).fetchone():
+        abort(404)
 
-    # get last 50 images from public posts
-    images_query = '''
-        SELECT
-            pi.id,
-            pi.filename,
-            pi.alt_text,
-            pi.created,
-            pi.sort_order,
-            p.post_date,
-            p.title,
-            p.id as post_id
-        FROM post_images pi
-        INNER JOIN posts p ON pi.post_id = p.id
-        WHERE p.is_private = 0
-        ORDER BY p.post_date DESC, pi.sort_order ASC
-        LIMIT 50
-    '''
-    images = conn.execute(images_query).fetchall()
-
-    # calculate index per post_date for titles
-    images_with_indices = []
-    date_counters = {}
-
-    for img in images:
-        post_date = img['post_date']
-        if post_date not in date_counters:
-            date_counters[post_date] = 0
-        date_counters[post_date] += 1
-
-        img_dict = dict(img)
-        img_dict['index'] = date_counters[post_date]
-        images_with_indices.append(img_dict)
-
-    conn.close()
-
-    response = render_template('images_rss.xml', images=images_with_indices, datetime=datetime, request=request)
-    return app.response_class(response, mimetype='application/rss+xml')
+    def entries():
+        # the request's connection is closed before the response is sent, so
+        # the stream reads through its own
+        stream_conn = open_db_connection()
+        try:
+            rows = stream_conn.execute(queries.SITEMAP_YEAR, (f'{year:04d}-01-01', f'{year + 1:04d}-01-01'))
+
+            def post_entry(post, images):
+                # image urls depend on the recorded versions, loaded a post at a
+                # time (and dropped again) so the stream's memory stays flat
+                g.recorded_versions = {}
+                load_recorded_versions([image['filename'] for image in images])
+                image_urls = [image_url(image, _external=True) for image in images]
+                return sitemap_url(url_for('post', post_date=post['post_date'], _external=True), post['updated'], image_urls)
+
+            yield f'<urlset {SITEMAP_NAMESPACES}>\n'
+            # rows come one per image, grouped by post
+            post, images = None, []
+            for row in rows:
+                if post is not None and row['id'] != post['id']:
+                    yield post_entry(post, images)
+                    images = []
+                post = row
+                if row['filename']:
+                    images.append(row)
+            if post is not None:
+                yield post_entry(post, images)
+            yield '</urlset>\n'
+        finally:
+            stream_conn.close()
+    return stream_sitemap(entries())
 
 
 @app.route('/')
 def index():
-    page = request.args.get('page', 1, type=int)
+    page = request.args.get('page', type=int)
+    before = request.args.get('before')
+    after = request.args.get('after')
     
     conn = get_db_connection()
     
-    # count total posts based on login status
+    # total posts based on login status, kept up to date by triggers
     if session.get('logged_in'):
-        total = conn.execute('SELECT COUNT(*) FROM posts').fetchone()[0]
-        posts_query = 'SELECT * FROM posts ORDER BY post_date DESC LIMIT ? OFFSET ?'
+        total = get_site_stat('posts')
+        conditions = []
     else:
-        total = conn.execute('SELECT COUNT(*) FROM posts WHERE is_private = 0').fetchone()[0]
-        posts_query = 'SELECT * FROM posts WHERE is_private = 0 ORDER BY post_date DESC LIMIT ? OFFSET ?'
-    
-    # calculate pagination
+        total = get_site_stat('public_posts')
+        conditions = queries.PUBLIC_POSTS
     total_pages = math.ceil(total / POSTS_PER_PAGE)
-    offset = (page - 1) * POSTS_PER_PAGE
     
     # get posts for current page
-    posts = conn.execute(posts_query, (POSTS_PER_PAGE, offset)).fetchall()
+    posts, has_newer, has_older = fetch_keyset_page(
+        conn, queries.POSTS, conditions, [],
+        queries.POSTS_ORDER, POSTS_PER_PAGE,
+        before=(before,) if before is not None else None,
+        after=((after,) if after else ()) if after is not None else None,
+        page=page
+    )
     
     # add images to each post
-    posts_with_images = []
-    for post in posts:
-        post_dict = dict(post)
-        post_dict['images'] = get_post_images(post['id'])
-        posts_with_images.append(post_dict)
+    posts_with_images = attach_post_images(posts)
+    skip_response_cache_while_processing(
+        [image for post in posts_with_images for image in post['images']]
+    )
     
-    conn.close()
+    # the post dates this page covers, so the response cache can tell which
+    # pages a new or edited post lands on. open ended at the newest/oldest end.
+    low = posts[-1]['post_date'] if posts and has_older else None
+    if after is not None:
+        low = after or None
+    high = posts[0]['post_date'] if posts and has_newer else None
+    if before is not None:
+        high = before
+    g.response_cache_range = (low, high)
     
     # create pagination object
-    pagination = {
-        'page': page,
-        'total_pages': total_pages,
-        'has_prev': page > 1,
-        'has_next': page < total_pages,
-        'prev_num': page - 1 if page > 1 else None,
-        'next_num': page + 1 if page < total_pages else None,
-        'total': total
-    }
+    pagination = build_pagination(
+        'index', posts, lambda post: post['post_date'],
+        has_newer, has_older, total, total_pages, page,
+        is_first=before is None and after is None
+    )
     
     return render_template('index.html', posts=posts_with_images, pagination=pagination)
 
@@ -694,10 +2246,145 @@ def post(post_date):
     
     # get images for this post
     images = get_post_images(post['id'])
+    skip_response_cache_while_processing(images)
     
     return render_template('post.html', post=post, images=images)
 
 
+SEARCH_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+# markers snippet() puts around matches, swapped for <mark> after escaping
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+
+
+def build_search_query(text):
+    """
+    turn what a visitor typed into an FTS5 query: every word must match,
+    quoted so punctuation can't be read as query syntax
+    """
+    terms = SEARCH_TERM_PATTERN.findall(text)[:SEARCH_MAX_TERMS]
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def highlight_snippet(snippet):
+    """escape a snippet and turn its match markers into <mark> tags"""
+    escaped = str(Markup.escape(snippet))
+    return Markup(escaped.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+
+@app.route('/search')
+def search():
+    text = request.args.get('q', '').strip()[:200]
+    page = max(request.args.get('page', 1, type=int), 1)
+    query = build_search_query(text)
+    results = []
+    total = 0
+
+    if query:
+        conn = get_db_connection()
+        public_only = not session.get('logged_in')
+        total = conn.execute(queries.search_count(public_only), (query,)).fetchone()[0]
+        rows = conn.execute(
+            queries.search_results(public_only),
+            (SNIPPET_START, SNIPPET_END, query, SEARCH_RESULTS_PER_PAGE, (page - 1) * SEARCH_RESULTS_PER_PAGE)
+        ).fetchall()
+        for row in rows:
+            result = dict(row)
+            result['snippet'] = highlight_snippet(row['snippet'])
+            results.append(result)
+
+    total_pages = math.ceil(total / SEARCH_RESULTS_PER_PAGE)
+    return render_template(
+        'search.html', q=text, results=results, total=total,
+        page=page, total_pages=total_pages
+    )
+
+
+def get_archive_months():
+    """
+    months with posts this visitor can see, newest first, from the
+    month_counts table (kept up to date by triggers, see migrations/0008_month_counts.sql)
+    """
+    rows = get_db_connection().execute(queries.archive_months(not session.get('logged_in'))).fetchall()
+    months = []
+    for row in rows:
+        year, month = (int(part) for part in row['month'].split('-'))
+        months.append({
+            'year': year,
+            'month': month,
+            'name': calendar.month_name[month].lower(),
+            'count': row['count'],
+        })
+    return months
+
+
+def group_archive_years(months):
+    """months grouped by year, for the archive navigation"""
+    years = []
+    for month in months:
+        if not years or years[-1]['year'] != month['year']:
+            years.append({'year': month['year'], 'count': 0, 'months': []})
+        years[-1]['count'] += month['count']
+        years[-1]['months'].append(month)
+    return years
+
+
+def get_posts_between(start, end):
+    """posts with start <= post_date < end this visitor can see, newest first"""
+    return get_db_connection().execute(
+        queries.posts_between(not session.get('logged_in')), (start, end)
+    ).fetchall()
+
+
+@app.route('/archive')
+def archive():
+    months = get_archive_months()
+    return render_template('archive.html', archive_years=group_archive_years(months), year=None)
+
+
+@app.route('/archive/<int(fixed_digits=4):year>')
+def archive_year(year):
+    all_months = get_archive_months()
+    months = [month for month in all_months if month['year'] == year]
+    if not months:
+        abort(404)
+
+    posts = get_posts_between(f'{year:04d}-01-01', f'{year + 1:04d}-01-01')
+    for month in months:
+        prefix = f"{year:04d}-{month['month']:02d}"
+        month['posts'] = [post for post in posts if post['post_date'].startswith(prefix)]
+
+    return render_template(
+        'archive.html', archive_years=group_archive_years(all_months), year=year, months=months
+    )
+
+
+@app.route('/archive/<int(fixed_digits=4):year>/<int(fixed_digits=2):month>')
+def archive_month(year, month):
+    if not 1 <= month <= 12:
+        abort(404)
+    months = get_archive_months()
+    position = next(
+        (i for i, m in enumerate(months) if m['year'] == year and m['month'] == month), None
+    )
+    if position is None:
+        abort(404)
+
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    posts = attach_post_images(
+        get_posts_between(f'{year:04d}-{month:02d}-01', f'{next_year:04d}-{next_month:02d}-01')
+    )
+    skip_response_cache_while_processing([image for post in posts for image in post['images']])
+
+    return render_template(
+        'archive_month.html',
+        posts=posts,
+        year=year,
+        month_name=months[position]['name'],
+        newer=months[position - 1] if position > 0 else None,
+        older=months[position + 1] if position + 1 < len(months) else None
+    )
+
+
 @app.route('/login', methods=('GET', 'POST'))
 @limiter.limit("5 per minute")
 def login():
@@ -755,10 +2442,8 @@ def create():
         if not title:
             flash('title is required!')
         else:
-            conn = None
+            conn = get_db_connection()
             try:
-                conn = get_db_connection()
-                
                 # insert post and get the post ID
                 cursor = conn.execute(
                     'INSERT INTO posts (title, content, post_date, is_private) VALUES (?, ?, ?, ?)',
@@ -766,33 +2451,37 @@ def create():
                 )
                 post_id = cursor.lastrowid
                 
-                # process uploaded images
-                processed_images = process_uploaded_images(request, post_date)
+                # store uploaded images for background processing
+                uploaded_images = store_uploaded_images(request, post_date)
                 
-                # save each processed image
-                for filename, alt_text, sort_order in processed_images:
+                # save each uploaded image
+                for filename, alt_text, sort_order in uploaded_images:
                     conn.execute(
-                        'INSERT INTO post_images (post_id, filename, alt_text, sort_order) VALUES (?, ?, ?, ?)',
+                        "INSERT INTO post_images (post_id, filename, alt_text, sort_order, status) VALUES (?, ?, ?, ?, 'pending')",
                         (post_id, filename, alt_text, sort_order)
                     )
                 
+                # cross-posted in the background, once the images are processed
+                queued = False
+                if 'cross_post_mastodon' in request.form and mastodon_configured():
+                    queued = queue_mastodon_post(conn, post_id)
+                
                 conn.commit()
+                if uploaded_images:
+                    notify_image_worker()
+                if not is_private:
+                    invalidate_cached_post([post_date], totals_changed=True)
                 flash('post created successfully!')
-                
-                # handle mastodon cross-posting
-                if 'cross_post_mastodon' in request.form:
-                    post_url = f"https://journal.palomakop.tv/post/{post_date}"
-                    post_to_mastodon(post_date, title, post_url)
+                flash_mastodon_queued(queued)
                 
                 return redirect(url_for('post', post_date=post_date))
                 
             except sqlite3.IntegrityError:
+                conn.rollback()
                 flash('a post already exists for this date. please choose a different date or edit the existing post.')
             except Exception as e:
+                conn.rollback()
                 flash(f'error creating post: {str(e)}')
-            finally:
-                if conn:
-                    conn.close()
 
     # default to today's date
     default_date = date.today().isoformat()
@@ -814,25 +2503,16 @@ def edit(post_date):
         if not title:
             flash('title is required!')
         else:
-            conn = None
+            conn = get_db_connection()
             try:
-                conn = get_db_connection()
-                
                 # handle existing image updates and deletions
                 for image in existing_images:
                     # check if image should be removed
                     if f'remove_image_{image["id"]}' in request.form:
-                        # delete files
-                        if image['filename']:
-                            paths_to_delete = [
-                                os.path.join(app.config['UPLOAD_FOLDER'], image['filename']),
-                                os.path.join(OPTIMIZED_FOLDER, f"opt_{image['filename']}"),
-                                os.path.join(WEBRING_SMALL_FOLDER, image['filename']),
-                                os.path.join(WEBRING_TINY_FOLDER, image['filename'])
-                            ]
-                            for path in paths_to_delete:
-                                if os.path.exists(path):
-                                    os.remove(path)
+                        # delete files, unless they belong to a shared blob,
+                        # which goes when its last reference does
+                        if image['filename'] and image['blob_hash'] is None:
+                            delete_image_files(image['filename'])
                         
                         # delete database record
                         conn.execute('DELETE FROM post_images WHERE id = ?', (image['id'],))
@@ -844,15 +2524,15 @@ def edit(post_date):
                             (new_alt_text, image['id'])
                         )
                 
-                # process new uploaded images
-                processed_images = process_uploaded_images(request, new_post_date)
+                # store new uploaded images for background processing
+                uploaded_images = store_uploaded_images(request, new_post_date)
                 
-                # save each new processed image
-                for filename, alt_text, sort_order in processed_images:
+                # save each new uploaded image
+                for filename, alt_text, sort_order in uploaded_images:
                     # adjust sort_order to come after existing images
                     adjusted_sort_order = len(existing_images) + sort_order
                     conn.execute(
-                        'INSERT INTO post_images (post_id, filename, alt_text, sort_order) VALUES (?, ?, ?, ?)',
+                        "INSERT INTO post_images (post_id, filename, alt_text, sort_order, status) VALUES (?, ?, ?, ?, 'pending')",
                         (post['id'], filename, alt_text, adjusted_sort_order)
                     )
                 
@@ -862,25 +2542,37 @@ def edit(post_date):
                     (title, content, new_post_date, is_private, post['id'])
                 )
                 
+                queued = False
+                if 'cross_post_mastodon' in request.form and mastodon_configured():
+                    queued = queue_mastodon_post(conn, post['id'])
+                
                 conn.commit()
+                # blobs only the removed images used
+                delete_unreferenced_blobs(conn)
+                if uploaded_images:
+                    notify_image_worker()
+                if not (post['is_private'] and is_private):
+                    invalidate_cached_post(
+                        [post['post_date'], new_post_date],
+                        totals_changed=bool(post['is_private']) != is_private,
+                        images_changed=bool(existing_images)
+                    )
                 flash('post updated successfully!')
-                
-                # handle mastodon cross-posting
-                if 'cross_post_mastodon' in request.form:
-                    post_url = f"https://journal.palomakop.tv/post/{new_post_date}"
-                    post_to_mastodon(new_post_date, title, post_url)
+                flash_mastodon_queued(queued)
                 
                 return redirect(url_for('post', post_date=new_post_date))
                 
             except sqlite3.IntegrityError:
+                conn.rollback()
                 flash('a post already exists for the new date. please choose a different date.')
             except Exception as e:
+                conn.rollback()
                 flash(f'error updating post: {str(e)}')
-            finally:
-                if conn:
-                    conn.close()
 
-    return render_template('edit.html', post=post, existing_images=existing_images)
+    return render_template(
+        'edit.html', post=post, existing_images=existing_images,
+        mastodon_entry=get_mastodon_outbox_entry(post['id'])
+    )
 
 
 @app.route('/delete/<post_date>', methods=('POST',))
@@ -891,24 +2583,19 @@ def delete(post_date):
     # get all images for this post
     images = get_post_images(post['id'])
     
-    # delete all associated image files
+    # delete associated image files that aren't shared blobs
     for image in images:
-        if image['filename']:
-            paths_to_delete = [
-                os.path.join(app.config['UPLOAD_FOLDER'], image['filename']),
-                os.path.join(OPTIMIZED_FOLDER, f"opt_{image['filename']}"),
-                os.path.join(WEBRING_SMALL_FOLDER, image['filename']),
-                os.path.join(WEBRING_TINY_FOLDER, image['filename'])
-            ]
-            for path in paths_to_delete:
-                if os.path.exists(path):
-                    os.remove(path)
+        if image['filename'] and image['blob_hash'] is None:
+            delete_image_files(image['filename'])
     
     conn = get_db_connection()
     # delete post (images will be deleted automatically due to CASCADE)
     conn.execute('DELETE FROM posts WHERE id = ?', (post['id'],))
     conn.commit()
-    conn.close()
+    # blobs only this post used
+    delete_unreferenced_blobs(conn)
+    if not post['is_private']:
+        invalidate_cached_post([post['post_date']], totals_changed=True, images_changed=bool(images))
     
     flash('"{}" was successfully deleted!'.format(post['title']))
     return redirect(url_for('index'))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+record dimensions, byte sizes and placeholders for images processed before
+they were recorded (see migrations/0011_image_metadata.sql).
+
+new uploads get their metadata when the background worker processes them.
+this reads the stored files of older images instead: version sizes come from
+each file's header and the placeholder from a draft decode of the original,
+so nothing is re-encoded. images that already have metadata are skipped, so
+the script can be interrupted and run again.
+
+usage:
+    python backfill_image_metadata.py [--workers N] [--force]
+"""
+
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from storage import (
+    open_db_connection,
+    image_versions_for,
+    record_image_versions,
+    IMAGE_WORKERS,
+    UPLOAD_FOLDER
+)
+from image_processing import read_image_metadata
+
+
+def images_to_backfill(conn, force):
+    """stored filenames of ready images that are missing metadata"""
+    condition = '' if force else 'AND (placeholder IS NULL OR width IS NULL)'
+    return [
+        row['filename'] for row in conn.execute(
+            f"SELECT DISTINCT filename FROM post_images WHERE status = 'ready' {condition} ORDER BY filename"
+        )
+    ]
+
+
+def record_metadata(conn, filename, results, placeholder):
+    """store the metadata of every post image using this stored file"""
+    original = results.get('original')
+    if original:
+        width, height, _ = original
+        conn.execute(
+            'UPDATE post_images SET width = ?, height = ?, placeholder = ? WHERE filename = ?',
+            (width, height, placeholder, filename)
+        )
+    else:
+        conn.execute(
+            'UPDATE post_images SET placeholder = ? WHERE filename = ?', (placeholder, filename)
+        )
+    record_image_versions(conn, filename, results)
+    conn.commit()
+
+
+def backfill_image_metadata(workers, force=False):
+    conn = open_db_connection()
+    filenames = images_to_backfill(conn, force)
+    print(f"{len(filenames)} images to backfill")
+    if not filenames:
+        conn.close()
+        return
+
+    success = 0
+    errors = 0
+    total = len(filenames)
+    interrupted = False
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    try:
+        futures = {
+            pool.submit(
+                read_image_metadata, os.path.join(UPLOAD_FOLDER, filename), image_versions_for(filename)
+            ): filename
+            for filename in filenames
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                results, placeholder = future.result()
+            except Exception as e:
+                print(f"[{done}/{total}] ✗ {filename}: {e}")
+                errors += 1
+                continue
+
+            record_metadata(conn, filename, results, placeholder)
+            missing = [name for name, info in results.items() if not info]
+            if missing:
+                print(f"[{done}/{total}] ✗ {filename}: missing {', '.join(missing)}")
+                errors += 1
+            else:
+                print(f"[{done}/{total}] ✓ {filename}")
+                success += 1
+    except KeyboardInterrupt:
+        print("\ninterrupted - finished images are saved, run again to resume")
+        interrupted = True
+        raise
+    finally:
+        # on ctrl-c, drop the queued images instead of waiting for them
+        pool.shutdown(wait=not interrupted, cancel_futures=interrupted)
+        conn.close()
+
+    print("=" * 50)
+    print("backfill complete!")
+    print(f"  success: {success} images")
+    print(f"  errors: {errors} images (run regenerate_variants.py to recreate missing files)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='record metadata of previously processed images')
+    parser.add_argument(
+        '--workers', type=int, default=max(IMAGE_WORKERS, 1),
+        help='number of processes to use (default: image_workers from config)'
+    )
+    parser.add_argument('--force', action='store_true', help='re-read images that already have metadata')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        backfill_image_metadata(args.workers, force=args.force)
+    except KeyboardInterrupt:
+        pass
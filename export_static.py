@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+export the public side of the journal as static files for nginx to serve.
+
+pages are rendered through the app itself (with a test client, as a logged
+out visitor), so they use the same templates, markdown rendering and image
+urls as the live site. listing pages are found by following the pagination
+links from the first page, so every url the site links to has a file.
+
+files are only rewritten when their content changed and files no longer
+linked to are removed, so running the export again is cheap. when
+static_export_folder is set in config.yaml the app also re-exports the
+affected pages in the background after a post is created, edited or deleted,
+or its images finish processing. the range of post dates each index page
+covers is kept in .index_ranges.json, so an edit only re-renders the index
+pages it shows up on.
+
+usage:
+    python export_static.py [--output FOLDER] [--site-url URL]
+
+pages with a query string are written to <page>/<query>.html, e.g.
+/?before=2024-05-01 becomes index/before=2024-05-01.html. an nginx server
+block that serves the export to logged out visitors and passes everything
+else (logins, admin pages, uploads through the app) on to gunicorn:
+
+    root /home/pi/journal/export;
+
+    # logged in (or mid-flash-message) visitors always get the live app
+    error_page 418 = @app;
+    if ($cookie_session) { return 418; }
+
+    location = /             { try_files /index/$args.html /index$args.html @app; }
+    location = /images       { try_files /images/$args.html /images$args.html @app; }
+    location /post/          { try_files $uri.html @app; }
+    location /archive        { try_files $uri.html @app; }
+    location = /about        { try_files /about.html @app; }
+    location = /rss          { default_type application/rss+xml; try_files /rss.xml @app; }
+    location = /images.xml   { default_type application/rss+xml; try_files /images.xml @app; }
+    location = /atom.xml     { default_type application/atom+xml; try_files /atom.xml @app; }
+    location = /feed.json    { default_type application/feed+json; try_files /feed.json @app; }
+    location /static/        { alias /home/pi/journal/static/; gzip_static on; expires max; }
+    location /uploads/       { alias /home/pi/journal/uploads/; }
+    location /               { try_files /nonexistent @app; }
+    location @app            { proxy_pass http://127.0.0.1:8000; }
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from flask import g
+
+
+# listing pages, crawled through their pagination links
+LISTING_PATHS = {'/': 'index', '/images': 'images'}
+LISTING_ARGS = ('before', 'after')
+# archive pages, crawled from /archive: /archive/<year> and /archive/<year>/<month>
+ARCHIVE_PATTERN = re.compile(r'^/archive(/\d{4}(/\d{2})?)?$')
+# post dates covered by each exported index page, {url: [low, high]}
+INDEX_RANGES_FILE = '.index_ranges.json'
+# single pages that aren't linked from listings
+FIXED_PAGES = {
+    '/about': 'about.html', '/rss': 'rss.xml', '/images.xml': 'images.xml',
+    '/atom.xml': 'atom.xml', '/feed.json': 'feed.json'
+}
+
+
+class LinkParser(HTMLParser):
+    """collects the href of every <a> tag"""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.links.append(href)
+
+
+def page_links(html):
+    parser = LinkParser()
+    parser.feed(html)
+    return parser.links
+
+
+def output_name(url):
+    """file an exported url is written to, relative to the export folder, or None"""
+    path, _, query = url.partition('?')
+    if path in FIXED_PAGES and not query:
+        return FIXED_PAGES[path]
+    if path in LISTING_PATHS:
+        name = LISTING_PATHS[path]
+        if not query:
+            return f'{name}.html'
+        if '/' in query or query.startswith('.'):
+            return None
+        return os.path.join(name, f'{query}.html')
+    if ARCHIVE_PATTERN.match(path) and not query:
+        return f'{path.strip("/")}.html'
+    if path.startswith('/post/') and not query:
+        post_date = path[len('/post/'):]
+        if post_date and '/' not in post_date and not post_date.startswith('.'):
+            return os.path.join('post', f'{post_date}.html')
+    return None
+
+
+def classify_link(href, site_netloc):
+    """('listing' | 'archive' | 'post', url) for links the export follows, or None"""
+    parts = urlsplit(href)
+    if parts.netloc and parts.netloc != site_netloc:
+        return None
+    url = f'{parts.path}?{parts.query}' if parts.query else parts.path
+    if parts.path in LISTING_PATHS:
+        args = [arg.partition('=')[0] for arg in parts.query.split('&') if arg]
+        if len(args) <= 1 and all(arg in LISTING_ARGS for arg in args):
+            return 'listing', url
+    elif ARCHIVE_PATTERN.match(parts.path) and not parts.query:
+        return 'archive', url
+    elif parts.path.startswith('/post/') and not parts.query:
+        return 'post', url
+    return None
+
+
+def write_if_changed(folder, name, body):
+    """write body to folder/name unless it already has that content; returns whether it was written"""
+    path = os.path.join(folder, name)
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == body:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so nginx never serves half a page
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def range_overlaps(cache_range, first_date, last_date):
+    """whether an index page covering cache_range (either end None for open) shows dates in first..last"""
+    low, high = cache_range or (None, None)
+    return (low is None or low <= last_date) and (high is None or high >= first_date)
+
+
+def remove_file(folder, name):
+    try:
+        os.remove(os.path.join(folder, name))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+class Exporter:
+    """renders urls through the app and keeps track of what was written"""
+
+    def __init__(self, app, folder, site_url):
+        self.client = app.test_client()
+        self.folder = folder
+        self.site_url = site_url.rstrip('/')
+        self.site_netloc = urlsplit(self.site_url).netloc
+        self.exported = set()
+        self.index_ranges = {}
+        self.written = 0
+        self.removed = 0
+
+    def export(self, url):
+        """render one url and write it out; returns the body for 200 responses"""
+        name = output_name(url)
+        if name is None:
+            return None
+        # kept open after the request, for the post dates an index page covers
+        with self.client:
+            response = self.client.get(url, base_url=self.site_url)
+            cache_range = g.get('response_cache_range')
+        if response.status_code == 404:
+            # deleted or made private since the last export
+            self.removed += remove_file(self.folder, name)
+            self.index_ranges.pop(url, None)
+            return None
+        if response.status_code != 200:
+            print(f"skip: {url} (status {response.status_code})")
+            return None
+        body = response.get_data()
+        self.written += write_if_changed(self.folder, name, body)
+        self.exported.add(name)
+        if url.partition('?')[0] == '/':
+            self.index_ranges[url] = cache_range
+        return body.decode('utf-8')
+
+    def crawl_listing(self, start_urls, skip=()):
+        """
+        export listing pages and every page reachable through their pagination
+        (or, from /archive, every archive page) apart from the skip urls;
+        returns linked post urls
+        """
+        start_url = start_urls[0]
+        queue = list(start_urls)
+        seen = set(start_urls) | set(skip)
+        posts = set()
+        while queue:
+            html = self.export(queue.pop())
+            if html is None:
+                continue
+            for href in page_links(html):
+                link = classify_link(href, self.site_netloc)
+                if link is None:
+                    continue
+                kind, url = link
+                if kind == 'post':
+                    posts.add(url)
+                elif url not in seen and self.same_listing(kind, url, start_url):
+                    seen.add(url)
+                    queue.append(url)
+        return posts
+
+    @staticmethod
+    def same_listing(kind, url, start_url):
+        if start_url == '/archive':
+            return kind == 'archive'
+        return kind == 'listing' and LISTING_PATHS[url.partition('?')[0]] == LISTING_PATHS[start_url.partition('?')[0]]
+
+    def load_index_ranges(self):
+        """the index pages of the last export and their ranges, or None if it didn't record them"""
+        try:
+            with open(os.path.join(self.folder, INDEX_RANGES_FILE), 'r', encoding='utf-8') as f:
+                self.index_ranges = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return self.index_ranges
+
+    def save_index_ranges(self):
+        body = json.dumps(self.index_ranges, sort_keys=True).encode('utf-8')
+        write_if_changed(self.folder, INDEX_RANGES_FILE, body)
+
+    def remove_unexported(self, subfolders):
+        """remove files in the given parts of the export that this run didn't produce"""
+        for subfolder in subfolders:
+            names = []
+            root = os.path.join(self.folder, subfolder)
+            if os.path.isfile(root):
+                names.append(subfolder)
+            elif os.path.isdir(root):
+                for dirpath, _, filenames in os.walk(root):
+                    names.extend(
+                        os.path.relpath(os.path.join(dirpath, filename), self.folder)
+                        for filename in filenames
+                    )
+            for name in names:
+                if name not in self.exported:
+                    self.removed += remove_file(self.folder, name)
+
+
+@contextmanager
+def export_lock(folder):
+    """only one export at a time, across every server process"""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, '.export.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_site(app, folder, site_url):
+    """export every public page"""
+    with export_lock(folder):
+        exporter = Exporter(app, folder, site_url)
+        for url in FIXED_PAGES:
+            exporter.export(url)
+        posts = set()
+        for start_url in [*LISTING_PATHS, '/archive']:
+            posts |= exporter.crawl_listing([start_url])
+        for url in sorted(posts):
+            exporter.export(url)
+        exporter.remove_unexported(['index.html', 'index', 'images.html', 'images', 'archive.html', 'archive', 'post'])
+        exporter.save_index_ranges()
+    return exporter
+
+
+def export_changes(app, folder, site_url, post_dates, images_changed=False, totals_changed=True):
+    """
+    re-export what a write to public posts can change: the posts' pages, the
+    feeds, the archive pages of their dates and the index pages showing them,
+    plus the image gallery when images changed. when the number of public
+    posts changed every index page shows the new count, so the whole index is
+    exported again. pages that now 404 are removed.
+    """
+    with export_lock(folder):
+        exporter = Exporter(app, folder, site_url)
+        for post_date in post_dates:
+            exporter.export(f'/post/{post_date}')
+        for url in ('/rss', '/images.xml', '/atom.xml', '/feed.json'):
+            exporter.export(url)
+
+        listings = []
+        index_ranges = exporter.load_index_ranges()
+        if totals_changed or not index_ranges:
+            exporter.index_ranges = {}
+            exporter.crawl_listing(['/'])
+            listings += ['index.html', 'index']
+        else:
+            # pages whose cursors moved link to new urls, which are followed
+            first_date, last_date = min(post_dates), max(post_dates)
+            affected = [url for url, cache_range in index_ranges.items()
+                        if range_overlaps(cache_range, first_date, last_date)]
+            exporter.crawl_listing(affected or ['/'], skip=set(index_ranges) - set(affected))
+
+        exporter.export('/archive')
+        for post_date in post_dates:
+            exporter.export(f'/archive/{post_date[:4]}')
+            exporter.export(f'/archive/{post_date[:4]}/{post_date[5:7]}')
+
+        if images_changed:
+            exporter.crawl_listing(['/images'])
+            listings += ['images.html', 'images']
+        exporter.remove_unexported(listings)
+        exporter.save_index_ranges()
+    return exporter
+
+
+def parse_args(default_folder, default_site_url):
+    parser = argparse.ArgumentParser(description='export the public journal as static files')
+    parser.add_argument(
+        '--output', default=default_folder,
+        help=f'folder to write to (default: static_export_folder from config, or {default_folder})'
+    )
+    parser.add_argument(
+        '--site-url', default=default_site_url,
+        help='url the site is served from, used for absolute links in feeds (default: site_url from config)'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from app import app, STATIC_EXPORT_FOLDER, SITE_URL
+
+    # rendering pages mustn't start the app's image worker or mastodon dispatcher
+    app.config['BACKGROUND_WORKERS'] = False
+    args = parse_args(STATIC_EXPORT_FOLDER or 'export', SITE_URL)
+    exporter = export_site(app, args.output, args.site_url)
+    print(f"exported {len(exporter.exported)} pages to {args.output}/")
+    print(f"  written: {exporter.written}")
+    print(f"  removed: {exporter.removed}")
@@ -0,0 +1,252 @@
+"""
+decoding, resizing and encoding of uploaded images.
+kept out of app.py so process pool workers can import it without
+setting up the flask app.
+"""
+
+import base64
+import hashlib
+import io
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image, ImageOps
+from pillow_heif import register_heif_opener
+
+
+# heif/heic support (needed in every worker process)
+register_heif_opener()
+
+# avif encoding is only available with the optional pillow-avif-plugin
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+
+# output formats variant profiles can use
+IMAGE_FORMATS = {
+    'jpeg': {'pil_format': 'JPEG', 'extension': 'jpg', 'mime_type': 'image/jpeg', 'options': {'optimize': True}},
+    'webp': {'pil_format': 'WEBP', 'extension': 'webp', 'mime_type': 'image/webp', 'options': {'method': 4}},
+    'avif': {'pil_format': 'AVIF', 'extension': 'avif', 'mime_type': 'image/avif', 'options': {'speed': 6}},
+}
+
+
+def format_supported(image_format):
+    """whether this pillow build can encode the given variant format"""
+    if image_format not in IMAGE_FORMATS:
+        return False
+    Image.init()
+    return IMAGE_FORMATS[image_format]['pil_format'] in Image.SAVE
+
+
+# low quality image placeholders: a tiny, heavily compressed jpeg of the
+# picture, inlined as a data uri and shown (scaled up and blurry) while the
+# real image loads
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 40
+
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def draft_for_width(img, max_width):
+    """
+    let the JPEG decoder downscale while decoding (DCT scaling), when the
+    result only needs to be max_width wide. the draft is never smaller than
+    what is asked for, so a normal resize afterwards keeps full quality.
+    must be called before the image is loaded. no-op for other formats.
+    """
+    if img.format != 'JPEG':
+        return img
+    width, height = img.size
+    # the stored width is the displayed height for rotated photos
+    display_width = height if img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS else width
+    if display_width <= max_width:
+        return img
+    scale = max_width / display_width
+    img.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+    return img
+
+
+def to_web_rgb(img):
+    """apply EXIF rotation and convert to RGB, putting transparency on white"""
+    img = ImageOps.exif_transpose(img)  # apply EXIF rotation before anything else
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        # create white background for transparent images
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'RGBA':
+            background.paste(img, mask=img.split()[-1])
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img
+
+
+def resize_to_width(img, max_width):
+    """
+    resize to max_width keeping aspect ratio. always returns a new image,
+    since save() sets attributes on the image and versions are saved concurrently.
+    """
+    width, height = img.size
+    if width <= max_width:
+        return img.copy()
+    new_height = int(height * (max_width / width))
+    return img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+
+
+def save_image(img, output_path, image_format, quality):
+    """
+    save in one of IMAGE_FORMATS without any EXIF data. written to a temporary
+    name first, so a file at output_path is always complete.
+    """
+    format_info = IMAGE_FORMATS[image_format]
+    temp_path = f"{output_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        img.save(temp_path, format_info['pil_format'], quality=quality, exif=b"", **format_info['options'])
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def version_info(path):
+    """(width, height, bytes) of a stored image file, read from its header"""
+    with Image.open(path) as img:
+        width, height = img.size
+    return width, height, os.path.getsize(path)
+
+
+def image_placeholder(img):
+    """a data uri of a tiny, low quality version of an image (a few hundred bytes)"""
+    small = resize_to_width(img, PLACEHOLDER_WIDTH)
+    buffer = io.BytesIO()
+    small.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def image_content_hash(img):
+    """sha-256 of an image's pixels, after EXIF rotation and RGB conversion"""
+    digest = hashlib.sha256(f"{img.mode} {img.width}x{img.height}\n".encode('utf-8'))
+    # in strips, so a large photo isn't copied into one huge bytes object
+    for top in range(0, img.height, 256):
+        digest.update(img.crop((0, top, img.width, min(top + 256, img.height))).tobytes())
+    return digest.hexdigest()
+
+
+def largest_first(version):
+    """sort key putting full-size versions first, then widest to narrowest"""
+    max_width = version[2]
+    return -math.inf if max_width is None else -max_width
+
+
+def write_image_versions(img, source_path, versions, max_threads=None):
+    """
+    write every version of an already decoded image. resized versions are
+    chained, each one made from the next larger version rather than the
+    full-size image, so only the first resize is full-frame. encodes run on
+    threads while the chain continues, since pillow releases the GIL while
+    encoding. returns dict of name -> (width, height, bytes) of the written
+    file, or None for versions that failed.
+    """
+    results = {name: None for name, *_ in versions}
+    with ThreadPoolExecutor(max_workers=max_threads or len(versions) or 1) as executor:
+        futures = {}
+        source = img
+        for name, output_path, max_width, image_format, quality in sorted(versions, key=largest_first):
+            if max_width is None:
+                out = img
+            else:
+                try:
+                    out = resize_to_width(source, max_width)
+                except Exception as e:
+                    print(f"error resizing {name} version of {source_path}: {e}")
+                    continue
+                source = out
+            future = executor.submit(save_image, out, output_path, image_format, quality)
+            futures[future] = (name, output_path, out.size)
+
+        for future in as_completed(futures):
+            name, output_path, (width, height) = futures[future]
+            try:
+                future.result()
+                results[name] = (width, height, os.path.getsize(output_path))
+            except Exception as e:
+                print(f"error creating {name} version of {source_path}: {e}")
+    return results
+
+
+def create_image_versions(source_path, versions, max_threads=None):
+    """
+    decode source_path once and write every version of it.
+    versions is a list of (name, output_path, max_width, image_format, quality)
+    tuples; a max_width of None saves the full-size image. when no full-size
+    version is asked for, JPEG sources are draft-decoded at the largest width
+    needed. returns dict of name -> (width, height, bytes), or None for
+    versions that failed.
+    """
+    widths = [max_width for _, _, max_width, _, _ in versions]
+    try:
+        with Image.open(source_path) as img:
+            if widths and None not in widths:
+                draft_for_width(img, max(widths))
+            img = to_web_rgb(img)
+            return write_image_versions(img, source_path, versions, max_threads)
+    except Exception as e:
+        print(f"error creating image versions: {e}")
+        import traceback
+        traceback.print_exc()
+        return {name: None for name, *_ in versions}
+
+
+def create_content_addressed_versions(source_path, versions, max_threads=None):
+    """
+    like create_image_versions, but output paths contain a '{hash}' placeholder
+    that is filled in with image_content_hash() of the decoded image. versions
+    whose file already exists (the same picture was uploaded before) are
+    skipped, so a duplicate costs one decode and no encoding.
+    returns (content hash, dict of name -> (width, height, bytes) or None,
+    whether every file already existed, placeholder data uri).
+    """
+    try:
+        with Image.open(source_path) as img:
+            img = to_web_rgb(img)
+            content_hash = image_content_hash(img)
+            versions = [
+                (name, output_path.replace('{hash}', content_hash), *rest)
+                for name, output_path, *rest in versions
+            ]
+            missing = [version for version in versions if not os.path.exists(version[1])]
+            results = {
+                name: version_info(output_path)
+                for name, output_path, *_ in versions if os.path.exists(output_path)
+            }
+            if missing:
+                results.update(write_image_versions(img, source_path, missing, max_threads))
+            return content_hash, results, not missing, image_placeholder(img)
+    except Exception as e:
+        print(f"error creating image versions: {e}")
+        import traceback
+        traceback.print_exc()
+        return None, {name: None for name, *_ in versions}, False, None
+
+
+def read_image_metadata(source_path, versions):
+    """
+    metadata of an image that was processed before it was recorded, for
+    backfilling. versions is a list of (name, output_path, ...) tuples.
+    returns (dict of name -> (width, height, bytes) or None if the file is
+    missing, placeholder data uri made from source_path).
+    """
+    results = {
+        name: version_info(output_path) if os.path.exists(output_path) else None
+        for name, output_path, *_ in versions
+    }
+    with Image.open(source_path) as img:
+        draft_for_width(img, PLACEHOLDER_WIDTH)
+        placeholder = image_placeholder(to_web_rgb(img))
+    return results, placeholder
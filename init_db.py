@@ -1,12 +1,13 @@
 import sqlite3
 import os
 from datetime import date, timedelta
+from migrate import load_database_path, run_migrations
 
 def init_database():
     """initialize database with updated schema for multiple images support"""
     
     # create database connection
-    connection = sqlite3.connect('database.db')
+    connection = sqlite3.connect(load_database_path())
     
     # create upload directories
     os.makedirs('uploads', exist_ok=True)
@@ -16,33 +17,19 @@ def init_database():
     print("Creating database tables...")
     
     # drop existing tables if they exist
+    connection.execute('DROP TABLE IF EXISTS mastodon_outbox')
     connection.execute('DROP TABLE IF EXISTS post_images')
+    connection.execute('DROP TABLE IF EXISTS image_blobs')
+    connection.execute('DROP TABLE IF EXISTS image_versions')
     connection.execute('DROP TABLE IF EXISTS posts')
+    connection.execute('DROP TABLE IF EXISTS site_stats')
+    connection.execute('DROP TABLE IF EXISTS posts_search')
+    connection.execute('DROP TABLE IF EXISTS month_counts')
+    connection.execute('DROP TABLE IF EXISTS variant_manifest')
+    connection.execute('DROP TABLE IF EXISTS schema_version')
     
-    # create posts table (without image columns)
-    connection.execute('''
-        CREATE TABLE posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            post_date DATE NOT NULL UNIQUE,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            is_private BOOLEAN NOT NULL DEFAULT 0
-        )
-    ''')
-    
-    # create post_images table
-    connection.execute('''
-        CREATE TABLE post_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            post_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            alt_text TEXT,
-            sort_order INTEGER DEFAULT 0,
-            created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
-        )
-    ''')
+    # create tables by applying every migration in migrations/
+    run_migrations(connection, verbose=False)
     
     print("Tables created successfully!")
     
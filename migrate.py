@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+apply database migrations.
+
+migrations live in migrations/ as NNNN_description.sql or NNNN_description.py
+(with an upgrade(conn) function) and are applied in order. the schema_version
+table records which have run, so this is safe to run after every deploy.
+
+usage:
+    python migrate.py                 apply pending migrations
+    python migrate.py --status        list applied and pending migrations
+    python migrate.py --check-plans   fail if a hot query would scan a whole table
+    python migrate.py --dump-schema   rewrite schema.sql from a fresh database
+"""
+
+import argparse
+import importlib.util
+import os
+import re
+import sqlite3
+import sys
+
+from queries import HOT_QUERIES
+
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_PATTERN = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+
+def load_database_path():
+    """
+    database path from config.yaml, like app.py. storage is imported here
+    rather than at the top because it reads config.yaml on import, and the
+    tests import migrate to set up their database before writing theirs.
+    """
+    from storage import DATABASE
+    return DATABASE
+
+
+def available_migrations():
+    """(version, name, path) for every migration file, in order"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_FOLDER)):
+        match = MIGRATION_PATTERN.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_FOLDER, filename)))
+    return migrations
+
+
+def ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def applied_versions(conn):
+    """versions already applied, or an empty set for unversioned databases"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not exists:
+        return set()
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+
+def pending_migrations(conn):
+    """migrations that haven't been applied to this database yet"""
+    applied = applied_versions(conn)
+    return [migration for migration in available_migrations() if migration[0] not in applied]
+
+
+def apply_migration(conn, version, name, path):
+    """apply one migration and record it, all in a single transaction"""
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage the transaction ourselves
+    try:
+        conn.execute('BEGIN')
+        if path.endswith('.sql'):
+            with open(path, 'r') as f:
+                statements = f.read()
+            # executescript would commit first, so run statement by statement
+            for statement in split_statements(statements):
+                conn.execute(statement)
+        else:
+            spec = importlib.util.spec_from_file_location(f'migration_{version:04d}', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(conn)
+        conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def split_statements(script):
+    """split a sql script into complete statements (trigger bodies included)"""
+    statements = []
+    current = ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current)
+            current = ''
+    # anything left over should only be comments
+    leftover = [line for line in current.splitlines() if line.strip() and not line.strip().startswith('--')]
+    if leftover:
+        raise ValueError(f"incomplete sql statement: {leftover[0]}")
+    return statements
+
+
+def run_migrations(conn, verbose=True):
+    """apply all pending migrations, returns how many were applied"""
+    ensure_version_table(conn)
+    pending = pending_migrations(conn)
+    for version, name, path in pending:
+        if verbose:
+            print(f"applying {version:04d}_{name}...")
+        apply_migration(conn, version, name, path)
+    return len(pending)
+
+
+def check_query_plans(conn):
+    """
+    EXPLAIN QUERY PLAN every hot query and report any that scan a whole table
+    instead of using an index. returns the list of (query name, plan line) failures.
+    """
+    failures = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+            detail = row[3]
+            # 'SCAN t' is a full table scan, 'SCAN t USING INDEX' walks an index in order
+            # and 'SCAN t VIRTUAL TABLE' is answered by the full-text index.
+            # 'SCAN (subquery-N)' reads rows a subquery already produced, and
+            # 'SCAN CONSTANT ROW' is a select without a table
+            if (
+                detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail
+                and not detail.startswith(('SCAN (subquery', 'SCAN CONSTANT ROW'))
+            ):
+                failures.append((name, detail))
+    return failures
+
+
+def dump_schema(path='schema.sql'):
+    """write the schema of a freshly migrated database to schema.sql"""
+    conn = sqlite3.connect(':memory:')
+    run_migrations(conn, verbose=False)
+    rows = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+        "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END, name"
+    ).fetchall()
+    conn.close()
+    with open(path, 'w') as f:
+        f.write('-- generated by `python migrate.py --dump-schema`, do not edit.\n')
+        f.write('-- change the schema by adding a file to migrations/ instead.\n\n')
+        for (sql,) in rows:
+            f.write(f'{sql};\n\n')
+    print(f"wrote {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='apply database migrations')
+    parser.add_argument('--status', action='store_true', help='list applied and pending migrations')
+    parser.add_argument('--check-plans', action='store_true', help='check hot query plans use indexes')
+    parser.add_argument('--dump-schema', action='store_true', help='rewrite schema.sql')
+    args = parser.parse_args()
+
+    if args.dump_schema:
+        dump_schema()
+        return 0
+
+    conn = sqlite3.connect(load_database_path())
+    try:
+        if args.status:
+            applied = applied_versions(conn)
+            for version, name, _ in available_migrations():
+                state = 'applied' if version in applied else 'pending'
+                print(f"{version:04d}_{name}: {state}")
+            return 0
+
+        if args.check_plans:
+            failures = check_query_plans(conn)
+            for name, detail in failures:
+                print(f"✗ {name}: {detail}")
+            if failures:
+                return 1
+            print(f"✓ all {len(HOT_QUERIES)} hot queries use indexes")
+            return 0
+
+        count = run_migrations(conn)
+        print(f"database is up to date ({count} migrations applied)")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
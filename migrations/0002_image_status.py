@@ -0,0 +1,11 @@
+"""
+status column used by background image processing.
+existing images already have all their versions, so they are 'ready'.
+skipped when the column was added by the old migrate_image_status.py script.
+"""
+
+
+def upgrade(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(post_images)')]
+    if 'status' not in columns:
+        conn.execute("ALTER TABLE post_images ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
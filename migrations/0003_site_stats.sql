@@ -0,0 +1,69 @@
+-- listing totals, kept up to date by triggers so pages never need a
+-- COUNT(*) over posts or post_images. counts are seeded from the current data,
+-- so this is safe to apply to databases that already have posts.
+
+DROP TABLE IF EXISTS site_stats;
+CREATE TABLE site_stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+-- all posts
+DROP TRIGGER IF EXISTS site_stats_posts_insert;
+CREATE TRIGGER site_stats_posts_insert AFTER INSERT ON posts BEGIN
+    UPDATE site_stats SET value = value + 1 WHERE key = 'posts';
+    UPDATE site_stats SET value = value + (NEW.is_private = 0) WHERE key = 'public_posts';
+END;
+
+-- images are counted before the delete, while the post row still exists
+DROP TRIGGER IF EXISTS site_stats_posts_delete;
+CREATE TRIGGER site_stats_posts_delete BEFORE DELETE ON posts BEGIN
+    UPDATE site_stats SET value = value - 1 WHERE key = 'posts';
+    UPDATE site_stats SET value = value - (OLD.is_private = 0) WHERE key = 'public_posts';
+    UPDATE site_stats SET value = value - (
+        SELECT COUNT(*) FROM post_images WHERE post_id = OLD.id AND status = 'ready'
+    ) * (OLD.is_private = 0) WHERE key = 'public_images';
+END;
+
+DROP TRIGGER IF EXISTS site_stats_posts_privacy;
+CREATE TRIGGER site_stats_posts_privacy AFTER UPDATE OF is_private ON posts
+WHEN (OLD.is_private = 0) != (NEW.is_private = 0) BEGIN
+    UPDATE site_stats SET value = value + (NEW.is_private = 0) - (OLD.is_private = 0)
+        WHERE key = 'public_posts';
+    UPDATE site_stats SET value = value + (
+        SELECT COUNT(*) FROM post_images WHERE post_id = NEW.id AND status = 'ready'
+    ) * ((NEW.is_private = 0) - (OLD.is_private = 0)) WHERE key = 'public_images';
+END;
+
+-- ready images on public posts
+DROP TRIGGER IF EXISTS site_stats_images_insert;
+CREATE TRIGGER site_stats_images_insert AFTER INSERT ON post_images
+WHEN NEW.status = 'ready' BEGIN
+    UPDATE site_stats SET value = value + 1 WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = NEW.post_id) = 0;
+END;
+
+DROP TRIGGER IF EXISTS site_stats_images_status;
+CREATE TRIGGER site_stats_images_status AFTER UPDATE OF status ON post_images
+WHEN (OLD.status = 'ready') != (NEW.status = 'ready') BEGIN
+    UPDATE site_stats SET value = value + (NEW.status = 'ready') - (OLD.status = 'ready')
+        WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = NEW.post_id) = 0;
+END;
+
+-- when the whole post is deleted its images were already subtracted above
+DROP TRIGGER IF EXISTS site_stats_images_delete;
+CREATE TRIGGER site_stats_images_delete AFTER DELETE ON post_images
+WHEN OLD.status = 'ready' BEGIN
+    UPDATE site_stats SET value = value - 1 WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = OLD.post_id) = 0;
+END;
+
+INSERT INTO site_stats (key, value) VALUES
+    ('posts', (SELECT COUNT(*) FROM posts)),
+    ('public_posts', (SELECT COUNT(*) FROM posts WHERE is_private = 0)),
+    ('public_images', (
+        SELECT COUNT(*) FROM post_images pi
+        INNER JOIN posts p ON pi.post_id = p.id
+        WHERE p.is_private = 0 AND pi.status = 'ready'
+    ));
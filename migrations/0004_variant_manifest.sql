@@ -0,0 +1,14 @@
+-- record of which original and profile settings each image variant was made
+-- from, used by regenerate_variants.py to rebuild only stale variants
+
+CREATE TABLE IF NOT EXISTS variant_manifest (
+    filename TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime REAL NOT NULL,
+    profile TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (filename, variant)
+);
@@ -0,0 +1,14 @@
+-- indexes for the queries in app.py. check them with
+-- python migrate.py --check-plans
+
+-- public listings, /rss and /images.xml: WHERE is_private = 0 ORDER BY post_date
+CREATE INDEX IF NOT EXISTS idx_posts_private_date ON posts (is_private, post_date);
+
+-- images of a post (or a page of posts) in display order
+CREATE INDEX IF NOT EXISTS idx_post_images_post_order ON post_images (post_id, sort_order);
+
+-- image gallery, newest first
+CREATE INDEX IF NOT EXISTS idx_post_images_status_created ON post_images (status, created);
+
+-- the background worker's queue. partial, so it stays tiny once images are ready
+CREATE INDEX IF NOT EXISTS idx_post_images_pending ON post_images (id) WHERE status = 'pending';
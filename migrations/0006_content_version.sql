@@ -0,0 +1,57 @@
+-- a version number and timestamp for the public content, bumped on every
+-- post or image write. used for ETag and Last-Modified headers, so unchanged
+-- pages and feeds can be answered with 304 Not Modified without rendering.
+
+INSERT OR REPLACE INTO site_stats (key, value) VALUES
+    ('content_version', 1),
+    ('content_modified', CAST(strftime('%s', 'now') AS INTEGER));
+
+DROP TRIGGER IF EXISTS content_version_posts_insert;
+CREATE TRIGGER content_version_posts_insert AFTER INSERT ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+DROP TRIGGER IF EXISTS content_version_posts_update;
+CREATE TRIGGER content_version_posts_update AFTER UPDATE ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+DROP TRIGGER IF EXISTS content_version_posts_delete;
+CREATE TRIGGER content_version_posts_delete AFTER DELETE ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+DROP TRIGGER IF EXISTS content_version_images_insert;
+CREATE TRIGGER content_version_images_insert AFTER INSERT ON post_images BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+-- the worker claiming an image (pending -> processing) changes nothing visible
+DROP TRIGGER IF EXISTS content_version_images_update;
+CREATE TRIGGER content_version_images_update AFTER UPDATE ON post_images
+WHEN NEW.status != 'processing' BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+DROP TRIGGER IF EXISTS content_version_images_delete;
+CREATE TRIGGER content_version_images_delete AFTER DELETE ON post_images BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
@@ -0,0 +1,53 @@
+-- full-text search over post titles, content and image alt text.
+-- one row per post with rowid = posts.id, kept in sync by triggers.
+
+DROP TABLE IF EXISTS posts_search;
+CREATE VIRTUAL TABLE posts_search USING fts5(
+    title,
+    content,
+    alt_text,
+    tokenize = 'porter unicode61'
+);
+
+DROP TRIGGER IF EXISTS posts_search_insert;
+CREATE TRIGGER posts_search_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_search (rowid, title, content, alt_text)
+        VALUES (NEW.id, NEW.title, NEW.content, '');
+END;
+
+DROP TRIGGER IF EXISTS posts_search_update;
+CREATE TRIGGER posts_search_update AFTER UPDATE OF title, content ON posts BEGIN
+    UPDATE posts_search SET title = NEW.title, content = NEW.content WHERE rowid = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS posts_search_delete;
+CREATE TRIGGER posts_search_delete AFTER DELETE ON posts BEGIN
+    DELETE FROM posts_search WHERE rowid = OLD.id;
+END;
+
+-- alt text of all of a post's images, rebuilt whenever one changes
+DROP TRIGGER IF EXISTS posts_search_images_insert;
+CREATE TRIGGER posts_search_images_insert AFTER INSERT ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = NEW.post_id
+    ) WHERE rowid = NEW.post_id;
+END;
+
+DROP TRIGGER IF EXISTS posts_search_images_update;
+CREATE TRIGGER posts_search_images_update AFTER UPDATE OF alt_text ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = NEW.post_id
+    ) WHERE rowid = NEW.post_id;
+END;
+
+DROP TRIGGER IF EXISTS posts_search_images_delete;
+CREATE TRIGGER posts_search_images_delete AFTER DELETE ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = OLD.post_id
+    ) WHERE rowid = OLD.post_id;
+END;
+
+INSERT INTO posts_search (rowid, title, content, alt_text)
+    SELECT id, title, content, (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = posts.id
+    ) FROM posts;
@@ -0,0 +1,48 @@
+-- posts per month for the archive, kept up to date by triggers so the
+-- archive never needs a GROUP BY over posts. month is 'YYYY-MM'.
+
+DROP TABLE IF EXISTS month_counts;
+CREATE TABLE month_counts (
+    month TEXT PRIMARY KEY,
+    posts INTEGER NOT NULL DEFAULT 0,
+    public_posts INTEGER NOT NULL DEFAULT 0
+);
+
+DROP TRIGGER IF EXISTS month_counts_posts_insert;
+CREATE TRIGGER month_counts_posts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO month_counts (month, posts, public_posts)
+        VALUES (substr(NEW.post_date, 1, 7), 1, NEW.is_private = 0)
+        ON CONFLICT (month) DO UPDATE SET
+            posts = posts + 1,
+            public_posts = public_posts + (NEW.is_private = 0);
+END;
+
+DROP TRIGGER IF EXISTS month_counts_posts_delete;
+CREATE TRIGGER month_counts_posts_delete AFTER DELETE ON posts BEGIN
+    UPDATE month_counts SET
+        posts = posts - 1,
+        public_posts = public_posts - (OLD.is_private = 0)
+        WHERE month = substr(OLD.post_date, 1, 7);
+    DELETE FROM month_counts WHERE month = substr(OLD.post_date, 1, 7) AND posts <= 0;
+END;
+
+-- a moved or re-privacied post leaves its old month and joins its new one
+DROP TRIGGER IF EXISTS month_counts_posts_update;
+CREATE TRIGGER month_counts_posts_update AFTER UPDATE OF post_date, is_private ON posts
+WHEN substr(OLD.post_date, 1, 7) != substr(NEW.post_date, 1, 7)
+    OR (OLD.is_private = 0) != (NEW.is_private = 0) BEGIN
+    UPDATE month_counts SET
+        posts = posts - 1,
+        public_posts = public_posts - (OLD.is_private = 0)
+        WHERE month = substr(OLD.post_date, 1, 7);
+    INSERT INTO month_counts (month, posts, public_posts)
+        VALUES (substr(NEW.post_date, 1, 7), 1, NEW.is_private = 0)
+        ON CONFLICT (month) DO UPDATE SET
+            posts = posts + 1,
+            public_posts = public_posts + (NEW.is_private = 0);
+    DELETE FROM month_counts WHERE month = substr(OLD.post_date, 1, 7) AND posts <= 0;
+END;
+
+INSERT INTO month_counts (month, posts, public_posts)
+    SELECT substr(post_date, 1, 7), COUNT(*), SUM(is_private = 0)
+    FROM posts GROUP BY substr(post_date, 1, 7);
@@ -0,0 +1,35 @@
+-- content-addressed image storage. identical pictures (same pixels after
+-- EXIF rotation) share one stored original and one set of variants, named
+-- after the content hash. post_images rows reference a blob and triggers
+-- keep its ref_count, so files are only removed with the last reference.
+-- images stored before this migration have no blob and keep their own files.
+
+CREATE TABLE IF NOT EXISTS image_blobs (
+    hash TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE post_images ADD COLUMN blob_hash TEXT REFERENCES image_blobs (hash);
+
+CREATE INDEX IF NOT EXISTS idx_image_blobs_unreferenced ON image_blobs (hash) WHERE ref_count <= 0;
+
+DROP TRIGGER IF EXISTS image_blobs_ref_insert;
+CREATE TRIGGER image_blobs_ref_insert AFTER INSERT ON post_images
+WHEN NEW.blob_hash IS NOT NULL BEGIN
+    UPDATE image_blobs SET ref_count = ref_count + 1 WHERE hash = NEW.blob_hash;
+END;
+
+DROP TRIGGER IF EXISTS image_blobs_ref_update;
+CREATE TRIGGER image_blobs_ref_update AFTER UPDATE OF blob_hash ON post_images
+WHEN OLD.blob_hash IS NOT NEW.blob_hash BEGIN
+    UPDATE image_blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+    UPDATE image_blobs SET ref_count = ref_count + 1 WHERE hash = NEW.blob_hash;
+END;
+
+DROP TRIGGER IF EXISTS image_blobs_ref_delete;
+CREATE TRIGGER image_blobs_ref_delete AFTER DELETE ON post_images
+WHEN OLD.blob_hash IS NOT NULL BEGIN
+    UPDATE image_blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+END;
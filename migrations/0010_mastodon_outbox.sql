@@ -0,0 +1,20 @@
+-- cross-posts waiting to go to mastodon. a background dispatcher sends them
+-- with retries, so a slow or unreachable instance never holds up saving a
+-- post. one row per post, so a post is never cross-posted twice.
+
+CREATE TABLE IF NOT EXISTS mastodon_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed TIMESTAMP,
+    last_error TEXT,
+    remote_url TEXT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent TIMESTAMP,
+    FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+);
+
+-- the dispatcher's queue
+CREATE INDEX IF NOT EXISTS idx_mastodon_outbox_due ON mastodon_outbox (next_attempt) WHERE status = 'pending';
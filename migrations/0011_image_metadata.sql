@@ -0,0 +1,32 @@
+-- image metadata recorded when images are processed, so pages and feeds can
+-- give dimensions and sizes without opening files. post_images gets the
+-- size of the original (variants keep its aspect ratio) and a tiny inline
+-- placeholder; image_versions has the exact size of every stored version,
+-- keyed by the stored filename so images sharing a blob share the rows.
+-- fill in images processed before this migration with backfill_image_metadata.py.
+
+ALTER TABLE post_images ADD COLUMN width INTEGER;
+ALTER TABLE post_images ADD COLUMN height INTEGER;
+ALTER TABLE post_images ADD COLUMN placeholder TEXT;
+
+CREATE TABLE IF NOT EXISTS image_versions (
+    filename TEXT NOT NULL,
+    version TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (filename, version)
+) WITHOUT ROWID;
+
+-- versions go with their files: a blob's when its last reference is
+-- removed, an image's own files when the image is deleted
+DROP TRIGGER IF EXISTS image_versions_blob_delete;
+CREATE TRIGGER image_versions_blob_delete AFTER DELETE ON image_blobs BEGIN
+    DELETE FROM image_versions WHERE filename = OLD.filename;
+END;
+
+DROP TRIGGER IF EXISTS image_versions_image_delete;
+CREATE TRIGGER image_versions_image_delete AFTER DELETE ON post_images
+WHEN OLD.blob_hash IS NULL BEGIN
+    DELETE FROM image_versions WHERE filename = OLD.filename;
+END;
@@ -0,0 +1,33 @@
+-- when each post's page last changed, for sitemap lastmod. set by triggers
+-- whenever a post is edited or one of its images is ready or removed.
+
+ALTER TABLE posts ADD COLUMN updated TIMESTAMP;
+
+-- existing posts: their creation, or their newest image if that's later
+UPDATE posts SET updated = MAX(
+    created,
+    COALESCE((SELECT MAX(created) FROM post_images WHERE post_id = posts.id AND status = 'ready'), created)
+);
+
+DROP TRIGGER IF EXISTS posts_updated_insert;
+CREATE TRIGGER posts_updated_insert AFTER INSERT ON posts
+WHEN NEW.updated IS NULL BEGIN
+    UPDATE posts SET updated = NEW.created WHERE id = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS posts_updated_edit;
+CREATE TRIGGER posts_updated_edit AFTER UPDATE OF title, content, post_date, is_private ON posts BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
+
+DROP TRIGGER IF EXISTS posts_updated_image_ready;
+CREATE TRIGGER posts_updated_image_ready AFTER UPDATE OF status ON post_images
+WHEN NEW.status = 'ready' AND OLD.status != 'ready' BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = NEW.post_id;
+END;
+
+DROP TRIGGER IF EXISTS posts_updated_image_delete;
+CREATE TRIGGER posts_updated_image_delete AFTER DELETE ON post_images
+WHEN OLD.status = 'ready' BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = OLD.post_id;
+END;
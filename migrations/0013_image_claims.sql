@@ -0,0 +1,9 @@
+-- when an image worker claimed an image. claims expire after
+-- image_claim_timeout, so images left 'processing' by a process that died
+-- are queued again without taking back ones another process is still
+-- working on.
+
+ALTER TABLE post_images ADD COLUMN claimed TIMESTAMP;
+
+-- images being processed, checked for expired claims on every worker pass
+CREATE INDEX IF NOT EXISTS idx_post_images_processing ON post_images (claimed) WHERE status = 'processing';
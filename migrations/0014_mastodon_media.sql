@@ -0,0 +1,6 @@
+-- ids of the media a cross-post already uploaded, as a json list, so a retry
+-- attaches the same media instead of uploading the images again. cleared
+-- when a failed entry is queued again, since mastodon removes unattached
+-- media after a day.
+
+ALTER TABLE mastodon_outbox ADD COLUMN media_ids TEXT;
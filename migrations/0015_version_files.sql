@@ -0,0 +1,7 @@
+-- the file a version is stored in, when it isn't the default name for its
+-- image. regenerate_variants.py writes remade variants under a new name
+-- (tagged with the settings and original they were made from) and records
+-- it here, since uploads are served as immutable: new bytes under an old
+-- url would stay cached in browsers for up to a year.
+
+ALTER TABLE image_versions ADD COLUMN file TEXT;
@@ -0,0 +1,15 @@
+-- a log of response cache purges: the cache group a write affected and, for
+-- index pages, the range of post dates. a cached response records the last
+-- purge before it was rendered and is only served while no later purge
+-- covers it, so a render that raced a write in another process is dropped
+-- while pages the write didn't touch stay cached. the app keeps the latest
+-- rows only; entries from before the oldest one are rendered again.
+
+CREATE TABLE IF NOT EXISTS response_cache_purges (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_group TEXT NOT NULL,
+    first_date TEXT,
+    last_date TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_purges_group ON response_cache_purges(cache_group, id);
@@ -0,0 +1,227 @@
+"""
+sql of the queries run on every listing, post page and feed. app.py runs
+these, and migrate.py --check-plans EXPLAINs them with the example parameters
+in HOT_QUERIES, so a schema change can't quietly turn one into a table scan.
+nothing here touches config.yaml or the database.
+"""
+
+
+def in_list(count):
+    """placeholders for an IN (...) list of count values"""
+    return ','.join('?' * count)
+
+
+def keyset_page(select, conditions, order_columns, compare=None, descending=True):
+    """
+    one page of select (a query without WHERE or ORDER BY) ordered by
+    order_columns, taking LIMIT ? OFFSET ? after its other parameters.
+    compare ('<' or '>') adds a condition on the order columns against a
+    cursor, whose values come after the conditions' parameters.
+    """
+    where = list(conditions)
+    if compare:
+        where.append(f"({', '.join(order_columns)}) {compare} ({', '.join('?' * len(order_columns))})")
+    sql = select
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    direction = 'DESC' if descending else 'ASC'
+    order = ', '.join(f'{column} {direction}' for column in order_columns)
+    return f'{sql} ORDER BY {order} LIMIT ? OFFSET ?'
+
+
+POST_BY_DATE = 'SELECT * FROM posts WHERE post_date = ?'
+
+# the index, by keyset_page
+POSTS = 'SELECT * FROM posts'
+PUBLIC_POSTS = ['is_private = 0']
+POSTS_ORDER = ['post_date']
+
+# the gallery, by keyset_page
+GALLERY_IMAGES = '''
+    SELECT
+        pi.id,
+        pi.filename,
+        pi.alt_text,
+        pi.created,
+        pi.status,
+        pi.width,
+        pi.height,
+        pi.placeholder,
+        p.post_date,
+        p.id as post_id
+    FROM post_images pi
+    INNER JOIN posts p ON pi.post_id = p.id
+'''
+GALLERY_CONDITIONS = ["p.is_private = 0", "pi.status = 'ready'"]
+GALLERY_ORDER = ['pi.created', 'pi.id']
+
+POST_IMAGES = 'SELECT * FROM post_images WHERE post_id = ? ORDER BY sort_order, id'
+
+UNFINISHED_POST_IMAGES = '''
+    SELECT 1 FROM post_images
+    WHERE post_id = ? AND status IN ('pending', 'processing') LIMIT 1
+'''
+
+
+def images_of_posts(count):
+    return f'SELECT * FROM post_images WHERE post_id IN ({in_list(count)}) ORDER BY post_id, sort_order, id'
+
+
+# titles number each post's images, counted within the feed
+IMAGES_FEED = '''
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY post_date ORDER BY sort_order, id) AS "index"
+    FROM (
+        SELECT
+            pi.id,
+            pi.filename,
+            pi.alt_text,
+            pi.created,
+            pi.sort_order,
+            pi.status,
+            p.post_date,
+            p.title,
+            p.id as post_id
+        FROM post_images pi
+        INNER JOIN posts p ON pi.post_id = p.id
+        WHERE p.is_private = 0 AND pi.status = 'ready'
+        ORDER BY p.post_date DESC, pi.sort_order ASC, pi.id ASC
+        LIMIT 50
+    )
+    ORDER BY post_date DESC, sort_order ASC, id ASC
+'''
+
+
+def recorded_versions(count):
+    return f'SELECT * FROM image_versions WHERE filename IN ({in_list(count)})'
+
+
+def version_sizes(count):
+    """takes the version, then the filenames"""
+    return f'SELECT filename, bytes FROM image_versions WHERE version = ? AND filename IN ({in_list(count)})'
+
+
+PENDING_IMAGES = "SELECT * FROM post_images WHERE status = 'pending' ORDER BY id LIMIT ?"
+
+REQUEUE_ABANDONED_IMAGES = '''
+    UPDATE post_images SET status = 'pending', claimed = NULL
+    WHERE status = 'processing' AND (claimed IS NULL OR claimed < datetime('now', ?))
+'''
+
+UNREFERENCED_BLOBS = 'SELECT hash, filename FROM image_blobs WHERE ref_count <= 0'
+
+DUE_MASTODON_POST = '''
+    SELECT * FROM mastodon_outbox
+    WHERE status = 'pending' AND next_attempt <= CURRENT_TIMESTAMP
+    ORDER BY next_attempt LIMIT 1
+'''
+
+SITEMAP_YEARS = '''
+    SELECT substr(post_date, 1, 4) AS year, MAX(updated) AS lastmod
+    FROM posts WHERE is_private = 0
+    GROUP BY year ORDER BY year
+'''
+
+SITEMAP_YEAR = '''
+    SELECT p.id, p.post_date, p.updated, pi.filename, pi.status
+    FROM posts p
+    LEFT JOIN post_images pi ON pi.post_id = p.id AND pi.status = 'ready'
+    WHERE p.is_private = 0 AND p.post_date >= ? AND p.post_date < ?
+    ORDER BY p.post_date, pi.sort_order, pi.id
+'''
+
+SITE_STAT = 'SELECT value FROM site_stats WHERE key = ?'
+
+
+def archive_months(public_only):
+    column = 'public_posts' if public_only else 'posts'
+    return f'SELECT month, {column} AS count FROM month_counts WHERE {column} > 0 ORDER BY month DESC'
+
+
+def posts_between(public_only):
+    """takes start <= post_date < end"""
+    conditions = ['post_date >= ?', 'post_date < ?'] + (PUBLIC_POSTS if public_only else [])
+    return f"SELECT * FROM posts WHERE {' AND '.join(conditions)} ORDER BY post_date DESC"
+
+
+def search_conditions(public_only):
+    return ' AND '.join(['posts_search MATCH ?'] + (['p.is_private = 0'] if public_only else []))
+
+
+def search_count(public_only):
+    """takes the match query"""
+    return f'''
+        SELECT COUNT(*) FROM posts_search
+        INNER JOIN posts p ON p.id = posts_search.rowid WHERE {search_conditions(public_only)}
+    '''
+
+
+def search_results(public_only):
+    """
+    takes the snippet's highlight start and end, the match query, limit and
+    offset. titles weigh most, then image alt text, then the post body
+    """
+    return f'''
+        SELECT p.*,
+               snippet(posts_search, -1, ?, ?, '…', 24) AS snippet,
+               bm25(posts_search, 10.0, 1.0, 2.0) AS score
+        FROM posts_search
+        INNER JOIN posts p ON p.id = posts_search.rowid
+        WHERE {search_conditions(public_only)}
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    '''
+
+
+# the response cache's purge log (see migrations/0016_response_cache_purges.sql).
+# CACHE_PURGED_SINCE takes the group, the purge id an entry was rendered after
+# and its range of post dates, low twice then high twice (None for open ends)
+CACHE_PURGE_BOUNDS = '''
+    SELECT (SELECT MIN(id) FROM response_cache_purges) AS first,
+           (SELECT MAX(id) FROM response_cache_purges) AS last
+'''
+
+CACHE_PURGED_SINCE = '''
+    SELECT 1 FROM response_cache_purges
+    WHERE cache_group = ? AND id > ?
+      AND (first_date IS NULL OR ((? IS NULL OR ? <= last_date) AND (? IS NULL OR ? >= first_date)))
+    LIMIT 1
+'''
+
+
+# the queries above as app.py runs them, with example parameters
+HOT_QUERIES = {
+    'post by date': (POST_BY_DATE, ('2024-01-01',)),
+    'public posts, first page': (keyset_page(POSTS, PUBLIC_POSTS, POSTS_ORDER), (15, 0)),
+    'public posts, older page': (
+        keyset_page(POSTS, PUBLIC_POSTS, POSTS_ORDER, '<'), ('2024-01-01', 15, 0)
+    ),
+    'public posts, newer page': (
+        keyset_page(POSTS, PUBLIC_POSTS, POSTS_ORDER, '>', descending=False), ('2024-01-01', 15, 0)
+    ),
+    'all posts, older page': (keyset_page(POSTS, [], POSTS_ORDER, '<'), ('2024-01-01', 15, 0)),
+    'images of a post': (POST_IMAGES, (1,)),
+    'unfinished images of a post': (UNFINISHED_POST_IMAGES, (1,)),
+    'images of a page of posts': (images_of_posts(3), (1, 2, 3)),
+    'gallery, older page': (
+        keyset_page(GALLERY_IMAGES, GALLERY_CONDITIONS, GALLERY_ORDER, '<'), ('2024-01-01 00:00:00', 10, 30, 0)
+    ),
+    'images feed': (IMAGES_FEED, ()),
+    'recorded image versions': (recorded_versions(2), ('a.jpg', 'b.jpg')),
+    'feed enclosure sizes': (version_sizes(2), ('optimized', 'a.jpg', 'b.jpg')),
+    'pending images': (PENDING_IMAGES, (4,)),
+    'abandoned images': (REQUEUE_ABANDONED_IMAGES, ('-600 seconds',)),
+    'unreferenced image blobs': (UNREFERENCED_BLOBS, ()),
+    'due mastodon posts': (DUE_MASTODON_POST, ()),
+    'sitemap years': (SITEMAP_YEARS, ()),
+    'sitemap year': (SITEMAP_YEAR, ('2024-01-01', '2025-01-01')),
+    'site stat': (SITE_STAT, ('posts',)),
+    'archive months': (archive_months(public_only=True), ()),
+    'archive month, public': (posts_between(public_only=True), ('2024-05-01', '2024-06-01')),
+    'archive month, all': (posts_between(public_only=False), ('2024-05-01', '2024-06-01')),
+    'search, count': (search_count(public_only=True), ('"walk"',)),
+    'search': (search_results(public_only=True), ('[', ']', '"walk"', 20, 0)),
+    'response cache purge bounds': (CACHE_PURGE_BOUNDS, ()),
+    'response cache purged since': (
+        CACHE_PURGED_SINCE, ('index', 10, '2024-01-01', '2024-01-01', '2024-02-01', '2024-02-01')
+    ),
+}
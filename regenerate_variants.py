@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+regenerate image variants after changing image_variants (or the older
+*_width settings) in config.yaml.
+
+only out-of-date variants are rebuilt. the variant_manifest table records, for every
+image and variant, the hash of the original it was made from and the profile
+settings used, so a variant is regenerated when its original changed, its
+profile changed, or its file is missing. images are processed in parallel and
+progress is committed as each one finishes, so the script can be interrupted
+and run again to pick up where it left off.
+
+uploads are served as immutable, so a variant is never rewritten in place:
+it's remade under a new name (see regenerated_variant_filename) that pages
+switch to once it's recorded. the file it replaces is left for cached pages
+and feeds that still link to it, and goes when the image is deleted.
+
+usage:
+    python regenerate_variants.py [--workers N] [--variant NAME ...] [--force] [--dry-run] [--adopt-existing]
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from storage import (
+    open_db_connection,
+    image_versions_for,
+    record_image_versions,
+    variant_filename,
+    regenerated_variant_filename,
+    IMAGE_VARIANTS,
+    IMAGE_WORKERS,
+    UPLOAD_FOLDER
+)
+from image_processing import create_image_versions, version_info
+
+
+def profile_signature(variant):
+    """stable string of the settings that affect a variant's output"""
+    return json.dumps(
+        {key: variant[key] for key in ('width', 'format', 'quality', 'folder', 'prefix')},
+        sort_keys=True
+    )
+
+
+def file_hash(path):
+    """sha-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_hash_for(original_path, manifest):
+    """
+    hash of an original. reuses the hash in the manifest when the file's size
+    and mtime haven't changed, so unchanged archives aren't re-read every run.
+    """
+    stat = os.stat(original_path)
+    for entry in manifest.values():
+        if entry['source_size'] == stat.st_size and entry['source_mtime'] == stat.st_mtime:
+            return entry['source_hash'], stat
+    return file_hash(original_path), stat
+
+
+def load_manifest(conn, filename):
+    return {
+        row['variant']: row for row in conn.execute(
+            'SELECT * FROM variant_manifest WHERE filename = ?', (filename,)
+        )
+    }
+
+
+def stale_versions(filename, manifest, source_hash, variant_names, force):
+    """
+    versions of an image whose manifest entry or output file is out of date,
+    at their default paths
+    """
+    stale = []
+    for name, output_path, max_width, image_format, quality in image_versions_for(filename):
+        if name not in variant_names:
+            continue
+        entry = manifest.get(name)
+        if (
+            force
+            or entry is None
+            or entry['source_hash'] != source_hash
+            or entry['profile'] != profile_signature(IMAGE_VARIANTS[name])
+            or not os.path.exists(entry['output_path'])
+        ):
+            stale.append((name, output_path, max_width, image_format, quality))
+    return stale
+
+
+def remade_versions(filename, source_hash, versions):
+    """stale versions with the new paths they're written to"""
+    return [
+        (name, os.path.join(IMAGE_VARIANTS[name]['folder'],
+                            regenerated_variant_filename(IMAGE_VARIANTS[name], filename, source_hash)), *rest)
+        for name, _, *rest in versions
+    ]
+
+
+def record_versions(conn, filename, source_hash, stat, versions, results):
+    """
+    store manifest entries for the versions that were written, and point
+    the image's recorded versions at their files
+    """
+    for name, output_path, *_ in versions:
+        if results.get(name):
+            conn.execute(
+                '''INSERT INTO variant_manifest
+                       (filename, variant, source_hash, source_size, source_mtime, profile, output_path)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (filename, variant) DO UPDATE SET
+                       source_hash = excluded.source_hash,
+                       source_size = excluded.source_size,
+                       source_mtime = excluded.source_mtime,
+                       profile = excluded.profile,
+                       output_path = excluded.output_path,
+                       updated = CURRENT_TIMESTAMP''',
+                (filename, name, source_hash, stat.st_size, stat.st_mtime,
+                 profile_signature(IMAGE_VARIANTS[name]), output_path)
+            )
+    # the new files' names, dimensions and sizes, for pages and feeds
+    files = {
+        name: os.path.basename(output_path) for name, output_path, *_ in versions
+        if os.path.basename(output_path) != variant_filename(IMAGE_VARIANTS[name], filename)
+    }
+    record_image_versions(conn, filename, {name: results.get(name) for name, *_ in versions}, files)
+    conn.commit()
+
+
+def find_stale_jobs(conn, variant_names, force=False, dry_run=False, adopt_existing=False):
+    """
+    (filename, original path, source hash, stat, versions to write) for every
+    ready image with stale variants, and how many originals are missing
+    """
+    filenames = [
+        row['filename'] for row in conn.execute(
+            "SELECT DISTINCT filename FROM post_images WHERE status = 'ready' ORDER BY filename"
+        )
+    ]
+    print(f"checking {len(filenames)} images against {len(variant_names)} variants")
+
+    jobs = []
+    missing = 0
+    for filename in filenames:
+        original_path = os.path.join(UPLOAD_FOLDER, filename)
+        if not os.path.exists(original_path):
+            missing += 1
+            print(f"skip: {filename} (original not found)")
+            continue
+        manifest = load_manifest(conn, filename)
+        source_hash, stat = source_hash_for(original_path, manifest)
+        versions = stale_versions(filename, manifest, source_hash, variant_names, force)
+
+        if adopt_existing and not dry_run:
+            # trust variant files made before the manifest existed
+            existing = [v for v in versions if v[0] not in manifest and os.path.exists(v[1])]
+            record_versions(conn, filename, source_hash, stat, existing, {v[0]: version_info(v[1]) for v in existing})
+            versions = [v for v in versions if v not in existing]
+
+        if versions:
+            jobs.append((filename, original_path, source_hash, stat, remade_versions(filename, source_hash, versions)))
+    return jobs, missing
+
+
+def regenerate_variants(workers, variant_names, force=False, dry_run=False, adopt_existing=False):
+    conn = open_db_connection()
+
+    # work out what's stale before starting any processes
+    jobs, missing = find_stale_jobs(conn, variant_names, force, dry_run, adopt_existing)
+    stale_count = sum(len(job[-1]) for job in jobs)
+    print(f"{stale_count} stale variants across {len(jobs)} images")
+    if dry_run or not jobs:
+        conn.close()
+        return
+
+    success = 0
+    errors = 0
+    total = len(jobs)
+    interrupted = False
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    try:
+        # one thread per process, the parallelism comes from the pool
+        futures = {
+            pool.submit(create_image_versions, original_path, versions, 1): (filename, source_hash, stat, versions)
+            for filename, original_path, source_hash, stat, versions in jobs
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            filename, source_hash, stat, versions = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"[{done}/{total}] ✗ {filename}: {e}")
+                errors += 1
+                continue
+
+            record_versions(conn, filename, source_hash, stat, versions, results)
+            failed = [name for name, ok in results.items() if not ok]
+            if failed:
+                print(f"[{done}/{total}] ✗ {filename}: failed {', '.join(failed)}")
+                errors += 1
+            else:
+                print(f"[{done}/{total}] ✓ {filename}: {', '.join(results)}")
+                success += 1
+    except KeyboardInterrupt:
+        print("\ninterrupted - finished images are saved, run again to resume")
+        interrupted = True
+        raise
+    finally:
+        # on ctrl-c, drop the queued images instead of waiting for them
+        pool.shutdown(wait=not interrupted, cancel_futures=interrupted)
+        conn.close()
+
+    print("=" * 50)
+    print("regeneration complete!")
+    print(f"  success: {success} images")
+    print(f"  errors: {errors} images")
+    print(f"  missing originals: {missing}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='regenerate out-of-date image variants')
+    parser.add_argument(
+        '--workers', type=int, default=max(IMAGE_WORKERS, 1),
+        help='number of processes to use (default: image_workers from config)'
+    )
+    parser.add_argument(
+        '--variant', action='append', choices=sorted(IMAGE_VARIANTS),
+        help='only check this variant (can be repeated)'
+    )
+    parser.add_argument('--force', action='store_true', help='regenerate even if up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only report what is stale')
+    parser.add_argument(
+        '--adopt-existing', action='store_true',
+        help='record variant files that already exist as up to date instead of regenerating them '
+             '(use once, on archives processed before the manifest existed)'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        regenerate_variants(
+            args.workers,
+            set(args.variant or IMAGE_VARIANTS),
+            force=args.force,
+            dry_run=args.dry_run,
+            adopt_existing=args.adopt_existing
+        )
+    except KeyboardInterrupt:
+        pass
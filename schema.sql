@@ -1,4 +1,51 @@
-DROP TABLE IF EXISTS posts;
+-- generated by `python migrate.py --dump-schema`, do not edit.
+-- change the schema by adding a file to migrations/ instead.
+
+CREATE TABLE image_blobs (
+    hash TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    ref_count INTEGER NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE image_versions (
+    filename TEXT NOT NULL,
+    version TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    bytes INTEGER NOT NULL, file TEXT,
+    PRIMARY KEY (filename, version)
+) WITHOUT ROWID;
+
+CREATE TABLE mastodon_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimed TIMESTAMP,
+    last_error TEXT,
+    remote_url TEXT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent TIMESTAMP, media_ids TEXT,
+    FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+);
+
+CREATE TABLE month_counts (
+    month TEXT PRIMARY KEY,
+    posts INTEGER NOT NULL DEFAULT 0,
+    public_posts INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE post_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    alt_text TEXT,
+    sort_order INTEGER DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, status TEXT NOT NULL DEFAULT 'ready', blob_hash TEXT REFERENCES image_blobs (hash), width INTEGER, height INTEGER, placeholder TEXT, claimed TIMESTAMP,
+    FOREIGN KEY (post_id) REFERENCES posts (id) ON DELETE CASCADE
+);
 
 CREATE TABLE posts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -6,7 +53,259 @@ CREATE TABLE posts (
     post_date DATE NOT NULL UNIQUE,
     title TEXT NOT NULL,
     content TEXT NOT NULL,
-    is_private BOOLEAN NOT NULL DEFAULT 0,
-    image_filename TEXT,
-    image_alt_text TEXT
-);
\ No newline at end of file
+    is_private BOOLEAN NOT NULL DEFAULT 0
+, updated TIMESTAMP);
+
+CREATE VIRTUAL TABLE posts_search USING fts5(
+    title,
+    content,
+    alt_text,
+    tokenize = 'porter unicode61'
+);
+
+CREATE TABLE 'posts_search_config'(k PRIMARY KEY, v) WITHOUT ROWID;
+
+CREATE TABLE 'posts_search_content'(id INTEGER PRIMARY KEY, c0, c1, c2);
+
+CREATE TABLE 'posts_search_data'(id INTEGER PRIMARY KEY, block BLOB);
+
+CREATE TABLE 'posts_search_docsize'(id INTEGER PRIMARY KEY, sz BLOB);
+
+CREATE TABLE 'posts_search_idx'(segid, term, pgno, PRIMARY KEY(segid, term)) WITHOUT ROWID;
+
+CREATE TABLE response_cache_purges (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_group TEXT NOT NULL,
+    first_date TEXT,
+    last_date TEXT
+);
+
+CREATE TABLE schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+
+CREATE TABLE site_stats (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE variant_manifest (
+    filename TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    source_hash TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime REAL NOT NULL,
+    profile TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (filename, variant)
+);
+
+CREATE INDEX idx_image_blobs_unreferenced ON image_blobs (hash) WHERE ref_count <= 0;
+
+CREATE INDEX idx_mastodon_outbox_due ON mastodon_outbox (next_attempt) WHERE status = 'pending';
+
+CREATE INDEX idx_post_images_pending ON post_images (id) WHERE status = 'pending';
+
+CREATE INDEX idx_post_images_post_order ON post_images (post_id, sort_order);
+
+CREATE INDEX idx_post_images_processing ON post_images (claimed) WHERE status = 'processing';
+
+CREATE INDEX idx_post_images_status_created ON post_images (status, created);
+
+CREATE INDEX idx_posts_private_date ON posts (is_private, post_date);
+
+CREATE INDEX idx_response_cache_purges_group ON response_cache_purges(cache_group, id);
+
+CREATE TRIGGER content_version_images_delete AFTER DELETE ON post_images BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER content_version_images_insert AFTER INSERT ON post_images BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER content_version_images_update AFTER UPDATE ON post_images
+WHEN NEW.status != 'processing' BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER content_version_posts_delete AFTER DELETE ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER content_version_posts_insert AFTER INSERT ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER content_version_posts_update AFTER UPDATE ON posts BEGIN
+    UPDATE site_stats SET value = CASE key
+        WHEN 'content_version' THEN value + 1
+        ELSE CAST(strftime('%s', 'now') AS INTEGER) END
+    WHERE key IN ('content_version', 'content_modified');
+END;
+
+CREATE TRIGGER image_blobs_ref_delete AFTER DELETE ON post_images
+WHEN OLD.blob_hash IS NOT NULL BEGIN
+    UPDATE image_blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+END;
+
+CREATE TRIGGER image_blobs_ref_insert AFTER INSERT ON post_images
+WHEN NEW.blob_hash IS NOT NULL BEGIN
+    UPDATE image_blobs SET ref_count = ref_count + 1 WHERE hash = NEW.blob_hash;
+END;
+
+CREATE TRIGGER image_blobs_ref_update AFTER UPDATE OF blob_hash ON post_images
+WHEN OLD.blob_hash IS NOT NEW.blob_hash BEGIN
+    UPDATE image_blobs SET ref_count = ref_count - 1 WHERE hash = OLD.blob_hash;
+    UPDATE image_blobs SET ref_count = ref_count + 1 WHERE hash = NEW.blob_hash;
+END;
+
+CREATE TRIGGER image_versions_blob_delete AFTER DELETE ON image_blobs BEGIN
+    DELETE FROM image_versions WHERE filename = OLD.filename;
+END;
+
+CREATE TRIGGER image_versions_image_delete AFTER DELETE ON post_images
+WHEN OLD.blob_hash IS NULL BEGIN
+    DELETE FROM image_versions WHERE filename = OLD.filename;
+END;
+
+CREATE TRIGGER month_counts_posts_delete AFTER DELETE ON posts BEGIN
+    UPDATE month_counts SET
+        posts = posts - 1,
+        public_posts = public_posts - (OLD.is_private = 0)
+        WHERE month = substr(OLD.post_date, 1, 7);
+    DELETE FROM month_counts WHERE month = substr(OLD.post_date, 1, 7) AND posts <= 0;
+END;
+
+CREATE TRIGGER month_counts_posts_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO month_counts (month, posts, public_posts)
+        VALUES (substr(NEW.post_date, 1, 7), 1, NEW.is_private = 0)
+        ON CONFLICT (month) DO UPDATE SET
+            posts = posts + 1,
+            public_posts = public_posts + (NEW.is_private = 0);
+END;
+
+CREATE TRIGGER month_counts_posts_update AFTER UPDATE OF post_date, is_private ON posts
+WHEN substr(OLD.post_date, 1, 7) != substr(NEW.post_date, 1, 7)
+    OR (OLD.is_private = 0) != (NEW.is_private = 0) BEGIN
+    UPDATE month_counts SET
+        posts = posts - 1,
+        public_posts = public_posts - (OLD.is_private = 0)
+        WHERE month = substr(OLD.post_date, 1, 7);
+    INSERT INTO month_counts (month, posts, public_posts)
+        VALUES (substr(NEW.post_date, 1, 7), 1, NEW.is_private = 0)
+        ON CONFLICT (month) DO UPDATE SET
+            posts = posts + 1,
+            public_posts = public_posts + (NEW.is_private = 0);
+    DELETE FROM month_counts WHERE month = substr(OLD.post_date, 1, 7) AND posts <= 0;
+END;
+
+CREATE TRIGGER posts_search_delete AFTER DELETE ON posts BEGIN
+    DELETE FROM posts_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER posts_search_images_delete AFTER DELETE ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = OLD.post_id
+    ) WHERE rowid = OLD.post_id;
+END;
+
+CREATE TRIGGER posts_search_images_insert AFTER INSERT ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = NEW.post_id
+    ) WHERE rowid = NEW.post_id;
+END;
+
+CREATE TRIGGER posts_search_images_update AFTER UPDATE OF alt_text ON post_images BEGIN
+    UPDATE posts_search SET alt_text = (
+        SELECT COALESCE(group_concat(alt_text, ' '), '') FROM post_images WHERE post_id = NEW.post_id
+    ) WHERE rowid = NEW.post_id;
+END;
+
+CREATE TRIGGER posts_search_insert AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_search (rowid, title, content, alt_text)
+        VALUES (NEW.id, NEW.title, NEW.content, '');
+END;
+
+CREATE TRIGGER posts_search_update AFTER UPDATE OF title, content ON posts BEGIN
+    UPDATE posts_search SET title = NEW.title, content = NEW.content WHERE rowid = NEW.id;
+END;
+
+CREATE TRIGGER posts_updated_edit AFTER UPDATE OF title, content, post_date, is_private ON posts BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER posts_updated_image_delete AFTER DELETE ON post_images
+WHEN OLD.status = 'ready' BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = OLD.post_id;
+END;
+
+CREATE TRIGGER posts_updated_image_ready AFTER UPDATE OF status ON post_images
+WHEN NEW.status = 'ready' AND OLD.status != 'ready' BEGIN
+    UPDATE posts SET updated = CURRENT_TIMESTAMP WHERE id = NEW.post_id;
+END;
+
+CREATE TRIGGER posts_updated_insert AFTER INSERT ON posts
+WHEN NEW.updated IS NULL BEGIN
+    UPDATE posts SET updated = NEW.created WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER site_stats_images_delete AFTER DELETE ON post_images
+WHEN OLD.status = 'ready' BEGIN
+    UPDATE site_stats SET value = value - 1 WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = OLD.post_id) = 0;
+END;
+
+CREATE TRIGGER site_stats_images_insert AFTER INSERT ON post_images
+WHEN NEW.status = 'ready' BEGIN
+    UPDATE site_stats SET value = value + 1 WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = NEW.post_id) = 0;
+END;
+
+CREATE TRIGGER site_stats_images_status AFTER UPDATE OF status ON post_images
+WHEN (OLD.status = 'ready') != (NEW.status = 'ready') BEGIN
+    UPDATE site_stats SET value = value + (NEW.status = 'ready') - (OLD.status = 'ready')
+        WHERE key = 'public_images'
+        AND (SELECT is_private FROM posts WHERE id = NEW.post_id) = 0;
+END;
+
+CREATE TRIGGER site_stats_posts_delete BEFORE DELETE ON posts BEGIN
+    UPDATE site_stats SET value = value - 1 WHERE key = 'posts';
+    UPDATE site_stats SET value = value - (OLD.is_private = 0) WHERE key = 'public_posts';
+    UPDATE site_stats SET value = value - (
+        SELECT COUNT(*) FROM post_images WHERE post_id = OLD.id AND status = 'ready'
+    ) * (OLD.is_private = 0) WHERE key = 'public_images';
+END;
+
+CREATE TRIGGER site_stats_posts_insert AFTER INSERT ON posts BEGIN
+    UPDATE site_stats SET value = value + 1 WHERE key = 'posts';
+    UPDATE site_stats SET value = value + (NEW.is_private = 0) WHERE key = 'public_posts';
+END;
+
+CREATE TRIGGER site_stats_posts_privacy AFTER UPDATE OF is_private ON posts
+WHEN (OLD.is_private = 0) != (NEW.is_private = 0) BEGIN
+    UPDATE site_stats SET value = value + (NEW.is_private = 0) - (OLD.is_private = 0)
+        WHERE key = 'public_posts';
+    UPDATE site_stats SET value = value + (
+        SELECT COUNT(*) FROM post_images WHERE post_id = NEW.id AND status = 'ready'
+    ) * ((NEW.is_private = 0) - (OLD.is_private = 0)) WHERE key = 'public_images';
+END;
+
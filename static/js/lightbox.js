@@ -1,11 +1,27 @@
-// simple image lightbox with lazy loading
+// simple image lightbox with lazy loading.
+// shows the smallest variant that fills the screen (links carry a
+// data-variants list from the server) and only fetches the full-size
+// original when the image is clicked to zoom in.
 (function() {
     'use strict';
     
+    const MAX_PRELOADS = 2; // images fetched ahead of time, at most
+    
     let currentImages = [];
     let currentIndex = 0;
     let lightbox = null;
-    let preloadedImages = new Set(); // track which images we've preloaded
+    let zoomed = false;
+    let loadToken = 0; // ignores loads for images we've navigated away from
+    let preloads = new Map(); // url -> Image, oldest first
+    
+    // formats the browser can show, besides jpeg
+    const supportedTypes = new Set(['image/jpeg']);
+    (function detectWebp() {
+        const canvas = document.createElement('canvas');
+        if (canvas.toDataURL && canvas.toDataURL('image/webp').startsWith('data:image/webp')) {
+            supportedTypes.add('image/webp');
+        }
+    })();
 
     function createLightbox() {
         lightbox = document.createElement('div');
@@ -25,6 +41,7 @@
         lightbox.querySelector('.lightbox-close').onclick = closeLightbox;
         lightbox.querySelector('.lightbox-prev').onclick = () => navigate(-1);
         lightbox.querySelector('.lightbox-next').onclick = () => navigate(1);
+        lightbox.querySelector('.lightbox-img').onclick = toggleZoom;
         
         // close when clicking background (lightbox or lightbox-content, but not image or buttons)
         lightbox.onclick = (e) => { 
@@ -44,13 +61,52 @@
         }
     }
 
+    function variantUrl(image) {
+        // the smallest variant at least as wide as the lightbox will show it
+        // on this screen, or the largest one there is
+        const candidates = image.variants.filter(v => supportedTypes.has(v.type));
+        if (candidates.length === 0) return image.fullUrl;
+        
+        const boxWidth = window.innerWidth * 0.9;
+        const boxHeight = window.innerHeight * 0.9;
+        const ratio = window.devicePixelRatio || 1;
+        let best = null;
+        for (const variant of candidates) {
+            const shownWidth = variant.height
+                ? Math.min(boxWidth, boxHeight * variant.width / variant.height)
+                : boxWidth;
+            const bigEnough = variant.width >= shownWidth * ratio;
+            const bestBigEnough = best && best.width >= shownWidth * ratio;
+            if (
+                !best
+                || (bigEnough && (!bestBigEnough || variant.width < best.width))
+                || (!bigEnough && !bestBigEnough && variant.width > best.width)
+                // same width in a smaller format
+                || (variant.width === best.width && variant.type !== 'image/jpeg')
+            ) {
+                best = variant;
+            }
+        }
+        return best.url;
+    }
+
     function preloadImage(url) {
-        // don't preload if we already have
-        if (preloadedImages.has(url)) return;
+        if (preloads.has(url)) return;
         
+        // keep the preload set small, cancelling the oldest fetch
+        while (preloads.size >= MAX_PRELOADS) {
+            const [oldUrl, oldImg] = preloads.entries().next().value;
+            oldImg.src = '';
+            preloads.delete(oldUrl);
+        }
         const img = new Image();
-        img.onload = () => preloadedImages.add(url);
         img.src = url;
+        preloads.set(url, img);
+    }
+
+    function clearPreloads() {
+        preloads.forEach(img => { img.src = ''; });
+        preloads.clear();
     }
 
     function getNextIndex(direction) {
@@ -64,7 +120,7 @@
         if (!lightbox) createLightbox();
         currentImages = images;
         currentIndex = index;
-        preloadedImages.clear(); // reset preload cache for new image set
+        clearPreloads(); // new image set
         updateLightbox();
         lightbox.style.display = 'block';
         document.body.style.overflow = 'hidden';
@@ -72,7 +128,7 @@
         // preload next image when lightbox opens (if there are multiple images)
         if (currentImages.length > 1) {
             const nextIndex = getNextIndex(1);
-            preloadImage(currentImages[nextIndex].fullUrl);
+            preloadImage(variantUrl(currentImages[nextIndex]));
         }
     }
 
@@ -80,6 +136,7 @@
         if (lightbox) {
             lightbox.style.display = 'none';
             document.body.style.overflow = '';
+            clearPreloads();
         }
     }
 
@@ -92,32 +149,28 @@
         // preload the next image in the direction we're going
         if (currentImages.length > 1) {
             const nextIndex = getNextIndex(direction);
-            preloadImage(currentImages[nextIndex].fullUrl);
+            preloadImage(variantUrl(currentImages[nextIndex]));
         }
     }
 
-    function updateLightbox() {
-        if (!lightbox) return;
-        
+    function showImage(url, alt) {
         const img = lightbox.querySelector('.lightbox-img');
         const loading = lightbox.querySelector('.lightbox-loading');
-        const current = currentImages[currentIndex];
+        const token = ++loadToken;
         
-        // show loading, hide image
+        // show loading until the new image is ready
         loading.style.display = 'block';
-        img.style.display = 'none';
         
-        // create new image to preload
         const newImg = new Image();
         newImg.onload = function() {
-            // image loaded successfully
+            if (token !== loadToken) return; // navigated away meanwhile
             img.src = this.src;
-            img.alt = current.alt;
+            img.alt = alt;
             loading.style.display = 'none';
             img.style.display = 'block';
-            preloadedImages.add(current.fullUrl); // mark as preloaded
         };
         newImg.onerror = function() {
+            if (token !== loadToken) return;
             // image failed to load
             loading.textContent = 'failed to load image';
             setTimeout(() => {
@@ -125,9 +178,30 @@
                 loading.textContent = 'loading...'; // reset for next time
             }, 2000);
         };
+        newImg.src = url;
+    }
+
+    function setZoom(value) {
+        zoomed = value;
+        lightbox.classList.toggle('zoomed', zoomed);
+    }
+
+    function toggleZoom() {
+        const current = currentImages[currentIndex];
+        setZoom(!zoomed);
+        // the full-size original is only fetched for zooming in
+        if (zoomed) showImage(current.fullUrl, current.alt);
+    }
+
+    function updateLightbox() {
+        if (!lightbox) return;
         
-        // start loading the image
-        newImg.src = current.fullUrl;
+        const img = lightbox.querySelector('.lightbox-img');
+        const current = currentImages[currentIndex];
+        
+        setZoom(false);
+        img.style.display = 'none';
+        showImage(variantUrl(current), current.alt);
         
         // hide nav buttons if only one image
         const prevBtn = lightbox.querySelector('.lightbox-prev');
@@ -141,6 +215,22 @@
         }
     }
 
+    function lightboxImageData(link) {
+        // the link's href is the full-size original, variants come from the server
+        const img = link.querySelector('img');
+        let variants = [];
+        try {
+            variants = JSON.parse(link.dataset.variants || '[]');
+        } catch (e) {
+            // fall back to the original
+        }
+        return {
+            fullUrl: link.href,
+            alt: img ? img.alt : '',
+            variants: variants
+        };
+    }
+
     function initializeLightbox() {
         // find all articles (posts)
         document.querySelectorAll('article').forEach(article => {
@@ -148,14 +238,7 @@
             if (imageLinks.length === 0) return;
 
             // collect image data for this post
-            const images = Array.from(imageLinks).map(link => {
-                const fullUrl = link.href; // use original href as full-size URL
-                const img = link.querySelector('img');
-                return {
-                    fullUrl: fullUrl,
-                    alt: img.alt
-                };
-            });
+            const images = Array.from(imageLinks).map(lightboxImageData);
 
             // add click handlers (don't modify href)
             imageLinks.forEach((link, index) => {
@@ -170,14 +253,7 @@
         if (document.querySelectorAll('article').length === 0) {
             const imageLinks = document.querySelectorAll('.post-image a');
             if (imageLinks.length > 0) {
-                const images = Array.from(imageLinks).map(link => {
-                    const fullUrl = link.href; // use original href as full-size URL
-                    const img = link.querySelector('img');
-                    return {
-                        fullUrl: fullUrl,
-                        alt: img.alt
-                    };
-                });
+                const images = Array.from(imageLinks).map(lightboxImageData);
 
                 imageLinks.forEach((link, index) => {
                     link.addEventListener('click', function(e) {
@@ -191,6 +267,7 @@
 
     // Expose openLightbox globally for image grid page
     window.openImageLightbox = openLightbox;
+    window.lightboxImageData = lightboxImageData;
 
     // initialize when DOM is ready
     if (document.readyState === 'loading') {
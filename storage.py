@@ -0,0 +1,200 @@
+"""
+config, database connections and where image files are stored, shared by
+app.py and the maintenance scripts. importing this only reads config.yaml,
+so scripts (and the process pool workers they spawn, which import the
+script again) can use it without setting up the flask app.
+"""
+
+import glob
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import yaml
+
+from image_processing import format_supported, IMAGE_FORMATS
+
+
+def config_warning(message):
+    """print a config warning once, from the main process rather than every pool worker"""
+    if multiprocessing.parent_process() is None:
+        print(message)
+
+
+# load configs
+def load_config():
+    try:
+        with open('config.yaml', 'r') as f:
+            return yaml.safe_load(f)
+    except FileNotFoundError:
+        config_warning("config.yaml not found, using defaults")
+        return {}
+
+
+config = load_config()
+
+
+# application settings - ensure numeric values are integers
+def get_int_config(key, default):
+    """get config value as integer, handling string values from YAML"""
+    value = config.get(key, default)
+    if value is None:
+        return default
+
+    # if it's already an integer, return it
+    if isinstance(value, int):
+        return value
+
+    # if it's a string, try to convert it
+    if isinstance(value, str):
+        try:
+            # handle expressions like "16 * 1024 * 1024"
+            if '*' in value or '+' in value or '-' in value:
+                # only evaluate simple arithmetic expressions for safety
+                if all(c in '0123456789 +-*()' for c in value):
+                    return int(eval(value))
+            else:
+                return int(value)
+        except (ValueError, SyntaxError):
+            config_warning(f"Warning: Could not parse config value '{key}': {value}, using default: {default}")
+            return default
+
+    return default
+
+
+UPLOAD_FOLDER = config.get('upload_folder', 'uploads')
+OPTIMIZED_FOLDER = config.get('optimized_folder', 'uploads/optimized')
+OPTIMIZED_WIDTH = get_int_config('optimized_width', 1200)
+WEBRING_SMALL_FOLDER = config.get('webring_small_folder', 'uploads/webring_small')
+WEBRING_TINY_FOLDER = config.get('webring_tiny_folder', 'uploads/webring_tiny')
+WEBRING_SMALL_WIDTH = get_int_config('webring_small_width', 960)
+WEBRING_TINY_WIDTH = get_int_config('webring_tiny_width', 256)
+IMAGE_WORKERS = get_int_config('image_workers', min(4, os.cpu_count() or 1))  # 0 = no process pool
+DATABASE = config.get('database', 'database.db')
+SQLITE_CACHE_SIZE = get_int_config('sqlite_cache_size', -16000)  # negative = KiB
+SQLITE_MMAP_SIZE = get_int_config('sqlite_mmap_size', 64 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT = get_int_config('sqlite_busy_timeout', 5000)  # milliseconds
+
+
+def open_db_connection():
+    """open a new sqlite connection with WAL mode and tuned pragmas"""
+    conn = sqlite3.connect(DATABASE, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers keep going while an upload transaction commits
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+    return conn
+
+
+# image variant profiles, generated for every upload alongside the original
+def load_image_variants():
+    """
+    read the image_variants list from config. each profile has a name, width,
+    format (jpeg, webp or avif) and quality, plus an optional folder and
+    filename prefix. templates and feeds rely on the optimized, webring_small
+    and webring_tiny profiles, so they are filled in from the older
+    *_width/*_folder settings when not listed.
+    """
+    defaults = [
+        {'name': 'optimized', 'width': OPTIMIZED_WIDTH, 'folder': OPTIMIZED_FOLDER, 'prefix': 'opt_'},
+        {'name': 'webring_small', 'width': WEBRING_SMALL_WIDTH, 'folder': WEBRING_SMALL_FOLDER},
+        {'name': 'webring_tiny', 'width': WEBRING_TINY_WIDTH, 'folder': WEBRING_TINY_FOLDER},
+    ]
+    configured = config.get('image_variants') or []
+    configured_names = {profile.get('name') for profile in configured}
+    profiles = configured + [p for p in defaults if p['name'] not in configured_names]
+
+    variants = {}
+    for profile in profiles:
+        name = profile['name']
+        image_format = str(profile.get('format', 'jpeg')).lower()
+        if not format_supported(image_format):
+            config_warning(f"Warning: image format '{image_format}' is not supported, skipping variant '{name}'")
+            continue
+        variants[name] = {
+            'name': name,
+            'width': int(profile['width']),
+            'format': image_format,
+            'quality': int(profile.get('quality', 85)),
+            'folder': profile.get('folder', os.path.join(UPLOAD_FOLDER, name)),
+            'prefix': profile.get('prefix', ''),
+        }
+    return variants
+
+
+IMAGE_VARIANTS = load_image_variants()
+
+
+def variant_filename(variant, base_filename):
+    """
+    filename of an upload's variant. jpeg variants keep the upload's filename
+    (as they always have), other formats get their own extension.
+    """
+    if variant['format'] == 'jpeg':
+        return f"{variant['prefix']}{base_filename}"
+    stem, _ = os.path.splitext(base_filename)
+    return f"{variant['prefix']}{stem}.{IMAGE_FORMATS[variant['format']]['extension']}"
+
+
+def regenerated_variant_filename(variant, base_filename, source_hash):
+    """
+    filename of a variant remade by regenerate_variants.py. it's tagged with
+    the settings and original (source_hash) it was made from, so a remade
+    variant gets a new url instead of new bytes under one served as immutable.
+    """
+    stem, _ = os.path.splitext(base_filename)
+    made_from = f"{source_hash} {variant['width']} {variant['format']} {variant['quality']}"
+    tag = hashlib.sha256(made_from.encode('utf-8')).hexdigest()[:12]
+    return f"{variant['prefix']}{stem}.{tag}.{IMAGE_FORMATS[variant['format']]['extension']}"
+
+
+def regenerated_variant_paths(base_filename):
+    """every remade variant file of an upload on disk, current or superseded"""
+    stem, _ = os.path.splitext(base_filename)
+    paths = []
+    for variant in IMAGE_VARIANTS.values():
+        pattern = f"{glob.escape(variant['prefix'] + stem)}.*.{IMAGE_FORMATS[variant['format']]['extension']}"
+        paths.extend(glob.glob(os.path.join(glob.escape(variant['folder']), pattern)))
+    return paths
+
+
+def image_versions_for(base_filename):
+    """
+    (name, output_path, max_width, format, quality) for the original
+    and every configured variant of an upload
+    """
+    versions = [('original', os.path.join(UPLOAD_FOLDER, base_filename), None, 'jpeg', 95)]
+    for variant in IMAGE_VARIANTS.values():
+        versions.append((
+            variant['name'],
+            os.path.join(variant['folder'], variant_filename(variant, base_filename)),
+            variant['width'],
+            variant['format'],
+            variant['quality']
+        ))
+    return versions
+
+
+def record_image_versions(conn, filename, results, files=None, replace=True):
+    """
+    store (width, height, bytes) of the versions of a stored image, in the
+    caller's transaction. files maps versions to the file they were written
+    to when it isn't the default name. replace=False keeps versions that are
+    already recorded, which may point at remade files.
+    """
+    on_conflict = '''DO UPDATE SET
+        width = excluded.width, height = excluded.height, bytes = excluded.bytes, file = excluded.file'''
+    if not replace:
+        on_conflict = 'DO NOTHING'
+    for version, info in results.items():
+        if info:
+            conn.execute(
+                f'''INSERT INTO image_versions (filename, version, width, height, bytes, file)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (filename, version) {on_conflict}''',
+                (filename, version, *info, (files or {}).get(version))
+            )
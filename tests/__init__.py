@@ -0,0 +1,58 @@
+"""
+tests run from a temporary folder with their own config.yaml and migrated
+database, set up here before any test imports app.py or storage.py (which
+read config.yaml from the working directory on import), so they never touch
+a real journal.
+
+run from the repository root with: python3 -m unittest
+"""
+
+import atexit
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+
+import yaml
+
+from migrate import run_migrations
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# a fake instance for the mastodon tests listens here
+MASTODON_PORT = free_port()
+
+TEST_CONFIG = {
+    'database': 'database.db',
+    'site_url': 'http://journal.test',
+    'precompress_static': False,
+    'image_workers': 0,
+    'image_variants': [
+        {'name': 'optimized_webp', 'width': 1200, 'format': 'webp', 'quality': 80},
+        {'name': 'webring_tiny_webp', 'width': 256, 'format': 'webp', 'quality': 75},
+    ],
+    'mastodon': {
+        'instance_url': f'http://127.0.0.1:{MASTODON_PORT}',
+        'access_token': 'test-token',
+        'privacy': 'private',
+    },
+    'mastodon_request_timeout': 1,
+}
+
+TEST_FOLDER = tempfile.mkdtemp(prefix='journal-tests-')
+atexit.register(shutil.rmtree, TEST_FOLDER, ignore_errors=True)
+os.chdir(TEST_FOLDER)
+with open('config.yaml', 'w') as f:
+    yaml.safe_dump(TEST_CONFIG, f)
+
+conn = sqlite3.connect(TEST_CONFIG['database'])
+run_migrations(conn, verbose=False)
+conn.close()
+
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
@@ -0,0 +1,140 @@
+"""
+archive counts: the month_counts triggers follow inserts, deletes, moved
+posts and privacy changes, and the archive pages show the counts and posts
+this visitor can see.
+"""
+
+import re
+import unittest
+
+import app as journal
+
+
+def write(sql, params=()):
+    conn = journal.open_db_connection()
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def month_count(month):
+    conn = journal.open_db_connection()
+    try:
+        row = conn.execute('SELECT posts, public_posts FROM month_counts WHERE month = ?', (month,)).fetchone()
+        return tuple(row) if row else None
+    finally:
+        conn.close()
+
+
+class MonthCountsTest(unittest.TestCase):
+    def add(self, post_date, is_private=0):
+        write(
+            'INSERT INTO posts (post_date, title, content, is_private) VALUES (?, ?, ?, ?)',
+            (post_date, 'counted', 'some text', is_private)
+        )
+
+    def test_inserts_and_deletes(self):
+        self.add('1994-05-01')
+        self.add('1994-05-02', is_private=1)
+        self.assertEqual(month_count('1994-05'), (2, 1))
+
+        write("DELETE FROM posts WHERE post_date = '1994-05-01'")
+        self.assertEqual(month_count('1994-05'), (1, 0))
+        write("DELETE FROM posts WHERE post_date = '1994-05-02'")
+        self.assertIsNone(month_count('1994-05'))
+
+    def test_privacy_changes(self):
+        self.add('1994-06-01')
+        write("UPDATE posts SET is_private = 1 WHERE post_date = '1994-06-01'")
+        self.assertEqual(month_count('1994-06'), (1, 0))
+        write("UPDATE posts SET is_private = 0 WHERE post_date = '1994-06-01'")
+        self.assertEqual(month_count('1994-06'), (1, 1))
+
+    def test_moved_posts(self):
+        self.add('1994-07-01')
+        self.add('1994-07-02')
+        write("UPDATE posts SET post_date = '1994-08-02' WHERE post_date = '1994-07-02'")
+        self.assertEqual(month_count('1994-07'), (1, 1))
+        self.assertEqual(month_count('1994-08'), (1, 1))
+
+        write("UPDATE posts SET post_date = '1994-08-01' WHERE post_date = '1994-07-01'")
+        self.assertIsNone(month_count('1994-07'))
+        self.assertEqual(month_count('1994-08'), (2, 2))
+
+        # a move within the month changes nothing
+        write("UPDATE posts SET post_date = '1994-08-03' WHERE post_date = '1994-08-01'")
+        self.assertEqual(month_count('1994-08'), (2, 2))
+
+
+class ArchivePagesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        posts = [
+            # post_date, title, is_private
+            ('1993-03-01', 'archived march', 0),
+            ('1993-03-02', 'archived secret', 1),
+            ('1993-04-01', 'archived april', 0),
+            ('1993-09-01', 'archived september secret', 1),
+        ]
+        for post_date, title, is_private in posts:
+            write(
+                'INSERT INTO posts (post_date, title, content, is_private) VALUES (?, ?, ?, ?)',
+                (post_date, title, 'some text', is_private)
+            )
+        journal.invalidate_cached_post([post[0] for post in posts], totals_changed=True)
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+
+    def log_in(self):
+        with self.client.session_transaction() as session:
+            session['logged_in'] = True
+
+    def counts(self, html):
+        """{'1993': n, 'march': n, ...} for 1993 in the archive navigation"""
+        nav = html[html.index('href="/archive/1993"'):]
+        nav = nav[:nav.index('</ul>')]
+        counts = {'1993': int(re.match(r'href="/archive/1993">1993</a>\s*\((\d+)\)', nav).group(1))}
+        for name, count in re.findall(r'>(\w+)</a\s*>\s*\((\d+)\)', nav):
+            counts[name] = int(count)
+        return counts
+
+    def test_counts_leave_out_private_posts(self):
+        html = self.client.get('/archive').get_data(as_text=True)
+        self.assertEqual(self.counts(html), {'1993': 2, 'march': 1, 'april': 1})
+
+    def test_admin_counts_private_posts(self):
+        self.log_in()
+        html = self.client.get('/archive').get_data(as_text=True)
+        self.assertEqual(self.counts(html), {'1993': 4, 'march': 2, 'april': 1, 'september': 1})
+
+    def test_year_lists_visible_posts_by_month(self):
+        html = self.client.get('/archive/1993').get_data(as_text=True)
+        self.assertIn('archived march', html)
+        self.assertIn('archived april', html)
+        self.assertNotIn('archived secret', html)
+        self.assertNotIn('href="/archive/1993/09"', html)
+
+        self.log_in()
+        html = self.client.get('/archive/1993').get_data(as_text=True)
+        self.assertIn('archived secret', html)
+        self.assertIn('href="/archive/1993/09"', html)
+
+    def test_month_pages(self):
+        html = self.client.get('/archive/1993/03').get_data(as_text=True)
+        self.assertIn('archived march', html)
+        self.assertNotIn('archived secret', html)
+
+    def test_months_without_visible_posts_are_not_found(self):
+        self.assertEqual(self.client.get('/archive/1993/09').status_code, 404)
+        self.assertEqual(self.client.get('/archive/1993/05').status_code, 404)
+        self.assertEqual(self.client.get('/archive/1993/13').status_code, 404)
+        self.assertEqual(self.client.get('/archive/1992').status_code, 404)
+
+        self.log_in()
+        self.assertEqual(self.client.get('/archive/1993/09').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
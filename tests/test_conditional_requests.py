@@ -0,0 +1,76 @@
+"""
+conditional GET: pages and feeds carry an etag and last-modified from the
+content version, are answered 304 until a write changes it, and logged in
+visitors get their own, private, validators.
+"""
+
+import unittest
+
+import app as journal
+
+
+class ConditionalRequestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+
+    def write_post(self, post_date):
+        conn = journal.open_db_connection()
+        conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            (post_date, 'a title', 'some text')
+        )
+        conn.commit()
+        conn.close()
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get('/archive')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.last_modified)
+        self.assertTrue(response.cache_control.no_cache)
+
+        revalidated = self.client.get('/archive', headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+        self.assertEqual(revalidated.headers['ETag'], etag)
+
+        revalidated = self.client.get('/archive', headers={'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get('/rss').headers['ETag']
+        self.write_post('1996-01-01')
+
+        response = self.client.get('/rss', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_etag_wins_over_last_modified(self):
+        response = self.client.get('/archive')
+        revalidated = self.client.get('/archive', headers={
+            'If-None-Match': '"something-else"', 'If-Modified-Since': response.headers['Last-Modified']
+        })
+        self.assertEqual(revalidated.status_code, 200)
+
+    def test_logged_in_visitors_get_private_validators(self):
+        public = self.client.get('/archive')
+        with self.client.session_transaction() as session:
+            session['logged_in'] = True
+
+        response = self.client.get('/archive', headers={'If-None-Match': public.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], public.headers['ETag'])
+        self.assertTrue(response.cache_control.private)
+        self.assertIn('Cookie', response.vary)
+
+    def test_other_pages_have_no_validators(self):
+        response = self.client.get('/about')
+        self.assertNotIn('ETag', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
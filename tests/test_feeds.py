@@ -0,0 +1,59 @@
+"""
+feed snapshots: a write whose snapshot update failed is picked up by the next
+feed request, and the gzipped and plain snapshots have different etags.
+"""
+
+import gzip
+import unittest
+from unittest import mock
+
+import app as journal
+
+
+class FeedSnapshotTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+        self.assertTrue(journal.FEED_SNAPSHOTS)
+
+    def test_failed_update_is_retried_by_the_next_request(self):
+        self.assertEqual(self.client.get('/rss').status_code, 200)
+
+        conn = journal.open_db_connection()
+        conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            ('2030-06-01', 'a post the feed missed', 'some text')
+        )
+        conn.commit()
+        conn.close()
+        with mock.patch.object(journal, 'write_feed_file', side_effect=OSError('disk full')):
+            journal.invalidate_cached_post(['2030-06-01'], totals_changed=True)
+
+        self.assertIn(b'a post the feed missed', self.client.get('/rss').data)
+
+    def test_gzipped_feed_has_its_own_etag(self):
+        plain = self.client.get('/atom.xml')
+        gzipped = self.client.get('/atom.xml', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzipped.content_encoding, 'gzip')
+        self.assertEqual(gzip.decompress(gzipped.data), plain.data)
+        self.assertIn('Accept-Encoding', gzipped.vary)
+
+        plain_etag, _ = plain.get_etag()
+        gzipped_etag, _ = gzipped.get_etag()
+        self.assertNotEqual(gzipped_etag, plain_etag)
+
+        revalidated = self.client.get(
+            '/atom.xml', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped.headers['ETag']}
+        )
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.get_etag()[0], gzipped_etag)
+        revalidated = self.client.get('/atom.xml', headers={'If-None-Match': plain.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.get_etag()[0], plain_etag)
+
+
+if __name__ == '__main__':
+    unittest.main()
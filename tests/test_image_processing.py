@@ -0,0 +1,99 @@
+"""
+draft decoding and chained resizes (create_image_versions) must look the
+same as resizing every version straight from the full-size image.
+
+run from the repository root with: python3 -m unittest
+"""
+
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image, ImageChops, ImageDraw, ImageStat
+
+from image_processing import create_image_versions, draft_for_width, resize_to_width, save_image, to_web_rgb
+from storage import IMAGE_VARIANTS
+
+
+# peak signal to noise ratio a version must reach against the direct resize,
+# after both are encoded the same way. above ~35 dB the difference is invisible.
+MIN_PSNR = 35
+
+
+def write_fixture(path, size=(3000, 2000), orientation=None):
+    """a photo-sized jpeg with gradients, hard edges and sensor-like noise"""
+    rng = random.Random(1)
+    img = Image.merge('RGB', (
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+    ))
+    draw = ImageDraw.Draw(img)
+    for _ in range(300):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse(
+            (x, y, x + rng.randrange(10, 200), y + rng.randrange(10, 200)),
+            fill=tuple(rng.randrange(256) for _ in range(3))
+        )
+    img = Image.blend(img, Image.effect_noise(size, 40).convert('RGB'), 0.15)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(path, 'JPEG', quality=92, exif=exif)
+
+
+def psnr(a, b):
+    mse = sum(rms * rms for rms in ImageStat.Stat(ImageChops.difference(a, b)).rms) / 3
+    return math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+class DraftDecodingQualityTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def check_versions(self, source_path):
+        versions = [
+            (name, os.path.join(self.folder, name), variant['width'], variant['format'], variant['quality'])
+            for name, variant in IMAGE_VARIANTS.items()
+        ]
+        # no full-size version, so JPEG sources are draft-decoded
+        results = create_image_versions(source_path, versions)
+
+        with Image.open(source_path) as img:
+            full = to_web_rgb(img)
+        for name, output_path, max_width, image_format, quality in versions:
+            with self.subTest(variant=name, width=max_width):
+                self.assertIsNotNone(results[name])
+                reference_path = os.path.join(self.folder, f'{name}.reference')
+                save_image(resize_to_width(full, max_width), reference_path, image_format, quality)
+                with Image.open(output_path) as output, Image.open(reference_path) as reference:
+                    self.assertEqual(output.size, reference.size)
+                    self.assertEqual(results[name][:2], reference.size)
+                    self.assertGreaterEqual(psnr(output.convert('RGB'), reference.convert('RGB')), MIN_PSNR)
+
+    def test_fixture_is_draft_decoded(self):
+        # otherwise the tests below would only cover the chained resizes
+        source_path = os.path.join(self.folder, 'source.jpg')
+        write_fixture(source_path)
+        with Image.open(source_path) as img:
+            draft_for_width(img, max(variant['width'] for variant in IMAGE_VARIANTS.values()))
+            self.assertLess(img.size[0], 3000)
+
+    def test_matches_direct_resize(self):
+        source_path = os.path.join(self.folder, 'source.jpg')
+        write_fixture(source_path)
+        self.check_versions(source_path)
+
+    def test_matches_direct_resize_when_rotated(self):
+        # stored landscape, displayed portrait: the draft is sized by the displayed width
+        source_path = os.path.join(self.folder, 'source.jpg')
+        write_fixture(source_path, orientation=6)
+        self.check_versions(source_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
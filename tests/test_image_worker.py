@@ -0,0 +1,121 @@
+"""
+the image worker: a post's pages, feeds and static export are invalidated
+once, after the last of its images is processed, and an image whose
+original was stored is shown even when some of its variants failed.
+"""
+
+import os
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import app as journal
+import image_processing
+
+
+class ImageWorkerInvalidationTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = journal.open_db_connection()
+        self.addCleanup(self.conn.close)
+
+    def create_post(self, post_date, image_count):
+        """a public post with image_count uploads waiting for the worker"""
+        post_id = self.conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            (post_date, 'a title', 'some text')
+        ).lastrowid
+        os.makedirs(journal.PENDING_FOLDER, exist_ok=True)
+        for i in range(image_count):
+            filename = f'{post_date}-{i}.jpg'
+            # distinct colours, so the uploads aren't deduplicated into one blob
+            Image.new('RGB', (64, 48), (40 * i, 90, 160)).save(os.path.join(journal.PENDING_FOLDER, filename))
+            self.conn.execute(
+                "INSERT INTO post_images (post_id, filename, sort_order, status) VALUES (?, ?, ?, 'pending')",
+                (post_id, filename, i)
+            )
+        self.conn.commit()
+        return post_id
+
+    def test_invalidates_once_after_last_image(self):
+        post_id = self.create_post('2024-03-01', 3)
+
+        with mock.patch.object(journal, 'invalidate_cached_post') as invalidate:
+            journal.process_image_jobs(self.conn, journal.claim_pending_images(self.conn, 2))
+            invalidate.assert_not_called()
+
+            journal.process_image_jobs(self.conn, journal.claim_pending_images(self.conn, 2))
+            invalidate.assert_called_once_with(['2024-03-01'], images_changed=True)
+
+        statuses = [row['status'] for row in self.conn.execute(
+            'SELECT status FROM post_images WHERE post_id = ?', (post_id,)
+        )]
+        self.assertEqual(statuses, ['ready'] * 3)
+
+
+class PartialVariantFailureTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+
+    def setUp(self):
+        self.conn = journal.open_db_connection()
+        self.addCleanup(self.conn.close)
+
+    def process_with_failing(self, post_date, failing_variants):
+        """process a one-image post while the given variants fail to encode"""
+        post_id = self.conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            (post_date, 'a title', 'some text')
+        ).lastrowid
+        filename = f'{post_date}-0.jpg'
+        os.makedirs(journal.PENDING_FOLDER, exist_ok=True)
+        Image.new('RGB', (64, 48), (200, 30, int(post_date[-2:]))).save(os.path.join(journal.PENDING_FOLDER, filename))
+        self.conn.execute(
+            "INSERT INTO post_images (post_id, filename, status) VALUES (?, ?, 'pending')", (post_id, filename)
+        )
+        self.conn.commit()
+
+        failing_folders = tuple(journal.IMAGE_VARIANTS[name]['folder'] + os.sep for name in failing_variants)
+        save_image = image_processing.save_image
+
+        def flaky_save_image(img, output_path, image_format, quality):
+            if output_path.startswith(failing_folders):
+                raise OSError('encoder broke')
+            save_image(img, output_path, image_format, quality)
+
+        with mock.patch.object(image_processing, 'save_image', flaky_save_image), \
+                mock.patch.object(journal, 'invalidate_cached_post'):
+            journal.process_image_jobs(self.conn, journal.claim_pending_images(self.conn, 1))
+        return self.conn.execute('SELECT * FROM post_images WHERE post_id = ?', (post_id,)).fetchone()
+
+    def test_failed_webp_variant_is_left_out(self):
+        image = self.process_with_failing('2024-03-02', ['optimized_webp'])
+        self.assertEqual(image['status'], 'ready')
+        self.assertEqual(image['filename'], journal.blob_filename(image['blob_hash']))
+
+        versions = {row['version'] for row in self.conn.execute(
+            'SELECT version FROM image_versions WHERE filename = ?', (image['filename'],)
+        )}
+        self.assertIn('original', versions)
+        self.assertIn('optimized', versions)
+        self.assertNotIn('optimized_webp', versions)
+
+        response = journal.app.test_client().get('/post/2024-03-02')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'image unavailable', response.data)
+        self.assertNotIn(b'/uploads/optimized_webp/', response.data)
+
+    def test_failed_main_variant_falls_back_to_original(self):
+        image = self.process_with_failing('2024-03-03', ['optimized'])
+        self.assertEqual(image['status'], 'ready')
+
+        with journal.app.test_request_context('/'):
+            self.assertEqual(journal.image_url(image), f"/uploads/{image['filename']}")
+            self.assertEqual(journal.image_url(image, 'webring_small'), f"/uploads/webring_small/{image['filename']}")
+        response = journal.app.test_client().get('/post/2024-03-03')
+        self.assertIn(f"/uploads/{image['filename']}".encode(), response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
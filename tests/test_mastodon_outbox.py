@@ -0,0 +1,245 @@
+"""
+the mastodon outbox against a fake instance: a retry after a send that timed
+out (or failed) must not toot the post twice or upload its images again, even
+once mastodon has forgotten the idempotency key.
+"""
+
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from flask import get_flashed_messages
+from PIL import Image
+
+import app as journal
+from tests import MASTODON_PORT
+
+
+class FakeMastodon(BaseHTTPRequestHandler):
+    """
+    just enough of the mastodon api for the dispatcher. it ignores
+    idempotency keys, like an instance that has already forgotten them.
+    """
+    statuses = []
+    status_requests = []
+    media_uploads = []
+    # what to do with the next status posts: 'timeout' creates the status but
+    # answers after the client gave up, 'error' fails without creating it
+    status_failures = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, value, code=200):
+        body = json.dumps(value).encode()
+        try:
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # the client timed out and hung up
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path in ('/api/v1/instance', '/api/v2/instance'):
+            self.send_json({'version': '4.3.0', 'api_versions': {'mastodon': 2}, 'uri': 'mastodon.test'})
+        elif path == '/api/v1/accounts/verify_credentials':
+            self.send_json({'id': '1', 'username': 'journal', 'acct': 'journal'})
+        elif path == '/api/v1/accounts/1/statuses':
+            self.send_json(list(reversed(self.statuses)))
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if path in ('/api/v1/media', '/api/v2/media'):
+            media_id = f'm{len(self.media_uploads) + 1}'
+            self.media_uploads.append(media_id)
+            self.send_json({'id': media_id, 'type': 'image', 'url': f'http://mastodon.test/media/{media_id}'})
+        elif path == '/api/v1/statuses':
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params = json.loads(body)
+            else:
+                params = {key: values if key.endswith('[]') else values[0]
+                          for key, values in parse_qs(body.decode()).items()}
+            self.status_requests.append(params)
+            failure = self.status_failures.pop(0) if self.status_failures else None
+            if failure == 'error':
+                self.send_json({'error': 'unavailable'}, 503)
+                return
+            status = self.create_status(params)
+            if failure == 'timeout':
+                time.sleep(journal.MASTODON_REQUEST_TIMEOUT + 1)
+            self.send_json(status)
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def create_status(self, params):
+        status_id = str(len(self.statuses) + 1)
+        url = params['status'].rsplit('\n', 1)[-1]
+        status = {
+            'id': status_id,
+            'url': f'http://mastodon.test/@journal/{status_id}',
+            'created_at': '2024-01-01T00:00:00.000Z',
+            'content': (
+                f'<p>{params["status"].split(chr(10))[0]}</p>'
+                f'<p><a href="{url}" target="_blank" rel="nofollow noopener">{url}</a></p>'
+            ),
+            'visibility': params.get('visibility'),
+            'media_attachments': [],
+        }
+        self.statuses.append(status)
+        return status
+
+
+class MastodonOutboxTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # the tests send entries themselves, no dispatcher thread
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        cls.server = ThreadingHTTPServer(('127.0.0.1', MASTODON_PORT), FakeMastodon)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeMastodon.statuses.clear()
+        FakeMastodon.status_requests.clear()
+        FakeMastodon.media_uploads.clear()
+        FakeMastodon.status_failures.clear()
+        self.conn = journal.open_db_connection()
+        self.addCleanup(self.conn.close)
+
+    def create_post(self, post_date):
+        """a post with one processed image, queued for mastodon"""
+        cursor = self.conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            (post_date, 'a title', 'some text')
+        )
+        post_id = cursor.lastrowid
+        filename = f'{post_date}-photo.jpg'
+        self.conn.execute(
+            '''INSERT INTO post_images (post_id, filename, alt_text, status)
+               VALUES (?, ?, ?, 'ready')''',
+            (post_id, filename, 'a photo')
+        )
+        variant = journal.IMAGE_VARIANTS['webring_small']
+        os.makedirs(variant['folder'], exist_ok=True)
+        Image.new('RGB', (96, 64), 'teal').save(
+            os.path.join(variant['folder'], journal.variant_filename(variant, filename))
+        )
+        journal.queue_mastodon_post(self.conn, post_id)
+        self.conn.commit()
+        return post_id
+
+    def send_due_entry(self, post_id):
+        """claim the post's outbox entry (retries are made due at once) and send it"""
+        self.conn.execute(
+            'UPDATE mastodon_outbox SET next_attempt = CURRENT_TIMESTAMP WHERE post_id = ?', (post_id,)
+        )
+        self.conn.commit()
+        entry = journal.claim_mastodon_entry(self.conn)
+        self.assertEqual(entry['post_id'], post_id)
+        journal.dispatch_mastodon_entry(self.conn, entry)
+        return self.conn.execute('SELECT * FROM mastodon_outbox WHERE post_id = ?', (post_id,)).fetchone()
+
+    def test_sends_post_with_media(self):
+        post_id = self.create_post('2024-02-01')
+        entry = self.send_due_entry(post_id)
+
+        self.assertEqual(entry['status'], 'sent')
+        self.assertEqual(entry['remote_url'], FakeMastodon.statuses[0]['url'])
+        self.assertEqual(FakeMastodon.media_uploads, ['m1'])
+        [request] = FakeMastodon.status_requests
+        self.assertIn('http://journal.test/post/2024-02-01', request['status'])
+        self.assertEqual(request['media_ids[]'], ['m1'])
+
+    def test_retry_after_timeout_finds_the_created_status(self):
+        post_id = self.create_post('2024-02-02')
+        FakeMastodon.status_failures.append('timeout')
+
+        entry = self.send_due_entry(post_id)
+        self.assertEqual(entry['status'], 'pending')
+        self.assertEqual(entry['attempts'], 1)
+        self.assertEqual(len(FakeMastodon.statuses), 1)
+
+        entry = self.send_due_entry(post_id)
+        self.assertEqual(entry['status'], 'sent')
+        self.assertEqual(entry['remote_url'], FakeMastodon.statuses[0]['url'])
+        # tooted once, images uploaded once
+        self.assertEqual(len(FakeMastodon.statuses), 1)
+        self.assertEqual(len(FakeMastodon.status_requests), 1)
+        self.assertEqual(FakeMastodon.media_uploads, ['m1'])
+
+    def test_retry_after_error_reuses_uploaded_media(self):
+        post_id = self.create_post('2024-02-03')
+        FakeMastodon.status_failures.append('error')
+
+        entry = self.send_due_entry(post_id)
+        self.assertEqual(entry['status'], 'pending')
+        self.assertEqual(json.loads(entry['media_ids']), ['m1'])
+
+        entry = self.send_due_entry(post_id)
+        self.assertEqual(entry['status'], 'sent')
+        self.assertEqual(len(FakeMastodon.statuses), 1)
+        self.assertEqual(FakeMastodon.media_uploads, ['m1'])
+        self.assertEqual([r['media_ids[]'] for r in FakeMastodon.status_requests], [['m1'], ['m1']])
+
+    def test_failed_entry_queued_again_uploads_media_afresh(self):
+        post_id = self.create_post('2024-02-04')
+        self.conn.execute(
+            '''UPDATE mastodon_outbox SET status = 'failed', attempts = ?, media_ids = '["gone"]'
+               WHERE post_id = ?''',
+            (journal.MASTODON_MAX_ATTEMPTS, post_id)
+        )
+        journal.queue_mastodon_post(self.conn, post_id)
+        self.conn.commit()
+
+        entry = self.send_due_entry(post_id)
+        self.assertEqual(entry['status'], 'sent')
+        self.assertEqual(FakeMastodon.media_uploads, ['m1'])
+
+    def test_queue_reports_whether_it_queued(self):
+        post_id = self.create_post('2024-02-05')
+        # queued once by create_post, still pending
+        self.assertFalse(journal.queue_mastodon_post(self.conn, post_id))
+        self.conn.execute("UPDATE mastodon_outbox SET status = 'sent' WHERE post_id = ?", (post_id,))
+        self.assertFalse(journal.queue_mastodon_post(self.conn, post_id))
+        self.conn.execute("UPDATE mastodon_outbox SET status = 'failed' WHERE post_id = ?", (post_id,))
+        self.assertTrue(journal.queue_mastodon_post(self.conn, post_id))
+        # not sent, so it isn't left due for the other tests
+        self.conn.execute('DELETE FROM mastodon_outbox WHERE post_id = ?', (post_id,))
+        self.conn.commit()
+
+    def flashes_after_save(self, queued):
+        with journal.app.test_request_context('/edit', method='POST', data={'cross_post_mastodon': 'on'}):
+            with mock.patch.object(journal, 'notify_mastodon_dispatcher'):
+                journal.flash_mastodon_queued(queued)
+            return get_flashed_messages()
+
+    def test_flashes_queued_only_when_queued(self):
+        self.assertEqual(self.flashes_after_save(True), ['queued for mastodon.'])
+        self.assertEqual(self.flashes_after_save(False), ['already queued for or sent to mastodon.'])
+
+    def test_cross_posting_needs_site_url(self):
+        self.assertTrue(journal.mastodon_configured())
+        with mock.patch.dict(journal.config):
+            del journal.config['site_url']
+            self.assertFalse(journal.mastodon_configured())
+            self.assertIn('not configured', self.flashes_after_save(False)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+keyset pagination: pages addressed by cursor from either end, and the
+boundaries where a page is the newest, the oldest, or runs out exactly.
+"""
+
+import re
+import sqlite3
+import unittest
+from unittest import mock
+
+import app as journal
+
+
+class FetchKeysetPageTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.row_factory = sqlite3.Row
+        self.addCleanup(self.conn.close)
+        self.conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, created TEXT, hidden INTEGER DEFAULT 0)')
+
+    def add(self, *created):
+        for value in created:
+            self.conn.execute('INSERT INTO items (created) VALUES (?)', (value,))
+
+    def page(self, per_page=2, columns=('created',), conditions=(), **kwargs):
+        rows, has_newer, has_older = journal.fetch_keyset_page(
+            self.conn, 'SELECT * FROM items', list(conditions), [], list(columns), per_page, **kwargs
+        )
+        return [row['created'] for row in rows], has_newer, has_older
+
+    def test_pages_from_the_newest_end(self):
+        self.add('a', 'b', 'c', 'd', 'e')
+        self.assertEqual(self.page(), (['e', 'd'], False, True))
+        self.assertEqual(self.page(before=('d',)), (['c', 'b'], True, True))
+        self.assertEqual(self.page(before=('b',)), (['a'], True, False))
+
+    def test_pages_from_the_oldest_end(self):
+        self.add('a', 'b', 'c', 'd', 'e')
+        self.assertEqual(self.page(after=()), (['b', 'a'], True, False))
+        self.assertEqual(self.page(after=('b',)), (['d', 'c'], True, True))
+        self.assertEqual(self.page(after=('d',)), (['e'], False, True))
+
+    def test_exactly_one_page(self):
+        self.add('a', 'b')
+        self.assertEqual(self.page(), (['b', 'a'], False, False))
+        self.assertEqual(self.page(after=()), (['b', 'a'], False, False))
+
+    def test_past_either_end(self):
+        self.add('a', 'b', 'c')
+        self.assertEqual(self.page(before=('a',)), ([], False, False))
+        self.assertEqual(self.page(after=('c',)), ([], False, False))
+        self.assertEqual(self.page(page=3), ([], False, False))
+
+    def test_old_page_numbers(self):
+        self.add('a', 'b', 'c', 'd', 'e')
+        self.assertEqual(self.page(page=2), (['c', 'b'], True, True))
+        self.assertEqual(self.page(page=0), (['e', 'd'], False, True))
+
+    def test_ties_are_split_by_the_second_column(self):
+        # the gallery's (created, id) cursor, with images uploaded together
+        self.add('a', 'b', 'b', 'b', 'c')
+        seen = []
+        rows, _, has_older = journal.fetch_keyset_page(
+            self.conn, 'SELECT * FROM items', [], [], ['created', 'id'], 2
+        )
+        while True:
+            seen += [row['id'] for row in rows]
+            if not has_older:
+                break
+            rows, _, has_older = journal.fetch_keyset_page(
+                self.conn, 'SELECT * FROM items', [], [], ['created', 'id'], 2,
+                before=(rows[-1]['created'], rows[-1]['id'])
+            )
+        self.assertEqual(seen, [5, 4, 3, 2, 1])
+
+    def test_conditions_apply_to_the_boundary_checks(self):
+        self.add('a', 'b', 'c')
+        self.conn.execute("UPDATE items SET hidden = 1 WHERE created = 'a'")
+        # 'a' is older, but hidden, so there's no older page
+        self.assertEqual(self.page(conditions=['hidden = 0']), (['c', 'b'], False, False))
+
+
+class IndexPaginationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        conn = journal.open_db_connection()
+        for day in range(1, 8):
+            conn.execute(
+                'INSERT INTO posts (post_date, title, content, is_private) VALUES (?, ?, ?, ?)',
+                (f'1997-01-0{day}', f'paged {day}', 'some text', int(day == 4))
+            )
+        conn.commit()
+        conn.close()
+
+    def setUp(self):
+        patcher = mock.patch.object(journal, 'POSTS_PER_PAGE', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = journal.app.test_client()
+
+    def walk(self, url, link_label):
+        """post dates on every page reached by following one pagination link"""
+        dates = []
+        while url:
+            html = self.client.get(url).get_data(as_text=True)
+            dates += re.findall(r'href="/post/(\d{4}-\d{2}-\d{2})"', html)
+            link = re.search(rf'href="([^"]+)"\s+aria-label="{link_label}"', html)
+            url = link.group(1).replace('&amp;', '&') if link else None
+        return dates
+
+    def public_post_dates(self):
+        conn = journal.open_db_connection()
+        try:
+            return [row['post_date'] for row in conn.execute(
+                'SELECT post_date FROM posts WHERE is_private = 0 ORDER BY post_date DESC'
+            )]
+        finally:
+            conn.close()
+
+    def test_older_links_reach_every_public_post_once(self):
+        dates = self.walk('/', 'next page')
+        self.assertEqual(dates, list(dict.fromkeys(dates)))
+        self.assertEqual(dates, self.public_post_dates())
+        self.assertNotIn('1997-01-04', dates)
+
+    def test_newer_links_from_the_last_page(self):
+        dates = self.walk('/?after=', 'previous page')
+        self.assertCountEqual(dates, self.public_post_dates())
+
+
+if __name__ == '__main__':
+    unittest.main()
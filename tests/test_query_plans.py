@@ -0,0 +1,31 @@
+"""
+migrate.py --check-plans against a freshly migrated database: every hot query
+app.py runs is answered from an index.
+"""
+
+import sqlite3
+import unittest
+from unittest import mock
+
+import migrate
+
+
+class QueryPlansTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.addCleanup(self.conn.close)
+        migrate.run_migrations(self.conn, verbose=False)
+
+    def test_hot_queries_use_indexes(self):
+        self.assertEqual(migrate.check_query_plans(self.conn), [])
+
+    def test_table_scan_is_reported(self):
+        hot_queries = {'unindexed': ('SELECT * FROM posts WHERE content = ?', ('text',))}
+        with mock.patch.dict(migrate.HOT_QUERIES, hot_queries, clear=True):
+            [(name, detail)] = migrate.check_query_plans(self.conn)
+        self.assertEqual(name, 'unindexed')
+        self.assertTrue(detail.startswith('SCAN'))
+
+
+if __name__ == '__main__':
+    unittest.main()
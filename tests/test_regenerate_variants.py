@@ -0,0 +1,90 @@
+"""
+regenerate_variants.py: a remade variant is written under a new name that
+pages switch to, instead of over the file served as immutable, and the old
+file stays for pages and feeds that still link to it.
+"""
+
+import os
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import app as journal
+import regenerate_variants
+from image_processing import create_image_versions
+
+
+class RegenerateVariantsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+
+    def setUp(self):
+        self.conn = journal.open_db_connection()
+        self.addCleanup(self.conn.close)
+
+    def create_image(self, post_date):
+        """a public post with one processed image"""
+        post_id = self.conn.execute(
+            'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+            (post_date, 'a title', 'some text')
+        ).lastrowid
+        filename = f'{post_date}-0.jpg'
+        os.makedirs(journal.PENDING_FOLDER, exist_ok=True)
+        Image.new('RGB', (64, 48), (10, 200, 60 * int(post_date[-2:]))).save(os.path.join(journal.PENDING_FOLDER, filename))
+        self.conn.execute(
+            "INSERT INTO post_images (post_id, filename, status) VALUES (?, ?, 'pending')", (post_id, filename)
+        )
+        self.conn.commit()
+        with mock.patch.object(journal, 'invalidate_cached_post'):
+            journal.process_image_jobs(self.conn, journal.claim_pending_images(self.conn, 1))
+        return self.conn.execute('SELECT * FROM post_images WHERE post_id = ?', (post_id,)).fetchone()
+
+    def regenerate(self, variant_names):
+        """what regenerate_variants() does, without the process pool"""
+        jobs, _ = regenerate_variants.find_stale_jobs(self.conn, variant_names)
+        for filename, original_path, source_hash, stat, versions in jobs:
+            results = create_image_versions(original_path, versions, 1)
+            regenerate_variants.record_versions(self.conn, filename, source_hash, stat, versions, results)
+        return jobs
+
+    def image_url(self, image):
+        with journal.app.test_request_context('/'):
+            return journal.image_url(image)
+
+    def test_remade_variant_gets_a_new_url(self):
+        image = self.create_image('2024-04-01')
+        old_url = self.image_url(image)
+        old_path = os.path.join(
+            journal.IMAGE_VARIANTS['optimized']['folder'],
+            journal.variant_filename(journal.IMAGE_VARIANTS['optimized'], image['filename'])
+        )
+        self.assertTrue(old_path.endswith(old_url.rsplit('/', 1)[-1]))
+
+        # new images have no manifest entries yet, so everything is stale
+        jobs = self.regenerate({'optimized'})
+        self.assertIn(image['filename'], [job[0] for job in jobs])
+
+        new_url = self.image_url(image)
+        self.assertNotEqual(new_url, old_url)
+        new_path = os.path.join(journal.IMAGE_VARIANTS['optimized']['folder'], new_url.rsplit('/', 1)[-1])
+        self.assertTrue(os.path.exists(new_path))
+        self.assertTrue(os.path.exists(old_path))
+        self.assertIn(new_url.encode(), journal.app.test_client().get('/post/2024-04-01').data)
+
+        # up to date now, and nothing is remade again
+        jobs = self.regenerate({'optimized'})
+        self.assertNotIn(image['filename'], [job[0] for job in jobs])
+        self.assertEqual(self.image_url(image), new_url)
+
+    def test_deleting_the_image_removes_remade_files(self):
+        image = self.create_image('2024-04-02')
+        self.regenerate({'optimized'})
+        remade = journal.regenerated_variant_paths(image['filename'])
+        self.assertTrue(remade)
+        self.assertTrue(set(remade) <= set(journal.image_file_paths(image['filename'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
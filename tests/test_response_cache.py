@@ -0,0 +1,93 @@
+"""
+the response cache for logged out visitors: pages are served from disk until
+a write purges them, a write only purges the pages it can affect, and a page
+rendered before a write isn't served even when it's stored after the purge.
+"""
+
+import unittest
+from unittest import mock
+
+import app as journal
+
+
+class ResponseCacheTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        conn = journal.open_db_connection()
+        # old enough to be on later index pages, whatever the other tests add
+        for day in range(1, 7):
+            conn.execute(
+                'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+                (f'1999-01-0{day}', f'day {day}', 'some text')
+            )
+        conn.commit()
+        conn.close()
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+        patcher = mock.patch.object(journal, 'POSTS_PER_PAGE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache_status(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.headers.get('X-Cache')
+
+    def test_served_from_cache_until_purged(self):
+        self.assertEqual(self.cache_status('/post/1999-01-01'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-01'), 'HIT')
+
+        journal.invalidate_cached_post(['1999-01-01'])
+        self.assertEqual(self.cache_status('/post/1999-01-01'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-01'), 'HIT')
+
+    def test_write_only_purges_pages_it_affects(self):
+        pages = ['/post/1999-01-04', '/', '/?before=1999-01-05', '/?before=1999-01-02']
+        for url in pages:
+            self.assertEqual(self.cache_status(url), 'MISS')
+
+        # an edit that doesn't change the totals, to a post on one index page
+        journal.invalidate_cached_post(['1999-01-03'])
+        self.assertEqual(self.cache_status('/?before=1999-01-05'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-04'), 'HIT')
+        self.assertEqual(self.cache_status('/'), 'HIT')
+        self.assertEqual(self.cache_status('/?before=1999-01-02'), 'HIT')
+
+        # a new post moves every index page along
+        journal.invalidate_cached_post(['1999-01-03'], totals_changed=True)
+        self.assertEqual(self.cache_status('/'), 'MISS')
+        self.assertEqual(self.cache_status('/?before=1999-01-02'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-04'), 'HIT')
+
+    def test_render_racing_a_write_is_not_served(self):
+        get_post_images = journal.get_post_images
+
+        def written_while_rendering(post_id):
+            # another process writes the post and purges it mid-render
+            journal.invalidate_cached_post(['1999-01-05'])
+            return get_post_images(post_id)
+
+        with mock.patch.object(journal, 'get_post_images', written_while_rendering):
+            self.assertEqual(self.cache_status('/post/1999-01-05'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-05'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-05'), 'HIT')
+
+    def test_entries_from_before_a_deploy_are_not_served(self):
+        self.assertEqual(self.cache_status('/post/1999-01-02'), 'MISS')
+        with mock.patch.object(journal, 'APP_SIGNATURE', 'deployed'):
+            self.assertEqual(self.cache_status('/post/1999-01-02'), 'MISS')
+
+    def test_forgotten_purges_render_again(self):
+        self.assertEqual(self.cache_status('/post/1999-01-06'), 'MISS')
+        with mock.patch.object(journal, 'RESPONSE_CACHE_PURGE_LOG', 1):
+            journal.invalidate_cached_post(['1999-01-01'])
+            journal.invalidate_cached_post(['1999-01-01'])
+        # the purges didn't cover it, but the log no longer says so
+        self.assertEqual(self.cache_status('/post/1999-01-06'), 'MISS')
+        self.assertEqual(self.cache_status('/post/1999-01-06'), 'HIT')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+full-text search: titles, content and image alt text are searched with
+stemming, every word has to match, titles rank first, private posts are
+only found by the admin, and the index follows edits.
+"""
+
+import re
+import unittest
+from unittest import mock
+
+import app as journal
+
+
+class SearchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        conn = journal.open_db_connection()
+        posts = [
+            # post_date, title, content, is_private
+            ('1995-01-01', 'a walk to zanzibar', 'nothing much', 0),
+            ('1995-01-02', 'notes', 'we walked past <b>zanzibar</b> again', 0),
+            ('1995-01-03', 'lagoonscapes', 'see below', 0),
+            ('1995-01-04', 'secret zanzibar plans', 'hush', 1),
+        ]
+        for post in posts:
+            conn.execute('INSERT INTO posts (post_date, title, content, is_private) VALUES (?, ?, ?, ?)', post)
+        post_id = conn.execute("SELECT id FROM posts WHERE post_date = '1995-01-03'").fetchone()['id']
+        conn.execute(
+            "INSERT INTO post_images (post_id, filename, alt_text, status) VALUES (?, ?, ?, 'ready')",
+            (post_id, 'zanzibar-search.jpg', 'a heron on the zanzibar shore')
+        )
+        conn.commit()
+        conn.close()
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+
+    def result_dates(self, q, **kwargs):
+        html = self.client.get('/search', query_string={'q': q, **kwargs}).get_data(as_text=True)
+        return re.findall(r'href="/post/(\d{4}-\d{2}-\d{2})"', html)
+
+    def test_query_is_quoted_words(self):
+        self.assertEqual(journal.build_search_query('walk OR "dog* -cat'), '"walk" "OR" "dog" "cat"')
+        self.assertEqual(journal.build_search_query('!!! ...'), '')
+        with mock.patch.object(journal, 'SEARCH_MAX_TERMS', 2):
+            self.assertEqual(journal.build_search_query('one two three'), '"one" "two"')
+
+    def test_titles_rank_above_content_and_alt_text(self):
+        dates = self.result_dates('zanzibar')
+        self.assertEqual(dates[0], '1995-01-01')
+        self.assertCountEqual(dates, ['1995-01-01', '1995-01-02', '1995-01-03'])
+
+    def test_words_are_stemmed_and_all_must_match(self):
+        self.assertCountEqual(self.result_dates('walking'), ['1995-01-01', '1995-01-02'])
+        self.assertEqual(self.result_dates('zanzibar heron'), ['1995-01-03'])
+        self.assertEqual(self.result_dates('zanzibar nowhere'), [])
+
+    def test_private_posts_are_only_found_by_the_admin(self):
+        self.assertNotIn('1995-01-04', self.result_dates('zanzibar'))
+        with self.client.session_transaction() as session:
+            session['logged_in'] = True
+        self.assertIn('1995-01-04', self.result_dates('zanzibar'))
+
+    def test_snippets_are_escaped_and_highlighted(self):
+        html = self.client.get('/search?q=walked').get_data(as_text=True)
+        self.assertIn('<mark>walked</mark>', html)
+        self.assertIn('&lt;b&gt;', html)
+        self.assertNotIn('<b>zanzibar</b>', html)
+
+    def test_pages_of_results(self):
+        with mock.patch.object(journal, 'SEARCH_RESULTS_PER_PAGE', 2):
+            first = self.result_dates('zanzibar')
+            second = self.result_dates('zanzibar', page=2)
+            html = self.client.get('/search?q=zanzibar').get_data(as_text=True)
+        self.assertEqual((len(first), len(second)), (2, 1))
+        self.assertFalse(set(first) & set(second))
+        self.assertIn('3 results', html)
+        self.assertIn('1 of 2', html)
+
+    def test_edits_are_searchable(self):
+        conn = journal.open_db_connection()
+        conn.execute("UPDATE posts SET title = 'quetzal sighting' WHERE post_date = '1995-01-03'")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.result_dates('quetzal'), ['1995-01-03'])
+        self.assertEqual(self.result_dates('lagoonscapes'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
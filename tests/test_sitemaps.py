@@ -0,0 +1,88 @@
+"""
+sitemap sharding: /sitemap.xml lists the listing pages and a sitemap per year
+with public posts, and each year's sitemap lists that year's public posts
+with their ready images.
+"""
+
+import re
+import unittest
+
+import app as journal
+
+
+class SitemapTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        conn = journal.open_db_connection()
+        posts = [
+            # post_date, is_private
+            ('1991-02-01', 0),
+            ('1991-02-02', 1),
+            ('1991-07-01', 0),
+            ('1990-01-01', 1),
+        ]
+        for post_date, is_private in posts:
+            conn.execute(
+                'INSERT INTO posts (post_date, title, content, is_private) VALUES (?, ?, ?, ?)',
+                (post_date, 'mapped', 'some text', is_private)
+            )
+        post_id = conn.execute("SELECT id FROM posts WHERE post_date = '1991-02-01'").fetchone()['id']
+        for filename, status in [('mapped-ready.jpg', 'ready'), ('mapped-pending.jpg', 'pending')]:
+            conn.execute(
+                'INSERT INTO post_images (post_id, filename, alt_text, status) VALUES (?, ?, ?, ?)',
+                (post_id, filename, 'a map', status)
+            )
+        conn.commit()
+        conn.close()
+        journal.invalidate_cached_post([post[0] for post in posts], totals_changed=True)
+
+    def setUp(self):
+        self.client = journal.app.test_client()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/xml')
+        return response.get_data(as_text=True)
+
+    def paths(self, xml):
+        """the paths of the absolute urls in each <loc>"""
+        return re.findall(r'<loc>https?://[^/<]+(/[^<]*)</loc>', xml)
+
+    def test_index_lists_a_sitemap_per_year(self):
+        xml = self.get('/sitemap.xml')
+        locs = self.paths(xml)
+        self.assertEqual(locs[0], '/sitemap-pages.xml')
+        self.assertIn('/sitemap-1991.xml', locs)
+        self.assertNotIn('/sitemap-1990.xml', locs)
+        years = [loc for loc in locs if re.search(r'sitemap-\d{4}\.xml$', loc)]
+        self.assertEqual(years, sorted(years))
+
+        entry = re.search(r'<sitemap><loc>[^<]+sitemap-1991\.xml</loc>(.*?)</sitemap>', xml).group(1)
+        self.assertRegex(entry, r'<lastmod>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+00:00</lastmod>')
+
+    def test_year_lists_its_public_posts(self):
+        xml = self.get('/sitemap-1991.xml')
+        locs = self.paths(xml)
+        self.assertEqual(locs, ['/post/1991-02-01', '/post/1991-07-01'])
+
+    def test_ready_images_are_listed_with_their_post(self):
+        xml = self.get('/sitemap-1991.xml')
+        entry = re.search(r'<url><loc>[^<]+/post/1991-02-01</loc>(.*?)</url>', xml).group(1)
+        self.assertEqual(len(re.findall('<image:image>', entry)), 1)
+        self.assertIn('mapped-ready', entry)
+        self.assertNotIn('mapped-pending', xml)
+
+    def test_years_without_public_posts_are_not_found(self):
+        self.assertEqual(self.client.get('/sitemap-1990.xml').status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-1989.xml').status_code, 404)
+
+    def test_listing_pages(self):
+        locs = self.paths(self.get('/sitemap-pages.xml'))
+        self.assertIn('/', locs)
+        self.assertIn('/archive', locs)
+
+
+if __name__ == '__main__':
+    unittest.main()
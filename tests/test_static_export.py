@@ -0,0 +1,85 @@
+"""
+the static export: a full export records the post dates each index page
+covers, and re-exporting after an edit only renders the index and archive
+pages showing the edited post, unless the number of posts changed.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app as journal
+from export_static import export_changes, export_site
+
+
+class StaticExportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        journal.app.config['BACKGROUND_WORKERS'] = False
+        conn = journal.open_db_connection()
+        # old enough to be on later index pages, whatever the other tests add
+        for day in range(1, 6):
+            conn.execute(
+                'INSERT INTO posts (post_date, title, content) VALUES (?, ?, ?)',
+                (f'1998-01-0{day}', f'exported day {day}', 'some text')
+            )
+        conn.commit()
+        conn.close()
+
+    def setUp(self):
+        patcher = mock.patch.object(journal, 'POSTS_PER_PAGE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.folder = tempfile.mkdtemp(dir='.')
+        export_site(journal.app, self.folder, journal.SITE_URL)
+
+    def edit_title(self, post_date, title):
+        conn = journal.open_db_connection()
+        conn.execute('UPDATE posts SET title = ? WHERE post_date = ?', (title, post_date))
+        conn.commit()
+        conn.close()
+        journal.invalidate_cached_post([post_date])
+
+    def read(self, name):
+        with open(os.path.join(self.folder, name), encoding='utf-8') as f:
+            return f.read()
+
+    def index_pages_showing(self, title):
+        pages = [
+            os.path.join('index', filename) for filename in os.listdir(os.path.join(self.folder, 'index'))
+        ] + ['index.html']
+        return {name for name in pages if title in self.read(name)}
+
+    def test_edit_exports_only_the_pages_showing_the_post(self):
+        # pages are addressed by cursors from either end, so a post is on a few
+        showing = self.index_pages_showing('exported day 3')
+        self.assertTrue(showing)
+        self.edit_title('1998-01-03', 'an edited title')
+        exporter = export_changes(
+            journal.app, self.folder, journal.SITE_URL, ['1998-01-03'], totals_changed=False
+        )
+
+        self.assertEqual(self.index_pages_showing('an edited title'), showing)
+        self.assertFalse(self.index_pages_showing('exported day 3'))
+        self.assertLessEqual(showing, exporter.exported)
+        self.assertNotIn('index.html', exporter.exported)
+        self.assertIn('an edited title', self.read(os.path.join('post', '1998-01-03.html')))
+
+        self.assertIn('an edited title', self.read(os.path.join('archive', '1998', '01.html')))
+        self.assertIn(os.path.join('archive', '1998.html'), exporter.exported)
+        self.assertNotIn(os.path.join('archive', '2024.html'), exporter.exported)
+
+    def test_new_post_exports_the_whole_index(self):
+        showing = self.index_pages_showing('exported day 4')
+        self.edit_title('1998-01-04', 'another edited title')
+        exporter = export_changes(
+            journal.app, self.folder, journal.SITE_URL, ['1998-01-04'], totals_changed=True
+        )
+        self.assertIn('index.html', exporter.exported)
+        self.assertEqual(self.index_pages_showing('another edited title'), showing)
+        self.assertFalse(self.index_pages_showing('exported day 4'))
+
+
+if __name__ == '__main__':
+    unittest.main()
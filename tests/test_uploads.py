@@ -0,0 +1,77 @@
+"""
+uploads are spooled into the pending folder while the request is parsed and
+then renamed into place, so storing one writes nothing beyond the spool.
+"""
+
+import io
+import os
+import unittest
+
+import app as journal
+
+
+UPLOAD_SIZE = 4 * 1024 * 1024
+
+
+def write_bytes():
+    """bytes this process has passed to write() so far (linux only)"""
+    with open('/proc/self/io') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key == 'wchar':
+                return int(value)
+    raise OSError('no wchar in /proc/self/io')
+
+
+class UploadSpoolTest(unittest.TestCase):
+    def upload_request(self):
+        data = os.urandom(UPLOAD_SIZE)
+        context = journal.app.test_request_context(
+            '/create', method='POST', content_type='multipart/form-data',
+            data={'image_1': (io.BytesIO(data), 'photo.jpg'), 'alt_text_1': 'a photo'}
+        )
+        return context, data
+
+    def test_upload_is_renamed_into_pending_folder(self):
+        context, data = self.upload_request()
+        with context:
+            file = journal.request.files['image_1']  # parses the body, spooling the file
+            spool_path = file.stream.name
+            self.assertEqual(os.path.dirname(spool_path), os.path.abspath(journal.PENDING_FOLDER))
+            spool_inode = os.stat(spool_path).st_ino
+
+            [(filename, alt_text, sort_order)] = journal.store_uploaded_images(journal.request, '2024-01-01')
+
+            stored_path = os.path.join(journal.PENDING_FOLDER, filename)
+            self.addCleanup(os.remove, stored_path)
+            # the same file, moved rather than copied
+            self.assertEqual(os.stat(stored_path).st_ino, spool_inode)
+            self.assertFalse(os.path.exists(spool_path))
+            with open(stored_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            self.assertEqual(alt_text, 'a photo')
+            self.assertEqual(sort_order, 0)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/io'), 'needs /proc/self/io')
+    def test_storing_an_upload_writes_no_data(self):
+        context, _ = self.upload_request()
+        with context:
+            journal.request.files  # spool the upload first
+            before = write_bytes()
+            [(filename, _, _)] = journal.store_uploaded_images(journal.request, '2024-01-01')
+            written = write_bytes() - before
+            self.addCleanup(os.remove, os.path.join(journal.PENDING_FOLDER, filename))
+        # copying would write the whole upload again
+        self.assertLess(written, UPLOAD_SIZE // 100)
+
+    def test_unused_spool_is_removed(self):
+        context, _ = self.upload_request()
+        with context:
+            spool_path = journal.request.files['image_1'].stream.name
+            self.assertTrue(os.path.exists(spool_path))
+        # the request ended without storing the upload
+        self.assertFalse(os.path.exists(spool_path))
+
+
+if __name__ == '__main__':
+    unittest.main()